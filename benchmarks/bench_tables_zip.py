@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Time making the tables and zipping the results on synthetic subjects
+
+For each size (subjects x time points) a SUBJECTS_DIR is written with
+synthetic.py where the gear would have it, output/<analysis id>/<project>/,
+and then what the gear does at the end of a run is timed:
+
+    tables   freesurfer_tables.pl on the longitudinal directories
+    zip      utils.results.zip_output.zip_output(), deleting what it zipped
+
+Each result is added to a JSON lines history file with the time, the git
+revision and the host, and compared with the last result of the same size
+and scale there, so a change in throughput shows up from one run to the
+next.  Run it in the gear's image, as freesurfer_tables.pl needs
+asegstats2table and aparcstats2table, e.g.
+
+    docker run --rm -v $PWD:/flywheel/v0 --entrypoint python3 IMAGE \\
+        /flywheel/v0/benchmarks/bench_tables_zip.py --sizes 1x3,4x3,16x3 \\
+        --history /flywheel/v0/output/tables_zip.jsonl
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import synthetic
+
+sys.path.insert(0, synthetic.REPO)
+from utils.results.zip_output import zip_output  # noqa: E402
+
+
+ANALYSIS_ID = 'benchmark'
+PROJECT = 'Benchmark'
+TABLES = os.path.join(synthetic.REPO, 'freesurfer_tables.pl')
+
+
+def git_revision():
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=synthetic.REPO,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_context(output_dir):
+    """What zip_output() needs of the gear's context"""
+
+    return types.SimpleNamespace(
+        output_dir=output_dir,
+        destination={'id': ANALYSIS_ID},
+        manifest_json={'name': 'grp-14'},
+        gear_dict={'run_level': 'project', 'project_label_safe': PROJECT})
+
+
+def run_one(subjects, timepoints, args, templates):
+    """Generate, tabulate and zip one SUBJECTS_DIR
+
+    Returns:
+        result (dict): sizes, seconds and throughput of each part
+    """
+
+    root = tempfile.mkdtemp(prefix='grp14_tables_zip_', dir=args.work)
+    cwd = os.getcwd()
+    try:
+        output_dir = os.path.join(root, 'output')
+        subjects_dir = os.path.join(output_dir, ANALYSIS_ID, PROJECT)
+
+        start = time.time()
+        summary = synthetic.generate(
+            subjects_dir, subjects, timepoints, args.scale, args.seed,
+            cross=not args.long_only, base=not args.long_only,
+            templates=templates)
+        result = {'subjects': subjects, 'timepoints': timepoints,
+                  'scale': args.scale, 'directories': summary['directories'],
+                  'files': summary['files'],
+                  'mb': round(summary['bytes'] / synthetic.MB, 1),
+                  'generate': time.time() - start}
+
+        # like the gear: in SUBJECTS_DIR, on "."
+        os.chdir(subjects_dir)
+        start = time.time()
+        with open(os.path.join(root, 'tables.log'), 'w') as log:
+            result['tables_return_code'] = subprocess.call(
+                [TABLES, '.'], stdout=log, stderr=subprocess.STDOUT)
+        result['tables'] = time.time() - start
+        result['tables_per_second'] = len(summary['long_dirs']) / \
+            result['tables']
+
+        start = time.time()
+        dest_zip = zip_output(make_context(output_dir), remove=True)
+        result['zip'] = time.time() - start
+        result['zip_mb'] = round(os.path.getsize(dest_zip) /
+                                 synthetic.MB, 1)
+        result['zip_mb_per_second'] = result['mb'] / result['zip']
+        result['zip_files_per_second'] = result['files'] / result['zip']
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def last_results(history):
+    """The latest result of each size and scale in the history file"""
+
+    last = {}
+    if history and os.path.exists(history):
+        with open(history, 'r') as fh:
+            for line in fh:
+                if line.strip():
+                    rr = json.loads(line)
+                    last[(rr['subjects'], rr['timepoints'], rr['scale'],
+                          rr.get('long_only', False))] = rr
+    return last
+
+
+COLUMNS = ['subjects', 'timepoints', 'files', 'mb', 'generate', 'tables',
+           'tables_per_second', 'zip', 'zip_mb_per_second',
+           'zip_files_per_second']
+COMPARED = ['tables_per_second', 'zip_mb_per_second', 'zip_files_per_second']
+
+
+def print_header():
+
+    print('  '.join('{:>12}'.format(cc[:12]) for cc in COLUMNS))
+
+
+def print_result(result, previous):
+
+    print('  '.join('{:>12.2f}'.format(result[cc])
+                    if isinstance(result.get(cc), float)
+                    else '{:>12}'.format(str(result.get(cc, '')))
+                    for cc in COLUMNS))
+    if result['tables_return_code'] != 0:
+        print('    freesurfer_tables.pl returned ' +
+              str(result['tables_return_code']))
+    if previous:
+        print('    since ' + previous['time'] + ' (' +
+              str(previous.get('revision')) + '): ' + ', '.join(
+                  '{} {:+.0%}'.format(cc, result[cc] / previous[cc] - 1)
+                  for cc in COMPARED if previous.get(cc)))
+    sys.stdout.flush()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1x3,4x3,8x4',
+                        help='sizes as SUBJECTSxTIMEPOINTS, comma separated')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs of each size')
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help='size of the files compared to a real run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--long-only', action='store_true',
+                        help='only write the longitudinal directories, as '
+                             'the gear leaves them with the cross-sectional '
+                             'and template ones pruned')
+    parser.add_argument('--work', help='where to write the subjects '
+                                       '(default: the temporary directory)')
+    parser.add_argument('--history', default='tables_zip_history.jsonl',
+                        help='JSON lines file the results are added to')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(nn) for nn in size.split('x'))
+             for size in args.sizes.split(',')]
+    templates = synthetic.load_templates()
+    last = last_results(args.history)
+    stamp = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'revision': git_revision(), 'host': socket.gethostname(),
+             'long_only': args.long_only}
+
+    print_header()
+    for subjects, timepoints in sizes:
+        for _ in range(args.repeat):
+            result = run_one(subjects, timepoints, args, templates)
+            result.update(stamp)
+            key = (subjects, timepoints, args.scale, args.long_only)
+            print_result(result, last.get(key))
+            if args.history:
+                with open(args.history, 'a') as fh:
+                    fh.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,186 @@
+"""A stand-in for the Flywheel SDK so run.py can be benchmarked offline
+
+benchmarks/run_benchmarks.py puts this directory first on PYTHONPATH, so
+"import flywheel" in run.py gets this module.  It serves one synthetic
+subject described by the JSON file named in $BENCH_SUBJECT:
+
+    {"config": {gear config},
+     "destination": "analysis id",
+     "latency": seconds each API call takes,
+     "bandwidth": bytes per second for downloads,
+     "subject": {"code": "...",
+                 "sessions": [{"label": "...",
+                               "acquisitions": [{"label": "...",
+                                                 "files": [{"name", "path",
+                                                            "type",
+                                                            "measurement",
+                                                            "hash"}]}]}]}}
+
+Only what the gear uses is here.  Uploads are copied to $BENCH_UPLOAD_DIR
+if it is set.
+"""
+
+import datetime
+import json
+import os
+import shutil
+import time
+
+
+class ApiException(Exception):
+    pass
+
+
+class Entity(dict):
+    """A container or file, with its fields as attributes"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class _Api:
+    """Latency of the simulated server"""
+
+    latency = 0.0
+    bandwidth = None
+    calls = 0
+
+    @classmethod
+    def call(cls, size=0):
+        cls.calls += 1
+        delay = cls.latency
+        if size and cls.bandwidth:
+            delay += size / cls.bandwidth
+        if delay:
+            time.sleep(delay)
+
+
+class Container(Entity):
+
+    def update_info(self, info):
+        _Api.call()
+        self.setdefault('info', {}).update(info)
+
+    def sessions(self):
+        _Api.call()
+        return self['_sessions']
+
+    def acquisitions(self):
+        _Api.call()
+        return self['_acquisitions']
+
+    def reload(self):
+        _Api.call()
+        return self
+
+    def download_file(self, name, path):
+        source = self['_paths'][name]
+        _Api.call(os.path.getsize(source))
+        shutil.copy(source, path)
+
+    def upload_file(self, path):
+        _Api.call(os.path.getsize(path))
+        self['_paths'][os.path.basename(path)] = path
+
+    def update_file_info(self, name, info):
+        _Api.call()
+
+
+class Client:
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, container_id):
+        _Api.call()
+        return self._store[container_id]
+
+    def get_analysis(self, analysis_id):
+        return self.get(analysis_id)
+
+    def get_project(self, project_id):
+        return self.get(project_id)
+
+    def get_session_acquisitions(self, session_id):
+        return self.get(session_id)['_acquisitions']
+
+    def get_session_analyses(self, session_id):
+        _Api.call()
+        return []
+
+    def get_acquisition_file_info(self, acquisition_id, name):
+        _Api.call()
+        return Entity(info={'MagneticFieldStrength': 3.0})
+
+    def upload_output_to_analysis(self, analysis_id, path):
+        _Api.call(os.path.getsize(path))
+        directory = os.environ.get('BENCH_UPLOAD_DIR')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            shutil.copy(path, directory)
+
+
+class GearContext:
+    """Like flywheel.GearContext, run in the current directory"""
+
+    def __init__(self):
+
+        with open(os.environ['BENCH_SUBJECT'], 'r') as fh:
+            bench = json.load(fh)
+        _Api.latency = bench.get('latency', 0.0)
+        _Api.bandwidth = bench.get('bandwidth')
+
+        self.config = bench['config']
+        self.destination = {'id': bench.get('destination', 'benchmark')}
+        self.output_dir = os.path.abspath('output')
+        self.work_dir = os.path.abspath('work')
+        os.makedirs(self.output_dir, exist_ok=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.client = Client(_build(bench['subject'], self.destination['id']))
+
+    def get_input_path(self, name):
+        return None
+
+    def log_config(self):
+        pass
+
+
+def _build(subject, analysis_id):
+    """The containers of the subject, by id"""
+
+    store = {}
+    project = Container(id='project', label='Benchmark', info={})
+    subj = Container(id='subject', code=subject['code'], info={},
+                     _sessions=[], files=[], _paths={})
+    store[analysis_id] = Container(
+        id=analysis_id, info={}, parent=Entity(type='subject'),
+        parents=Entity(project='project', subject='subject', session=None))
+    store['project'] = project
+    store['subject'] = subj
+
+    start = datetime.datetime(2010, 1, 1)
+    for ss, session in enumerate(subject['sessions']):
+        ses = Container(id='session' + str(ss), label=session['label'],
+                        _acquisitions=[])
+        for aa, acquisition in enumerate(session['acquisitions']):
+            files = [Entity(name=ff['name'], type=ff.get('type', 'nifti'),
+                            classification={'Measurement':
+                                            [ff.get('measurement', 'T1')]},
+                            hash=ff.get('hash'))
+                     for ff in acquisition['files']]
+            acq = Container(id='acquisition' + str(ss) + '_' + str(aa),
+                            label=acquisition['label'],
+                            timestamp=start + datetime.timedelta(days=180 * ss,
+                                                                 minutes=aa),
+                            timezone=None, original_timestamp=None,
+                            files=files,
+                            _paths={ff['name']: ff['path']
+                                    for ff in acquisition['files']})
+            ses['_acquisitions'].append(acq)
+            store[acq.id] = acq
+        subj['_sessions'].append(ses)
+        store[ses.id] = ses
+    return store
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Time the gear's orchestration on synthetic subjects
+
+run.py is run as it is, but "flywheel" is the mock in this directory and
+"recon-all" is the fake in bin/, so no FreeSurfer compute is spent.  For each
+subject size (sessions x acquisitions) it reports the time spent finding
+the files, downloading them, scheduling recon-all (the time in each step
+when no recon-all was running), making the tables and zipping, read from
+the gear's trace (config "trace").
+
+Run it in the gear's image with this repository at /flywheel/v0, e.g.
+
+    docker run --rm -v $PWD:/flywheel/v0 --entrypoint python3 IMAGE \\
+        /flywheel/v0/benchmarks/run_benchmarks.py --sizes 3x2,6x4,10x6
+
+/tmp/gear_environ.json is changed while a benchmark runs (to put bin/ on
+PATH) and put back afterwards.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+GEAR_ENVIRON = '/tmp/gear_environ.json'
+STEPS = ['cross-sectional', 'base', 'longitudinal']
+
+# Acquisitions after the first in each session are not T1, so the gear
+# looks at them but does not download them
+OTHER_MEASUREMENTS = ['T2', 'Diffusion', 'Functional', 'Localizer']
+
+
+def make_nifti(path, data_bytes, dims=(256, 256, 176), voxel=(1.0, 1.0, 1.2)):
+    """Write a NIfTI-1 .nii.gz with a T1 like header and random data"""
+
+    header = bytearray(352)
+    struct.pack_into('<i', header, 0, 348)
+    struct.pack_into('<8h', header, 40, 3, dims[0], dims[1], dims[2],
+                     1, 1, 1, 1)
+    struct.pack_into('<hh', header, 70, 2, 8)  # uint8
+    struct.pack_into('<8f', header, 76, 1, voxel[0], voxel[1], voxel[2],
+                     0, 0, 0, 0)
+    struct.pack_into('<f', header, 108, 352)
+    header[148:163] = b'synthetic 3T T1'
+    struct.pack_into('<2h', header, 252, 1, 0)  # qform_code, sform_code
+    struct.pack_into('<6f', header, 256, 0, 0, 0, 0, 0, 0)
+    header[344:348] = b'n+1\0'
+    with gzip.open(path, 'wb', compresslevel=1) as fh:
+        fh.write(bytes(header))
+        fh.write(os.urandom(data_bytes))
+
+
+def make_subject(root, sessions, acquisitions, nifti_mb):
+    """Input files and the description of a subject for the mock client"""
+
+    inputs = os.path.join(root, 'inputs')
+    os.makedirs(inputs)
+    subject = {'code': 'bench_{}x{}'.format(sessions, acquisitions),
+               'sessions': []}
+    for ss in range(sessions):
+        session = {'label': 'visit_{:02d}'.format(ss + 1),
+                   'acquisitions': []}
+        for aa in range(acquisitions):
+            name = 'ses{}_acq{}.nii.gz'.format(ss + 1, aa + 1)
+            path = os.path.join(inputs, name)
+            if aa == 0:
+                make_nifti(path, int(nifti_mb * 2 ** 20))
+                measurement = 'T1'
+                label = 'T1w_MPRAGE'
+            else:
+                make_nifti(path, 1024)
+                measurement = OTHER_MEASUREMENTS[
+                    (aa - 1) % len(OTHER_MEASUREMENTS)]
+                label = measurement + '_' + str(aa)
+            session['acquisitions'].append(
+                {'label': label,
+                 'files': [{'name': name, 'path': path,
+                            'measurement': measurement,
+                            'hash': 'hash_{}_{}'.format(ss, aa)}]})
+        subject['sessions'].append(session)
+    return subject
+
+
+def extract_stats(work):
+    """Stats files of a real longitudinal run, from the gear's dry run
+    data, for the fake recon-all to copy"""
+
+    dest = os.path.join(work, 'stats')
+    os.makedirs(dest)
+    with tarfile.open(os.path.join(REPO, 'dry_run_data.tgz'), 'r:gz') as tar:
+        members = [mm for mm in tar.getmembers()
+                   if '/stats/' in mm.name and mm.isfile() and
+                   not os.path.basename(mm.name).startswith('._')]
+        first = os.path.dirname(members[0].name)
+        for member in members:
+            if os.path.dirname(member.name) == first:
+                with tar.extractfile(member) as src, \
+                        open(os.path.join(dest, os.path.basename(
+                            member.name)), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+    return dest
+
+
+def phase_times(trace_path):
+    """Seconds spent in each phase, from the gear's trace"""
+
+    with open(trace_path, 'r') as fh:
+        spans = [json.loads(line) for line in fh if line.strip()]
+
+    def total(name):
+        return sum(ss['duration_seconds'] for ss in spans
+                   if ss['name'] == name)
+
+    times = {'discovery': total('discovery'),
+             'download': total('download'),
+             'downloads': len([ss for ss in spans
+                               if ss['name'] == 'download']),
+             'tables': total('tables'),
+             'zip': total('zip'),
+             'cleanup': total('cleanup'),
+             'gear': total('gear')}
+
+    # scheduling: time in a step when none of its recon-all runs were going
+    idle = 0.0
+    for step in [ss for ss in spans if ss['name'] in STEPS]:
+        runs = sorted((ss['start_time'], ss['end_time']) for ss in spans
+                      if ss['name'] == 'recon-all' and
+                      ss['parent_id'] == step['span_id'])
+        busy = 0.0
+        end = step['start_time']
+        for run_start, run_end in runs:
+            run_start = max(run_start, end)
+            if run_end > run_start:
+                busy += run_end - run_start
+                end = run_end
+        idle += step['duration_seconds'] - busy
+    times['scheduling'] = idle
+    return times
+
+
+def run_one(sessions, acquisitions, args, stats_dir, environ):
+    """Run the gear on one synthetic subject
+
+    Returns:
+        result (dict): the size, phase times and return code
+    """
+
+    root = tempfile.mkdtemp(prefix='grp14_bench_')
+    try:
+        subject = make_subject(root, sessions, acquisitions, args.nifti_mb)
+        config = {'gear-dry-run': False, 'gear-zip-output': True,
+                  'remove_subjects_dir': True, 'gear-log-level': 'INFO',
+                  'gear-FREESURFER_LICENSE': 'benchmark', 'trace': True}
+        config.update(json.loads(args.config))
+        destination = 'bench{}x{}'.format(sessions, acquisitions)
+        with open(os.path.join(root, 'subject.json'), 'w') as fh:
+            json.dump({'config': config, 'destination': destination,
+                       'latency': args.latency,
+                       'bandwidth': args.bandwidth_mb * 2 ** 20,
+                       'subject': subject}, fh)
+
+        env = dict(os.environ)
+        env.update({'PYTHONPATH': HERE,
+                    'BENCH_SUBJECT': os.path.join(root, 'subject.json')})
+        # the gear runs recon-all with this environment
+        environ = dict(environ)
+        environ.update({'BENCH_STATS_DIR': stats_dir,
+                        'BENCH_SLEEP_SECONDS': str(args.sleep),
+                        'BENCH_CPU_SECONDS': str(args.cpu_seconds),
+                        'BENCH_MRI_MB': str(args.mri_mb),
+                        'BENCH_SMALL_FILES': str(args.small_files)})
+        with open(GEAR_ENVIRON, 'w') as fh:
+            json.dump(environ, fh)
+
+        start = time.time()
+        with open(os.path.join(root, 'gear.log'), 'w') as log:
+            return_code = subprocess.call(
+                [sys.executable, os.path.join(REPO, 'run.py')], cwd=root,
+                env=env, stdout=log, stderr=subprocess.STDOUT)
+        wall = time.time() - start
+
+        with open(os.path.join(REPO, 'manifest.json'), 'r') as fh:
+            gear_name = json.load(fh)['name']
+        trace = os.path.join(root, 'output', gear_name + '_trace_' +
+                             destination + '.jsonl')
+        result = {'sessions': sessions, 'acquisitions': acquisitions,
+                  'return_code': return_code, 'wall': wall}
+        if os.path.exists(trace):
+            result.update(phase_times(trace))
+        if return_code != 0:
+            result['log'] = os.path.join(root, 'gear.log')
+            args.keep = True
+        return result
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print('Kept ' + root)
+
+
+COLUMNS = ['sessions', 'acquisitions', 'return_code', 'wall', 'discovery',
+           'download', 'downloads', 'scheduling', 'tables', 'zip', 'cleanup']
+
+
+def print_header():
+
+    print('  '.join('{:>12}'.format(cc) for cc in COLUMNS))
+
+
+def print_result(result):
+
+    print('  '.join('{:>12.2f}'.format(result[cc])
+                    if isinstance(result.get(cc), float)
+                    else '{:>12}'.format(str(result.get(cc, '')))
+                    for cc in COLUMNS))
+    sys.stdout.flush()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='2x1,4x3,8x6',
+                        help='subject sizes as SESSIONSxACQUISITIONS, comma '
+                             'separated')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs of each size')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds each Flywheel API call takes')
+    parser.add_argument('--bandwidth-mb', type=float, default=100,
+                        help='download speed in MB/s')
+    parser.add_argument('--nifti-mb', type=float, default=8,
+                        help='size of each T1 input')
+    parser.add_argument('--sleep', type=float, default=2,
+                        help='wall seconds of each fake recon-all')
+    parser.add_argument('--cpu-seconds', type=float, default=0,
+                        help='CPU seconds of each fake recon-all')
+    parser.add_argument('--mri-mb', type=float, default=4,
+                        help='size of the mri/ volumes each run makes')
+    parser.add_argument('--small-files', type=int, default=200,
+                        help='small files each run makes')
+    parser.add_argument('--config', default='{}',
+                        help='gear config as JSON, e.g. '
+                             '\'{"n_concurrent_timepoints": 2}\'')
+    parser.add_argument('--json', help='also save the results here')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the directories the gear ran in')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(nn) for nn in size.split('x'))
+             for size in args.sizes.split(',')]
+
+    with open(GEAR_ENVIRON, 'r') as fh:
+        saved_environ = fh.read()
+    environ = json.loads(saved_environ)
+    environ['PATH'] = os.path.join(HERE, 'bin') + ':' + environ['PATH']
+
+    work = tempfile.mkdtemp(prefix='grp14_bench_stats_')
+    results = []
+    try:
+        stats_dir = extract_stats(work)
+        print_header()
+        for sessions, acquisitions in sizes:
+            for _ in range(args.repeat):
+                result = run_one(sessions, acquisitions, args, stats_dir,
+                                 environ)
+                results.append(result)
+                print_result(result)
+    finally:
+        with open(GEAR_ENVIRON, 'w') as fh:
+            fh.write(saved_environ)
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""Write synthetic FreeSurfer subject directories
+
+Makes a SUBJECTS_DIR like the gear leaves behind for any number of subjects
+and time points: a cross-sectional directory for each time point
+(SUBJECT-VISIT), a template (BASE) and the longitudinal directories
+(SUBJECT-VISIT.long.BASE).  The gear only ever has one subject, so with more
+than one the templates are called SUBJECT_BASE, but the longitudinal
+directories keep the names freesurfer_tables.pl expects.  Each has
+
+  - stats/aseg.stats, wmparc.stats and ?h.*.stats of aparc, aparc.a2009s,
+    aparc.DKTatlas, BA_exvivo and BA_exvivo.thresh in the format FreeSurfer
+    6 writes, made from the dry run data with the values changed: each
+    subject gets its own head size and cortical thickness and each time
+    point a little atrophy and noise, so the tables differ from row to row
+  - mri/, surf/, label/, scripts/ and touch/ with the files recon-all -all
+    makes, of about the sizes it makes them for a 1 mm brain (see LAYOUT).
+    Volumes and annotations are random, as gzipped data does not compress
+    any further, surfaces are half random and labels and logs are text, so
+    zipping them costs about what it does for real data.
+
+For example, 3 subjects with 4 time points at a tenth of the real size:
+
+    python3 benchmarks/synthetic.py /tmp/subjects --subjects 3 \\
+        --timepoints 4 --scale 0.1
+"""
+
+import argparse
+import os
+import random
+import re
+import tarfile
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+MB = 2 ** 20
+KB = 2 ** 10
+
+# (path, bytes, kind) of the files of one cross-sectional recon-all -all run
+# with FreeSurfer 6.  "{h}" is repeated for lh and rh.  kind is how the
+# contents are made: "gz" random, "bin" half random, "text" label or log lines.
+LAYOUT = [
+    ('mri/orig/001.mgz', 8 * MB, 'gz'),
+    ('mri/rawavg.mgz', 8 * MB, 'gz'),
+    ('mri/orig.mgz', 3.5 * MB, 'gz'),
+    ('mri/orig_nu.mgz', 3.3 * MB, 'gz'),
+    ('mri/nu.mgz', 3.3 * MB, 'gz'),
+    ('mri/T1.mgz', 2.8 * MB, 'gz'),
+    ('mri/brainmask.auto.mgz', 1.4 * MB, 'gz'),
+    ('mri/brainmask.mgz', 1.4 * MB, 'gz'),
+    ('mri/brain.mgz', 1.3 * MB, 'gz'),
+    ('mri/brain.finalsurfs.mgz', 1.3 * MB, 'gz'),
+    ('mri/norm.mgz', 1.3 * MB, 'gz'),
+    ('mri/aseg.auto_noCCseg.mgz', 350 * KB, 'gz'),
+    ('mri/aseg.auto.mgz', 350 * KB, 'gz'),
+    ('mri/aseg.presurf.mgz', 350 * KB, 'gz'),
+    ('mri/aseg.presurf.hypos.mgz', 350 * KB, 'gz'),
+    ('mri/aseg.mgz', 360 * KB, 'gz'),
+    ('mri/aparc+aseg.mgz', 520 * KB, 'gz'),
+    ('mri/aparc.a2009s+aseg.mgz', 560 * KB, 'gz'),
+    ('mri/aparc.DKTatlas+aseg.mgz', 510 * KB, 'gz'),
+    ('mri/wmparc.mgz', 640 * KB, 'gz'),
+    ('mri/wm.seg.mgz', 200 * KB, 'gz'),
+    ('mri/wm.asegedit.mgz', 200 * KB, 'gz'),
+    ('mri/wm.mgz', 210 * KB, 'gz'),
+    ('mri/filled.mgz', 150 * KB, 'gz'),
+    ('mri/ribbon.mgz', 200 * KB, 'gz'),
+    ('mri/{h}.ribbon.mgz', 110 * KB, 'gz'),
+    ('mri/segment.dat', 1 * KB, 'text'),
+    ('mri/talairach.log', 4 * KB, 'text'),
+    ('mri/talairach.label_intensities.txt', 60 * KB, 'text'),
+    ('mri/transforms/talairach.auto.xfm', 1 * KB, 'text'),
+    ('mri/transforms/talairach.xfm', 1 * KB, 'text'),
+    ('mri/transforms/talairach.lta', 2 * KB, 'text'),
+    ('mri/transforms/talairach_with_skull.lta', 2 * KB, 'text'),
+    ('mri/transforms/cc_up.lta', 2 * KB, 'text'),
+    ('mri/transforms/talairach.m3z', 45 * MB, 'gz'),
+    ('surf/{h}.orig.nofix', 4 * MB, 'bin'),
+    ('surf/{h}.smoothwm.nofix', 4 * MB, 'bin'),
+    ('surf/{h}.inflated.nofix', 4 * MB, 'bin'),
+    ('surf/{h}.qsphere.nofix', 4 * MB, 'bin'),
+    ('surf/{h}.orig', 5 * MB, 'bin'),
+    ('surf/{h}.smoothwm', 5 * MB, 'bin'),
+    ('surf/{h}.inflated', 5 * MB, 'bin'),
+    ('surf/{h}.white.preaparc', 5 * MB, 'bin'),
+    ('surf/{h}.white', 5 * MB, 'bin'),
+    ('surf/{h}.pial', 5 * MB, 'bin'),
+    ('surf/{h}.sphere', 5 * MB, 'bin'),
+    ('surf/{h}.sphere.reg', 5 * MB, 'bin'),
+    ('surf/{h}.defect_labels', 560 * KB, 'bin'),
+    ('surf/{h}.defect_borders', 560 * KB, 'bin'),
+    ('surf/{h}.defect_chull', 560 * KB, 'bin'),
+    ('surf/{h}.curv', 560 * KB, 'bin'),
+    ('surf/{h}.curv.pial', 560 * KB, 'bin'),
+    ('surf/{h}.area', 560 * KB, 'bin'),
+    ('surf/{h}.area.mid', 560 * KB, 'bin'),
+    ('surf/{h}.area.pial', 560 * KB, 'bin'),
+    ('surf/{h}.thickness', 560 * KB, 'bin'),
+    ('surf/{h}.volume', 560 * KB, 'bin'),
+    ('surf/{h}.sulc', 560 * KB, 'bin'),
+    ('surf/{h}.jacobian_white', 560 * KB, 'bin'),
+    ('surf/{h}.avg_curv', 560 * KB, 'bin'),
+    ('surf/{h}.inflated.H', 560 * KB, 'bin'),
+    ('surf/{h}.inflated.K', 560 * KB, 'bin'),
+    ('surf/{h}.w-g.pct.mgh', 580 * KB, 'bin'),
+    ('label/{h}.cortex.label', 4 * MB, 'text'),
+    ('label/{h}.aparc.annot', 570 * KB, 'gz'),
+    ('label/{h}.aparc.a2009s.annot', 580 * KB, 'gz'),
+    ('label/{h}.aparc.DKTatlas.annot', 570 * KB, 'gz'),
+    ('label/{h}.BA_exvivo.annot', 560 * KB, 'gz'),
+    ('label/{h}.BA_exvivo.thresh.annot', 560 * KB, 'gz'),
+    ('label/aparc.annot.a2009s.ctab', 8 * KB, 'text'),
+    ('label/aparc.annot.ctab', 2 * KB, 'text'),
+    ('label/aparc.annot.DKTatlas.ctab', 2 * KB, 'text'),
+    ('label/BA_exvivo.ctab', 1 * KB, 'text'),
+    ('label/BA_exvivo.thresh.ctab', 1 * KB, 'text'),
+    ('scripts/recon-all.log', 2 * MB, 'text'),
+    ('scripts/recon-all-status.log', 6 * KB, 'text'),
+    ('scripts/recon-all.env', 4 * KB, 'text'),
+    ('scripts/recon-all.cmd', 90 * KB, 'text'),
+    ('scripts/recon-all.local-copy', 140 * KB, 'text'),
+    ('scripts/build-stamp.txt', 1 * KB, 'text'),
+    ('scripts/lastcall.build-stamp.txt', 1 * KB, 'text'),
+    ('scripts/ponscc.cut.log', 1 * KB, 'text'),
+    ('scripts/pctsurfcon.log', 8 * KB, 'text'),
+    ('scripts/defect2seg.log', 3 * KB, 'text'),
+    ('scripts/patchdir.txt', 1 * KB, 'text'),
+] + [('label/{h}.' + area + '_exvivo' + thresh + '.label', size, 'text')
+     for area, size in (('BA1', 280 * KB), ('BA2', 480 * KB),
+                        ('BA3a', 140 * KB), ('BA3b', 360 * KB),
+                        ('BA4a', 380 * KB), ('BA4p', 300 * KB),
+                        ('BA6', 1.6 * MB), ('BA44', 380 * KB),
+                        ('BA45', 380 * KB), ('V1', 900 * KB),
+                        ('V2', 1.7 * MB), ('MT', 300 * KB),
+                        ('perirhinal', 200 * KB), ('entorhinal', 120 * KB))
+     for thresh in ('', '.thresh')]
+
+# recon-all keeps an empty file in touch/ for each stage it has done
+TOUCH = ['conform', 'talairach', 'nu', 'inorm1', 'skull.mgz_strip',
+         'em_register', 'ca_normalize', 'ca_register', 'asegmerge',
+         'inorm2', 'wmsegment', 'fill', 'ribbon', 'relabelhypos',
+         'aparc2aseg', 'segstats', 'wmaparc'] + \
+    ['{h}.' + stage for stage in
+     ('tessellate', 'smoothwm1', 'inflate1', 'qsphere', 'topofix',
+      'white_surface', 'smoothwm2', 'inflate2', 'inflate2_curv', 'sphmorph',
+      'sphreg', 'jacobian_white', 'avgcurv', 'aparc', 'pial_surface',
+      'aparcstats', 'aparc2', 'aparc.a2009s', 'BA_exvivo')]
+
+EMPTY_DIRS = ['bem', 'tmp', 'trash']
+
+# columns (and Measure units) that grow with the size of the head, and ones
+# that go with the thickness of the cortex.  Others get a little noise, the
+# Index and SegId columns are kept.
+SIZE_COLUMNS = {'NVoxels', 'Volume_mm3', 'NumVert', 'SurfArea', 'GrayVol'}
+THICKNESS_COLUMNS = {'ThickAvg'}
+KEPT_COLUMNS = {'Index', 'SegId'}
+
+_NUMBER = re.compile(r'^-?\d+(\.\d+)?$')
+
+# The dry run data only has aseg and aparc stats, the others are made from
+# them with these structures
+DESTRIEUX = [
+    'G_and_S_frontomargin', 'G_and_S_occipital_inf', 'G_and_S_paracentral',
+    'G_and_S_subcentral', 'G_and_S_transv_frontopol', 'G_and_S_cingul-Ant',
+    'G_and_S_cingul-Mid-Ant', 'G_and_S_cingul-Mid-Post',
+    'G_cingul-Post-dorsal', 'G_cingul-Post-ventral', 'G_cuneus',
+    'G_front_inf-Opercular', 'G_front_inf-Orbital', 'G_front_inf-Triangul',
+    'G_front_middle', 'G_front_sup', 'G_Ins_lg_and_S_cent_ins',
+    'G_insular_short', 'G_occipital_middle', 'G_occipital_sup',
+    'G_oc-temp_lat-fusifor', 'G_oc-temp_med-Lingual',
+    'G_oc-temp_med-Parahip', 'G_orbital', 'G_pariet_inf-Angular',
+    'G_pariet_inf-Supramar', 'G_parietal_sup', 'G_postcentral',
+    'G_precentral', 'G_precuneus', 'G_rectus', 'G_subcallosal',
+    'G_temp_sup-G_T_transv', 'G_temp_sup-Lateral', 'G_temp_sup-Plan_polar',
+    'G_temp_sup-Plan_tempo', 'G_temporal_inf', 'G_temporal_middle',
+    'Lat_Fis-ant-Horizont', 'Lat_Fis-ant-Vertical', 'Lat_Fis-post',
+    'Pole_occipital', 'Pole_temporal', 'S_calcarine', 'S_central',
+    'S_cingul-Marginalis', 'S_circular_insula_ant', 'S_circular_insula_inf',
+    'S_circular_insula_sup', 'S_collat_transv_ant', 'S_collat_transv_post',
+    'S_front_inf', 'S_front_middle', 'S_front_sup', 'S_interm_prim-Jensen',
+    'S_intrapariet_and_P_trans', 'S_oc_middle_and_Lunatus',
+    'S_oc_sup_and_transversal', 'S_occipital_ant', 'S_oc-temp_lat',
+    'S_oc-temp_med_and_Lingual', 'S_orbital_lateral', 'S_orbital_med-olfact',
+    'S_orbital-H_Shaped', 'S_parieto_occipital', 'S_pericallosal',
+    'S_postcentral', 'S_precentral-inf-part', 'S_precentral-sup-part',
+    'S_suborbital', 'S_subparietal', 'S_temporal_inf', 'S_temporal_sup',
+    'S_temporal_transverse']
+BRODMANN = [area + '_exvivo' for area in
+            ('BA1', 'BA2', 'BA3a', 'BA3b', 'BA4a', 'BA4p', 'BA6', 'BA44',
+             'BA45', 'V1', 'V2', 'MT', 'perirhinal', 'entorhinal')]
+NOT_IN_DKT = ['bankssts', 'frontalpole', 'temporalpole']
+
+
+def load_templates():
+    """Stats files for a subject, from one subject of the dry run data
+
+    Returns:
+        templates (dict): file name in stats/: contents
+    """
+
+    templates = {}
+    with tarfile.open(os.path.join(REPO, 'dry_run_data.tgz'), 'r:gz') as tar:
+        members = [mm for mm in tar.getmembers()
+                   if '/stats/' in mm.name and mm.isfile() and
+                   not os.path.basename(mm.name).startswith('._')]
+        first = os.path.dirname(members[0].name)
+        for member in members:
+            if os.path.dirname(member.name) == first:
+                with tar.extractfile(member) as fh:
+                    templates[os.path.basename(member.name)] = \
+                        fh.read().decode('utf-8')
+
+    for hemi in ('lh', 'rh'):
+        aparc = templates[hemi + '.aparc.stats']
+        names = [row.split()[0] for row in _rows(aparc)]
+        templates[hemi + '.aparc.a2009s.stats'] = _with_structures(
+            aparc, DESTRIEUX)
+        templates[hemi + '.aparc.DKTatlas.stats'] = _with_structures(
+            aparc, [nn for nn in names if nn not in NOT_IN_DKT])
+        templates[hemi + '.BA_exvivo.stats'] = _with_structures(
+            aparc, BRODMANN)
+        templates[hemi + '.BA_exvivo.thresh.stats'] = _with_structures(
+            aparc, BRODMANN)
+
+    # wmparc: the white matter under each aparc region, 3001... in the left
+    # hemisphere and 4001... in the right, and what is under none
+    names = [row.split()[0] for row in _rows(templates['lh.aparc.stats'])]
+    structures = ['wm-lh-' + nn for nn in names] + \
+        ['wm-rh-' + nn for nn in names] + \
+        ['Left-UnsegmentedWhiteMatter', 'Right-UnsegmentedWhiteMatter']
+    seg_ids = [3001 + nn for nn in range(len(names))] + \
+        [4001 + nn for nn in range(len(names))] + [5001, 5002]
+    templates['wmparc.stats'] = _with_structures(
+        templates['aseg.stats'], structures, seg_ids)
+    return templates
+
+
+def _rows(stats):
+
+    return [line for line in stats.splitlines(True)
+            if line.strip() and not line.startswith('#')]
+
+
+def _split_row(line):
+    """The tokens of a table row, and a function that puts changed tokens
+    back with the same spacing"""
+
+    parts = re.split(r'(\s+)', line.rstrip('\n'))
+    leading = parts[0] == ''
+    tokens = parts[2::2] if leading else parts[0::2]
+    spaces = parts[1::2]
+
+    def join(changed):
+        out = []
+        if leading:
+            for space, token in zip(spaces, changed):
+                out += [space, token]
+        else:
+            for token, space in zip(changed, spaces + ['']):
+                out += [token, space]
+        return ''.join(out) + '\n'
+
+    return tokens, join
+
+
+def _with_structures(template, structures, seg_ids=None):
+    """template with its table rows for the given structures, the values
+    taken from its rows in turn"""
+
+    headers = []
+    header_lines = []
+    rows = []
+    for line in template.splitlines(True):
+        if not line.strip() or line.startswith('#'):
+            if line.startswith('# ColHeaders '):
+                headers = line.split()[2:]
+            elif line.startswith('# NRows '):
+                line = '# NRows ' + str(len(structures)) + ' \n'
+            header_lines.append(line)
+        else:
+            rows.append(line)
+
+    new_rows = []
+    for nn, structure in enumerate(structures):
+        tokens, join = _split_row(rows[nn % len(rows)])
+        for cc, header in enumerate(headers[:len(tokens)]):
+            if header == 'StructName':
+                tokens[cc] = structure.ljust(len(tokens[cc]))
+            elif header == 'Index':
+                tokens[cc] = str(nn + 1).rjust(len(tokens[cc]))
+            elif header == 'SegId' and seg_ids:
+                tokens[cc] = str(seg_ids[nn]).rjust(len(tokens[cc]))
+        new_rows.append(join(tokens))
+    return ''.join(header_lines + new_rows)
+
+
+def _format_like(token, value):
+    """value written with as many decimals as token, at least as wide"""
+
+    if '.' in token:
+        text = '{:.{}f}'.format(value, len(token.split('.')[1]))
+    else:
+        text = str(int(round(value)))
+    return text.rjust(len(token))
+
+
+def _change_row(line, headers, factors, rng):
+
+    # keep the spacing of the columns: change each token in place
+    tokens, join = _split_row(line)
+    changed = []
+    for header, token in zip(headers, tokens):
+        if not _NUMBER.match(token) or header in KEPT_COLUMNS:
+            changed.append(token)
+            continue
+        if header in SIZE_COLUMNS:
+            factor = factors['size'] * rng.gauss(1.0, factors['noise'])
+        elif header in THICKNESS_COLUMNS:
+            factor = factors['thickness'] * rng.gauss(1.0, factors['noise'])
+        else:
+            factor = rng.gauss(1.0, 2 * factors['noise'])
+        changed.append(_format_like(token, float(token) * factor))
+    changed += tokens[len(changed):]
+    return join(changed)
+
+
+def _change_measure(line, factors):
+
+    # "# Measure Name, Short, Long name, value, units"
+    fields = line.rstrip('\n').split(', ')
+    value, units = fields[-2], fields[-1].strip()
+    if units in ('mm^3', 'mm^2') or 'NumVert' in line:
+        factor = factors['size']
+    elif units == 'mm':
+        factor = factors['thickness']
+    else:
+        return line
+    fields[-2] = _format_like(value, float(value) * factor).strip()
+    return ', '.join(fields) + '\n'
+
+
+def make_stats(template, subject_name, subjects_dir, factors, rng):
+    """A stats file like template with the values changed
+
+    Args:
+        template (str): contents of a FreeSurfer .stats file
+        subject_name (str): for the subjectname line
+        subjects_dir (str): for the SUBJECTS_DIR line
+        factors (dict): 'size' and 'thickness' multiply the volumes, areas
+            and thicknesses, 'noise' is the standard deviation of the
+            change of each value
+        rng (random.Random): where the noise comes from
+
+    Returns:
+        stats (str)
+    """
+
+    headers = []
+    lines = []
+    for line in template.splitlines(True):
+        if line.startswith('# subjectname '):
+            line = '# subjectname ' + subject_name + '\n'
+        elif line.startswith('# SUBJECTS_DIR '):
+            line = '# SUBJECTS_DIR ' + subjects_dir + '\n'
+        elif line.startswith('# cmdline '):
+            line = re.sub(r'\S+\.long\.\S+', subject_name, line)
+        elif line.startswith('# ColHeaders '):
+            headers = line.split()[2:]
+        elif line.startswith('# Measure '):
+            line = _change_measure(line, factors)
+        elif not line.startswith('#') and line.strip() and headers:
+            line = _change_row(line, headers, factors, rng)
+        lines.append(line)
+    return ''.join(lines)
+
+
+def _text(size, rng):
+
+    # label files are lines of "vertex x y z value"
+    line_count = max(1, int(size) // 32)
+    return ''.join('{:d}  {:.3f}  {:.3f}  {:.3f} 0.0000000000\n'.format(
+        nn, rng.uniform(-80, 80), rng.uniform(-110, 80),
+        rng.uniform(-50, 90)) for nn in range(line_count)).encode('ascii')
+
+
+def write_file(path, size, kind, rng):
+    """Write a file of about size bytes made as kind says"""
+
+    size = int(size)
+    with open(path, 'wb') as fh:
+        if kind == 'text':
+            fh.write(_text(size, rng)[:size])
+        elif kind == 'bin':
+            half = size // 2
+            fh.write(os.urandom(half))
+            fh.write(bytes(size - half))
+        else:
+            fh.write(os.urandom(size))
+
+
+def layout(scale=1.0, long=False):
+    """The files of one subject directory
+
+    Args:
+        scale (float): multiplies the size of each file
+        long (bool): for a longitudinal directory, which has no mri/orig/
+
+    Returns:
+        files (list of (path, bytes, kind))
+    """
+
+    files = []
+    for path, size, kind in LAYOUT:
+        if long and path.startswith('mri/orig/'):
+            continue
+        for hemi in (('lh', 'rh') if '{h}' in path else ('',)):
+            files.append((path.format(h=hemi), max(1, int(size * scale)),
+                          kind))
+    return files
+
+
+def write_subject(subject_dir, templates, factors, rng, scale=1.0,
+                  long=False, base_tps=None):
+    """Write one subject directory
+
+    Args:
+        subject_dir (str): the directory to make, its name is the subject
+        templates (dict): from load_templates()
+        factors (dict): see make_stats()
+        rng (random.Random): for the stats values
+        scale (float): multiplies the size of each file
+        long (bool): longitudinal directory
+        base_tps (list of str): the time points, for a template
+
+    Returns:
+        (files, bytes) (tuple of int): what was written
+    """
+
+    name = os.path.basename(subject_dir)
+    subjects_dir = os.path.dirname(os.path.abspath(subject_dir))
+    files = 0
+    total = 0
+
+    for path, size, kind in layout(scale, long):
+        full = os.path.join(subject_dir, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        write_file(full, size, kind, rng)
+        files += 1
+        total += size
+
+    for directory in EMPTY_DIRS:
+        os.makedirs(os.path.join(subject_dir, directory), exist_ok=True)
+    os.makedirs(os.path.join(subject_dir, 'touch'), exist_ok=True)
+    for stage in TOUCH:
+        for hemi in (('lh', 'rh') if '{h}' in stage else ('',)):
+            open(os.path.join(subject_dir, 'touch', stage.format(h=hemi) +
+                              '.touch'), 'w').close()
+            files += 1
+
+    os.makedirs(os.path.join(subject_dir, 'stats'), exist_ok=True)
+    for file_name, template in sorted(templates.items()):
+        stats = make_stats(template, name, subjects_dir, factors, rng)
+        with open(os.path.join(subject_dir, 'stats', file_name), 'w') as fh:
+            fh.write(stats)
+        files += 1
+        total += len(stats)
+
+    if base_tps:
+        with open(os.path.join(subject_dir, 'base-tps'), 'w') as fh:
+            fh.write('\n'.join(base_tps) + '\n')
+        files += 1
+
+    with open(os.path.join(subject_dir, 'scripts', 'recon-all.done'),
+              'w') as fh:
+        fh.write('SUBJECT ' + name + '\nSUBJECTS_DIR ' + subjects_dir +
+                 '\nCMDARGS synthetic\n')
+
+    return files, total
+
+
+def generate(subjects_dir, subjects=1, timepoints=3, scale=1.0, seed=0,
+             cross=True, base=True, templates=None):
+    """Write a SUBJECTS_DIR of synthetic subjects
+
+    Args:
+        subjects_dir (str): made if it is not there
+        subjects (int): how many subjects
+        timepoints (int): time points of each subject
+        scale (float): multiplies the size of each file, 1.0 is the size of
+            a real run
+        seed (int): the same seed makes the same stats values
+        cross (bool): also write the cross-sectional directories
+        base (bool): also write the templates
+        templates (dict): from load_templates(), read if not given
+
+    Returns:
+        summary (dict): 'directories', 'files', 'bytes' written and
+            'long_dirs', the names of the longitudinal directories
+    """
+
+    rng = random.Random(seed)
+    if templates is None:
+        templates = load_templates()
+    os.makedirs(subjects_dir, exist_ok=True)
+    summary = {'directories': 0, 'files': 0, 'bytes': 0, 'long_dirs': []}
+
+    def add(counts):
+        summary['directories'] += 1
+        summary['files'] += counts[0]
+        summary['bytes'] += counts[1]
+
+    for ss in range(subjects):
+        subject = 'sub{:04d}'.format(ss + 1)
+        base_name = 'BASE' if subjects == 1 else subject + '_BASE'
+        head = rng.gauss(1.0, 0.1)
+        thickness = rng.gauss(1.0, 0.05)
+        visits = [subject + '-V{:02d}'.format(tt + 1)
+                  for tt in range(timepoints)]
+
+        if base:
+            add(write_subject(
+                os.path.join(subjects_dir, base_name), templates,
+                {'size': head, 'thickness': thickness, 'noise': 0.005},
+                rng, scale, base_tps=visits))
+
+        for tt, visit in enumerate(visits):
+            # about half a percent of atrophy a visit
+            shrink = 1.0 - 0.005 * tt
+            factors = {'size': head * shrink,
+                       'thickness': thickness * shrink, 'noise': 0.01}
+            if cross:
+                add(write_subject(os.path.join(subjects_dir, visit),
+                                  templates, dict(factors, noise=0.02), rng,
+                                  scale))
+            long_dir = visit + '.long.BASE'
+            add(write_subject(os.path.join(subjects_dir, long_dir),
+                              templates, factors, rng, scale, long=True))
+            summary['long_dirs'].append(long_dir)
+
+    return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('subjects_dir')
+    parser.add_argument('--subjects', type=int, default=1)
+    parser.add_argument('--timepoints', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='size of the files compared to a real run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--long-only', action='store_true',
+                        help='only the longitudinal directories')
+    args = parser.parse_args()
+
+    summary = generate(args.subjects_dir, args.subjects, args.timepoints,
+                       args.scale, args.seed, cross=not args.long_only,
+                       base=not args.long_only)
+    print('Wrote {} directories, {} files, {:.1f} MB to {}'.format(
+        summary['directories'], summary['files'], summary['bytes'] / MB,
+        args.subjects_dir))
+
+
+if __name__ == '__main__':
+
+    main()
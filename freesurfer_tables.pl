@@ -6,13 +6,24 @@
 #   Collect all longitudinal FreeSurfer results into summary tables
 #
 # Usage
-#   freesurfer_tables.pl [dir]
+#   freesurfer_tables.pl [-x dir1,dir2,...] [-p parc1,parc2,...]
+#                        [-m meas1,meas2,...] [-j jobs] [dir]
 #
 # Inputs
 #   dir is the top-level FreeSurfer output directory containing
 #   longitudinal folders, named *.long.* which can exist at any
 #   depth beneath dir. Default is the current working directory.
 #
+# Options
+#   -x  comma separated list of longitudinal folders to leave out,
+#       e.g. ones where recon-all failed
+#   -p  comma separated list of more parcellations to tabulate like
+#       aparc: aparc.a2009s, aparc.DKTatlas, BA_exvivo,
+#       BA_exvivo.thresh, and wmparc (white matter volumes)
+#   -m  comma separated list of more measures to tabulate for each
+#       parcellation: meancurv, gauscurv, foldind, curvind, thicknessstd
+#   -j  number of tables to make at the same time (default 1)
+#
 # Outputs
 #   freesurfer_aseg_vol.csv
 #   freesurfer_aparc_vol_right.csv
@@ -21,6 +32,11 @@
 #   freesurfer_aparc_thick_left.csv
 #   freesurfer_aparc_area_right.csv
 #   freesurfer_aparc_area_left.csv
+#   freesurfer_dictionary.csv
+#   and for -p and -m, e.g.
+#   freesurfer_a2009s_thick_left.csv
+#   freesurfer_aparc_meancurv_right.csv
+#   freesurfer_wmparc_vol.csv
 #
 # Dependencies
 #   - asegstats2table
@@ -36,11 +52,36 @@
 use Cwd qw(getcwd abs_path);
 use File::Temp qw(tempfile tempdir);
 use File::Basename;
+use Getopt::Std;
 
 # system definitions
 $aseg = '/opt/freesurfer/bin/asegstats2table';
 $aparc = '/opt/freesurfer/bin/aparcstats2table';
 
+# short names of the parcellations and measures, for the table names
+%parc_name = ('aparc' => 'aparc', 'aparc.a2009s' => 'a2009s',
+              'aparc.DKTatlas' => 'dkt', 'BA_exvivo' => 'ba',
+              'BA_exvivo.thresh' => 'ba_thresh', 'wmparc' => 'wmparc');
+%meas_name = ('volume' => 'vol', 'thickness' => 'thick', 'area' => 'area',
+              'meancurv' => 'meancurv', 'gauscurv' => 'gauscurv',
+              'foldind' => 'foldind', 'curvind' => 'curvind',
+              'thicknessstd' => 'thickstd');
+%meas_unit = ('volume' => 'volume,mm3', 'thickness' => 'thickness,mm',
+              'area' => 'area,mm2', 'meancurv' => 'mean curvature,mm-1',
+              'gauscurv' => 'gaussian curvature,mm-2',
+              'foldind' => 'folding index,none',
+              'curvind' => 'curvature index,none',
+              'thicknessstd' => 'thickness standard deviation,mm');
+
+# options
+getopts('x:p:m:j:', \%opts);
+%exclude = map { $_ => 1 } split(',', $opts{x});
+@parcs = split(',', $opts{p});
+@measures = split(',', $opts{m});
+$jobs = ($opts{j} > 0) ? $opts{j} : 1;
+for (@parcs) { exists($parc_name{$_}) or die("Unknown parcellation: $_\n"); }
+for (@measures) { exists($meas_name{$_}) or die("Unknown measure: $_\n"); }
+
 # input directory
 $ENV{SUBJECTS_DIR} = ($#ARGV < 0) ? getcwd() : abs_path($ARGV[0]);
 
@@ -59,15 +100,24 @@ $opts = "--subjectsfile=$scans --skip -d comma";
 # find scan directories
 find_scans($scans);
 
-# create tables
+# create tables, each one reads the stats of every scan so they are made
+# at the same time
 print("Writing csv files in directory: $out\n");
-system("$aseg $opts -m volume -t $out/freesurfer_aseg_vol.csv");
-system("$aparc $opts --hemi rh -m volume -t $out/freesurfer_aparc_vol_right.csv");
-system("$aparc $opts --hemi lh -m volume -t $out/freesurfer_aparc_vol_left.csv");
-system("$aparc $opts --hemi rh -m thickness -t $out/freesurfer_aparc_thick_right.csv");
-system("$aparc $opts --hemi lh -m thickness -t $out/freesurfer_aparc_thick_left.csv");
-system("$aparc $opts --hemi rh -t $out/freesurfer_aparc_area_right.csv");
-system("$aparc $opts --hemi lh -t $out/freesurfer_aparc_area_left.csv");
+@cmds = ("$aseg $opts -m volume -t $out/freesurfer_aseg_vol.csv");
+@parc_tables = ();  # [csv of the left hemisphere, parcellation, measure]
+for $parc ('aparc', @parcs) {
+  if ($parc eq 'wmparc') {
+    push(@cmds, "$aseg $opts --stats=wmparc.stats -m volume -t $out/freesurfer_wmparc_vol.csv");
+    next;
+  }
+  for $meas ('thickness', 'volume', 'area', @measures) {
+    $csv = "freesurfer_$parc_name{$parc}_$meas_name{$meas}";
+    push(@cmds, "$aparc $opts --hemi rh --parc $parc -m $meas -t $out/${csv}_right.csv");
+    push(@cmds, "$aparc $opts --hemi lh --parc $parc -m $meas -t $out/${csv}_left.csv");
+    push(@parc_tables, ["${csv}_left.csv", $parc, $meas]);
+  }
+}
+run_commands($jobs, @cmds);
 
 # write dictionary
 chdir($out);
@@ -100,7 +150,9 @@ sub find_scans {
   for $d (@out) {
     chomp($d);
     $d =~ s/^\.\///;
-    if (-f "$d/stats/aseg.stats") {
+    if ($exclude{basename($d)}) {
+      print("Leaving out: $d\n");
+    } elsif (-f "$d/stats/aseg.stats") {
       print(F "$d\n");
       $count++;
     } else {
@@ -115,6 +167,36 @@ sub find_scans {
 }
 
 
+sub run_commands {
+
+  # run the commands, at most $_[0] at a time
+
+  my($max, @cmds) = @_;
+  my(%running, $cmd, $pid);
+
+  for $cmd (@cmds) {
+    if (keys(%running) >= $max) {
+      $pid = wait();
+      $? and print("Warning: Failed: $running{$pid}\n");
+      delete($running{$pid});
+    }
+    $pid = fork();
+    defined($pid) or die("Could not fork: $!\n");
+    if ($pid == 0) {
+      exec($cmd) or exit(127);
+    }
+    $running{$pid} = $cmd;
+  }
+
+  while (keys(%running)) {
+    $pid = wait();
+    $? and print("Warning: Failed: $running{$pid}\n");
+    delete($running{$pid});
+  }
+
+}
+
+
 sub modify_abe {
 
   my($csv, $mod, @list, $study, $x, $err);
@@ -170,7 +252,7 @@ sub modify_abe {
 
 sub write_dictionary {
 
-  my($method, $label, $region, $hemi, $meas, $unit, %lut_aparc, %lut_aseg, @head, @vars, $v);
+  my($method, $label, $region, $hemi, $meas, $unit, %lut_aparc, %lut_aseg, %lut_ba, @head, @vars, %in_aseg, $v, $t, $csv, $parc);
 
   # load DATA into hashes
   while (<DATA>) {
@@ -178,6 +260,7 @@ sub write_dictionary {
     ($method, $label, $region) = split(':');
     $method eq 'aparc' and $lut_aparc{$label} = $region;
     $method eq 'aseg' and $lut_aseg{$label} = $region;
+    $method eq 'ba' and $lut_ba{$label} = $region;
   }
 
   # start dictionary with header
@@ -189,6 +272,7 @@ sub write_dictionary {
   chomp(@head = `head -1 freesurfer_aseg_vol.csv`);
   @vars = split(',', $head[0]);  # split header into variable list
   shift(@vars);  # skip first variable in header
+  %in_aseg = map { $_ => 1 } @vars;
 
   # process each variable
   for $v (sort(@vars)) {
@@ -228,7 +312,45 @@ sub write_dictionary {
 
   }
 
-  for $csv (qw(freesurfer_aparc_thick_left.csv freesurfer_aparc_vol_left.csv)) {
+  # white matter under each aparc region, and what is not under any
+  if (-f 'freesurfer_wmparc_vol.csv') {
+
+    chomp(@head = `head -1 freesurfer_wmparc_vol.csv`);
+    @vars = split(',', $head[0]);
+    shift(@vars);
+
+    for $v (sort(@vars)) {
+
+      if ($v =~ /^wm-(lh|rh)-(.*)$/) {
+        $hemi = ($1 eq 'lh') ? 'left' : 'right';
+        $region = $lut_aparc{$2};
+        if ($region eq '') {
+          print("Warning: No aparc region associated with variable: $v\n");
+          next;
+        }
+        print(D "$v,$region White Matter,$hemi,wmparc segmentation,volume,mm3\n");  # <-- write line
+        next;
+      }
+
+      if ($v =~ /^(Left|Right)-UnsegmentedWhiteMatter$/) {
+        $hemi = lc($1);
+        print(D "$v,Unsegmented White Matter,$hemi,wmparc segmentation,volume,mm3\n");  # <-- write line
+        next;
+      }
+
+      $in_aseg{$v} and next;  # ignore - this is in aseg
+
+      print("Warning: Unrecognized variable: $v\n");
+
+    }
+
+  }
+
+  for $t (@parc_tables) {
+
+    ($csv, $parc, $meas) = @$t;
+    $method = ($parc eq 'aparc') ? 'parcellation' : "$parc parcellation";
+    $unit = $meas_unit{$meas};
 
     # get aparc variables from header of csv
     chomp(@head = `head -1 $csv`);
@@ -238,17 +360,23 @@ sub write_dictionary {
     # process each variable
     for $v (sort(@vars)) {
 
-      if ($v =~ /^lh_(.*?)_(thickness|volume)$/) {
-        $meas = $2;
-        $region = $lut_aparc{$1};
+      if ($v =~ /^lh_(.*?)_$meas$/) {
+        $label = $1;
+        if ($parc =~ /^BA_exvivo/) {
+          $region = $lut_ba{$label};
+        } elsif ($parc eq 'aparc.a2009s') {
+          $region = destrieux_region($label);
+        } else {
+          $region = $lut_aparc{$label};
+        }
+        $region eq '' and $region = $lut_aparc{$label};  # MeanThickness etc.
         if ($region eq '') {
-          print("Warning: No aparc region associated with variable: $1\n");
+          print("Warning: No $parc region associated with variable: $label\n");
           next;
         }
-        $unit = ($meas eq 'thickness') ? 'thickness,mm' : 'volume,mm3';
-        print(D "$v,$region,left,parcellation,$unit\n");  # <-- write line
+        print(D "$v,$region,left,$method,$unit\n");  # <-- write line
         $v =~ s/^lh_/rh_/;
-        print(D "$v,$region,right,parcellation,$unit\n");  # <-- write line
+        print(D "$v,$region,right,$method,$unit\n");  # <-- write line
         next;
       }
 
@@ -266,6 +394,24 @@ sub write_dictionary {
 }
 
 
+sub destrieux_region {
+
+  # region name from a label of the Destrieux atlas (aparc.a2009s),
+  # e.g. G_and_S_cingul-Mid-Ant -> Gyrus and Sulcus cingul Mid Ant
+
+  my($region) = @_;
+
+  $region =~ s/^G_and_S_/Gyrus and Sulcus /;
+  $region =~ s/^G_/Gyrus /;
+  $region =~ s/^S_/Sulcus /;
+  $region =~ s/^Lat_Fis/Lateral Fissure/;
+  $region =~ s/^Pole_/Pole /;
+  $region =~ s/[_-]/ /g;
+  return $region;
+
+}
+
+
 __DATA__
 
 # lines have the format "method:label:region"
@@ -307,6 +453,24 @@ aparc:temporalpole:Temporal Pole
 aparc:transversetemporal:Transverse Temporal
 aparc:insula:Insula
 aparc:MeanThickness:Mean Global Cortex
+aparc:WhiteSurfArea:Total White Surface
+
+# BA_exvivo and BA_exvivo.thresh labels
+
+ba:BA1_exvivo:Brodmann Area 1
+ba:BA2_exvivo:Brodmann Area 2
+ba:BA3a_exvivo:Brodmann Area 3a
+ba:BA3b_exvivo:Brodmann Area 3b
+ba:BA4a_exvivo:Brodmann Area 4a
+ba:BA4p_exvivo:Brodmann Area 4p
+ba:BA6_exvivo:Brodmann Area 6
+ba:BA44_exvivo:Brodmann Area 44
+ba:BA45_exvivo:Brodmann Area 45
+ba:V1_exvivo:Primary Visual Cortex
+ba:V2_exvivo:Secondary Visual Cortex
+ba:MT_exvivo:Middle Temporal Visual Area
+ba:perirhinal_exvivo:Perirhinal Cortex
+ba:entorhinal_exvivo:Entorhinal Cortex
 
 # variables that do not match: /^(Right-|Left-|lh|rh)(.*)/
 
@@ -15,7 +15,13 @@ Process
          -all -qcache [-3T]
   - Execute longitudinal processing for each scan (visit)
       % recon-all -long visit_j BASE -all -qcache [-3T]
-  - The -3T option is included if B0=3.0 is in the Nifti "descrip"
+  - The -3T option is included if MagneticFieldStrength is 3 or, when that
+    is not available, if B0=3.0 is in the Nifti "descrip"
+  - recon-all's -openmp (and optionally -parallel for the hemispheres) and
+    the number of time points run at the same time share the CPUs
+  - Before anything is run, only the Nifti headers are read to reject (or
+    flag) scans that are not 3D, have very coarse voxels, or have no
+    usable orientation
 
 Freesurfer Output Structure
        <destdir>/<patnum>/visit_j
@@ -30,6 +36,13 @@ Summary Outputs (produced by freesurfer_tables.pl)
   freesurfer_aparc_thick_left.csv
   freesurfer_aparc_area_right.csv
   freesurfer_aparc_area_left.csv
+  freesurfer_dictionary.csv
+  and, with extra_parcellations and extra_measures, the same for each
+  parcellation and measure, e.g. freesurfer_a2009s_thick_left.csv,
+  freesurfer_aparc_meancurv_left.csv and freesurfer_wmparc_vol.csv
+
+Rates of Change (with change_tables, see utils/results/change_rates.py)
+  *_change.csv, *_pct_change.csv and *_slope.csv for each table
 
 Original perl coding by: DB Clayton - 2019/09/17
 
@@ -42,6 +55,14 @@ import shutil
 import json
 import re
 import glob
+import csv
+import functools
+import zipfile
+import hashlib
+import signal
+import sqlite3
+import threading
+import time
 
 import flywheel
 
@@ -51,23 +72,102 @@ from utils.fly.custom_log import custom_log
 from utils.fly.load_manifest_json import load_manifest_json
 from utils.fly.make_file_name_safe import make_file_name_safe
 
+from utils.nifti.read_nifti_header import read_nifti_header
+from utils.nifti.read_nifti_header import check_nifti_header
+from utils.nifti.fingerprint_nifti import fingerprint_nifti
+
 from utils.results.set_zip_name import set_zip_head
 from utils.results.zip_output import zip_output
+from utils.results.publish import Publisher
+from utils.results.change_rates import parse_date, write_change_tables
+from utils.results.info_metrics import parse_patterns, collect_metrics
+from utils.results.info_metrics import limit_size
 
 import utils.dry_run
 
+import utils.metrics
+import utils.profiling
 import utils.system
-
-
-def download_it(fw, acquisition, file_name, input_path):
+import utils.tracing
+from utils.tracing import span
+from utils.watchdog import Watchdog, parse_stage_timeouts
+from utils.memory import GB, MemoryAdmission, parse_memory_estimates
+from utils.parallel import plan_threads, plan_options, run_jobs
+from utils.runtime import RuntimePredictor, timepoint_features
+from utils.runtime import longest_first, list_schedule
+from utils.history import RunHistory, machine
+from utils.checkpoint import Checkpointer, FlywheelStore, LocalStore
+from utils.reuse import find_prior_analyses, unpack_subject, check_subject
+from utils.disk import DEFAULT_SIZES, DiskMonitor, directory_size
+from utils.disk import project_peak, prune_subject
+from utils.cleanup import TRASH, Cleaner
+
+
+# Lists in context.gear_dict that have one element per time point (scan)
+TIMEPOINT_LISTS = ['niftis', 'file_names', 'createds', 'visits',
+                   'field_strength', 'nifti_headers', 'file_hashes',
+                   'session_ids']
+
+# The template needs at least this many time points
+MIN_TIMEPOINTS = 2
+
+# The recon-all steps of the longitudinal pipeline, in order
+STEPS = ['cross-sectional', 'base', 'longitudinal']
+
+# What freesurfer_tables.pl can tabulate besides aseg volumes and aparc
+# volume, thickness and area
+EXTRA_PARCELLATIONS = ['aparc.a2009s', 'aparc.DKTatlas', 'BA_exvivo',
+                       'BA_exvivo.thresh', 'wmparc']
+EXTRA_MEASURES = ['meancurv', 'gauscurv', 'foldind', 'curvind',
+                  'thicknessstd']
+
+# Guards context.gear_dict['schedule'], runs finish in several threads
+_schedule_lock = threading.Lock()
+
+
+def find_duplicate(context, key, value):
+    """Return the index of the time point with the same hash, or None"""
+
+    if value is None:
+        return None
+    for nn, hashes in enumerate(context.gear_dict['file_hashes']):
+        if hashes.get(key) == value:
+            return nn
+    return None
+
+
+def download_it(fw, acquisition, afile, input_path, session):
     """Once proper file has been found, get it.
 
+    If config "skip_duplicate_scans" is set, a file that has the same
+    Flywheel hash as a file already found is not downloaded at all.  After
+    downloading, the content hash and image fingerprint (see
+    fingerprint_nifti()) are compared to the files already found, so a
+    re-export of the same scan is not processed twice.
+
     Args:
         acquisition
-        file_name
+        afile: the file in the acquisition
         input_path
+        session: the session that has the acquisition
+
+    Returns:
+        True if the file will be processed, False if it is a duplicate
     """
 
+    file_name = afile.name
+    visit = make_file_name_safe(session.label, '_')
+    skip_duplicates = context.config.get('skip_duplicate_scans', False)
+
+    hashes = {'flywheel': afile.get('hash')}
+    if skip_duplicates:
+        nn = find_duplicate(context, 'flywheel', hashes['flywheel'])
+        if nn is not None:
+            note_dropped(context, visit, file_name, 'duplicate of "' +
+                         context.gear_dict['file_names'][nn] +
+                         '" (same Flywheel hash)')
+            return False
+
     safe = make_file_name_safe(file_name, replace_str='_')
 
     full_path = input_path + safe
@@ -91,7 +191,24 @@ def download_it(fw, acquisition, file_name, input_path):
     else:
         log.info('Downloading ' + file_name + ' -> ' +\
              full_path + ' created ' + created)
-        acquisition.download_file(file_name, full_path)
+        with span('download', file=file_name, visit=visit) as sp:
+            acquisition.download_file(file_name, full_path)
+            sp.set('bytes', os.path.getsize(full_path))
+        utils.metrics.inc('grp14_downloads_total')
+        utils.metrics.inc('grp14_downloaded_bytes_total',
+                          os.path.getsize(full_path))
+
+    if skip_duplicates:
+        hashes.update(fingerprint_nifti(full_path))
+        for key, how in (('sha256', 'same content'),
+                         ('fingerprint', 'same image')):
+            nn = find_duplicate(context, key, hashes[key])
+            if nn is not None:
+                note_dropped(context, visit, file_name, 'duplicate of "' +
+                             context.gear_dict['file_names'][nn] + '" (' +
+                             how + ')')
+                os.remove(full_path)
+                return False
 
     full_file = fw.get_acquisition_file_info(acquisition.id, file_name)
     field_strength = full_file.info.get('MagneticFieldStrength')
@@ -99,7 +216,13 @@ def download_it(fw, acquisition, file_name, input_path):
     context.gear_dict['niftis'].append(full_path)
     context.gear_dict['file_names'].append(file_name)
     context.gear_dict['createds'].append(created)
+    context.gear_dict['visits'].append(visit)
     context.gear_dict['field_strength'].append(field_strength)
+    context.gear_dict['nifti_headers'].append(None)
+    context.gear_dict['file_hashes'].append(hashes)
+    context.gear_dict['session_ids'].append(session.id)
+
+    return True
 
 def find_and_download_files(context):
     """Find apropriate files for the subject and download them
@@ -264,13 +387,162 @@ def find_and_download_files(context):
                                 log.info('Found ' + cm + ' file')
 
                     if found_one:
-                        download_it(fw, acquisition, afile.name, input_path)
-                        context.gear_dict['visits'].append(
-                            make_file_name_safe(session.label, '_'))
+                        download_it(fw, acquisition, afile, input_path,
+                                    session)
                     else:
                         log.info('Ignoring ' + afile.name)
 
 
+def note_dropped(context, visit, file_name, reason):
+    """Remember a file that was found but will not be processed"""
+
+    msg = 'Dropping "' + file_name + '" (' + visit + '): ' + reason
+    log.warning(msg)
+    context.gear_dict['warnings'].append(msg)
+    context.gear_dict['dropped'].append({'visit': visit,
+                                         'file_name': file_name,
+                                         'reason': reason})
+
+
+def drop_timepoint(context, nn, reason):
+    """Remove the nn-th time point from all of the time point lists.
+
+    The dropped file is remembered in context.gear_dict['dropped'] so it can
+    be reported at the end.
+
+    Args:
+        context (dict): the gear context
+        nn (int): index into the time point lists
+        reason (str): why it is not being processed
+    """
+
+    note_dropped(context, context.gear_dict['visits'][nn],
+                 context.gear_dict['file_names'][nn], reason)
+
+    for key in TIMEPOINT_LISTS:
+        del context.gear_dict[key][nn]
+    utils.metrics.gauge('grp14_timepoints', len(context.gear_dict['niftis']))
+
+
+def preflight_niftis(context):
+    """Check NIfTI headers before spending any compute on them.
+
+    Only the header of each downloaded file is read.  Scans that are not 3D,
+    have very coarse voxels, or have no usable orientation are dropped
+    (config "preflight" = "reject") or just warned about ("warn").  The
+    header's "descrip" is used for the field strength when the acquisition
+    info does not have MagneticFieldStrength.
+    """
+
+    mode = context.config.get('preflight', 'warn')
+    if mode == 'off':
+        log.info('NIfTI header pre-flight check is off')
+        return
+
+    max_voxel_size = context.config.get('preflight_max_voxel_size', 2.0)
+
+    nn = 0
+    while nn < len(context.gear_dict['niftis']):
+
+        nifti = context.gear_dict['niftis'][nn]
+
+        try:
+            header = read_nifti_header(nifti)
+        except (OSError, ValueError) as e:
+            header = None
+            problems = ['could not read header: ' + str(e)]
+        else:
+            problems = check_nifti_header(header, max_voxel_size)
+            log.info('Header of ' + nifti + ': dims ' +
+                     str(header['dims'][1:header['dims'][0] + 1]) +
+                     ' voxel size ' + str(header['pixdim'][1:4]) +
+                     ' orientation ' + str(header['orientation']) +
+                     ' descrip "' + header['descrip'] + '"')
+
+            if context.gear_dict['field_strength'][nn] is None and \
+               header['field_strength'] is not None:
+                log.info('Using field strength from NIfTI descrip: ' +
+                         str(header['field_strength']))
+                context.gear_dict['field_strength'][nn] = \
+                    header['field_strength']
+
+        context.gear_dict['nifti_headers'][nn] = header
+
+        if problems:
+            msg = '"' + context.gear_dict['file_names'][nn] + '": ' + \
+                  '; '.join(problems)
+            if mode == 'reject':
+                drop_timepoint(context, nn,
+                               'pre-flight: ' + '; '.join(problems))
+                continue
+            log.warning('Pre-flight problem with ' + msg)
+            context.gear_dict['warnings'].append('Pre-flight: ' + msg)
+
+        nn += 1
+
+
+def scan_score(context, nn):
+    """Rank a scan for the "best" multiple_t1_policy: bigger is better.
+
+    Scans without pre-flight problems come first, then the ones with the
+    smallest voxels, then the ones with the most voxels.
+    """
+
+    header = context.gear_dict['nifti_headers'][nn]
+    if header is None:
+        try:
+            header = read_nifti_header(context.gear_dict['niftis'][nn])
+        except (OSError, ValueError):
+            return (False, float('-inf'), 0)
+
+    max_voxel_size = context.config.get('preflight_max_voxel_size', 2.0)
+    problems = check_nifti_header(header, max_voxel_size)
+
+    pixdim = header['pixdim']
+    dims = header['dims']
+    voxel_volume = abs(pixdim[1] * pixdim[2] * pixdim[3])
+    num_voxels = dims[1] * dims[2] * dims[3]
+
+    return (not problems, -voxel_volume, num_voxels)
+
+
+def select_scans(context):
+    """Apply multiple_t1_policy to sessions that have more than one scan.
+
+    "all" keeps every scan, "best" keeps only the best one (see scan_score()).
+    Then visit names are made unique so each scan gets its own subject
+    directory: the 2nd scan in session "ses" becomes visit "ses_2".
+    """
+
+    if context.config.get('multiple_t1_policy', 'all') == 'best':
+
+        session_ids = context.gear_dict['session_ids']
+        for session_id in sorted(set(session_ids), key=session_ids.index):
+            indices = [nn for nn, sid in enumerate(session_ids)
+                       if sid == session_id]
+            if len(indices) < 2:
+                continue
+            best = max(indices, key=lambda nn: scan_score(context, nn))
+            best_name = context.gear_dict['file_names'][best]
+            log.info('Using "' + best_name + '" for session ' +
+                     context.gear_dict['visits'][best])
+            for nn in reversed(indices):
+                if nn != best:
+                    drop_timepoint(context, nn, 'multiple_t1_policy is ' +
+                                   'best, using "' + best_name + '"')
+
+    visits = context.gear_dict['visits']
+    for nn, visit in enumerate(visits):
+        if visit in visits[:nn]:
+            rpt = 2
+            while visit + '_' + str(rpt) in visits:
+                rpt += 1
+            visits[nn] = visit + '_' + str(rpt)
+            log.info('Session ' + visit + ' has more than one scan, using ' +
+                     'visit name ' + visits[nn] + ' for "' +
+                     context.gear_dict['file_names'][nn] + '"')
+
+
 def update_gear_status(key, value):
     """Set destination's 'info' to indicate what's happening"""
 
@@ -284,7 +556,7 @@ def update_gear_status(key, value):
 def set_recon_all_status(subject_dir):
     """Set final status to last line of recon-all-status.log."""
 
-    path = context.gear_dict['output_analysisid_dir'] + '/' + \
+    path = context.gear_dict['subjects_dir'] + '/' + \
            subject_dir + '/scripts/recon-all-status.log'
     if os.path.exists(path):
         with open(path, 'r') as fh:
@@ -308,7 +580,7 @@ def update_gear_status(key, value):
 def set_recon_all_status(subject_dir):
     """Set final status to last line of recon-all-status.log."""
 
-    path = context.gear_dict['output_analysisid_dir'] + '/' + \
+    path = context.gear_dict['subjects_dir'] + '/' + \
            subject_dir + '/scripts/recon-all-status.log'
     if os.path.exists(path):
         with open(path, 'r') as fh:
@@ -319,6 +591,85 @@ def set_recon_all_status(subject_dir):
         last_line = 'recon-all-status.log is missing'
     update_gear_status(subject_dir, last_line)
 
+
+def update_gear_info(info):
+    """Set several keys of destination's 'info' in one request"""
+
+    fw = context.client
+    dest_container = fw.get(context.destination['id'])
+    dest_container.update_info(info)
+    log.info('Set ' + ', '.join(sorted(info)) + ' in the analysis info')
+
+
+def publish_summary_metrics(context, tables_dir, dates):
+    """Put the values of the variables in config info_metrics in the
+    analysis info as "summary-metrics", see utils.results.info_metrics"""
+
+    patterns = parse_patterns(context.config.get('info_metrics'))
+    if not patterns:
+        return
+    metrics = collect_metrics(tables_dir, patterns, dates)
+    max_bytes = int(context.config.get('info_metrics_max_kb', 32) * 1024)
+    metrics, omitted = limit_size(metrics, max_bytes)
+    info = {'summary-metrics': metrics}
+    if omitted:
+        log.warning('Left ' + str(len(omitted)) + ' variables out of the ' +
+                    'summary metrics, they would be more than ' +
+                    str(max_bytes) + ' bytes')
+        info['summary-metrics-omitted'] = omitted
+    update_gear_info(info)
+
+
+def start_trace(context):
+    """With config trace, time the phases of the gear as spans (see
+    utils.tracing) in a JSON lines file in the output directory, so it is
+    attached to the analysis."""
+
+    if not context.config.get('trace', False):
+        return
+    manifest = load_manifest_json()
+    path = os.path.join(context.output_dir, manifest['name'] + '_trace_' +
+                        context.destination['id'] + '.jsonl')
+    utils.tracing.start(path, gear_name=manifest['name'],
+                        gear_version=manifest['version'],
+                        analysis_id=context.destination['id'])
+
+
+def start_metrics(context):
+    """With config metrics_file, keep metrics (see utils.metrics) in that
+    .prom file for node_exporter's textfile collector while the gear
+    runs."""
+
+    path = context.config.get('metrics_file', '')
+    if not path:
+        return
+    manifest = load_manifest_json()
+    utils.metrics.start(path, analysis_id=context.destination['id'],
+                        gear_version=manifest['version'])
+    utils.metrics.gauge('grp14_info', 1)
+    utils.metrics.gauge('grp14_running', 1)
+    utils.metrics.gauge('grp14_start_time_seconds', round(time.time(), 3))
+    utils.metrics.count_api_calls(context.client)
+
+
+def start_profile(context):
+    """With config gear-profile, profile the gear's Python code (see
+    utils.profiling) and put the reports in the output directory"""
+
+    if not context.config.get('gear-profile', False):
+        return
+    utils.profiling.start(context.output_dir,
+                          load_manifest_json()['name'] + '_profile_')
+
+
+def stop_metrics(return_code):
+    """Write the metrics for the last time"""
+
+    utils.metrics.gauge('grp14_exit_code', return_code)
+    utils.metrics.gauge('grp14_running', 0)
+    utils.metrics.stop()
+
+
 def initialize(context):
     """Initialize logging and add informaiton to gear context:
         context.gear_dict:
@@ -349,6 +700,25 @@ def initialize(context):
     context.gear_dict['createds'] = []
     context.gear_dict['visits'] = []
     context.gear_dict['field_strength'] = []
+    context.gear_dict['nifti_headers'] = []
+    context.gear_dict['file_hashes'] = []
+    context.gear_dict['session_ids'] = []
+
+    # Time points that were found but are not being processed
+    context.gear_dict['dropped'] = []
+
+    # Why recon-all failed, and what the watchdog saw if it killed it, for
+    # each subject directory
+    context.gear_dict['failures'] = {}
+    context.gear_dict['watchdog'] = {}
+
+    # Peak memory of each recon-all run, see run_recon_all()
+    context.gear_dict['memory'] = {}
+
+    # Predicted and measured minutes of each recon-all run, see
+    # schedule_step()
+    context.gear_dict['runtime_predictor'] = RuntimePredictor()
+    context.gear_dict['runtimes'] = {}
 
     # get # cpu's to set -openmp
     cpu_count = os.cpu_count()
@@ -368,6 +738,13 @@ def initialize(context):
                          'os.cpu_count(), using ' + str_cpu_count)
     context.gear_dict['cpu_count'] = str_cpu_count
 
+    # How the CPUs were shared in each step, see plan_step()
+    context.gear_dict['parallelism'] = {
+        'mode': context.config.get('parallel_mode', 'none'),
+        'cpu_count': cpu_count,
+        'n_concurrent_timepoints':
+            context.config.get('n_concurrent_timepoints', 1)}
+
     # The main command line command to be run (just command, no arguments):
     context.gear_dict['COMMAND'] = 'longitudinal'
 
@@ -376,6 +753,42 @@ def initialize(context):
     context.gear_dict['errors'] = []
     context.gear_dict['warnings'] = []
 
+    # Subject directories restored from checkpoints, see make_checkpointer(),
+    # or taken from earlier analyses, see reuse_cross_sectional()
+    context.gear_dict['checkpointer'] = None
+    context.gear_dict['restored'] = set()
+    context.gear_dict['reused'] = {}
+
+    # Results put in the output directory (or uploaded) while the gear runs,
+    # see make_publisher()
+    context.gear_dict['publisher'] = None
+    context.gear_dict['published_dirs'] = []
+
+    # Disk used by SUBJECTS_DIR, see check_disk_budget()
+    context.gear_dict['disk'] = {'budget_gb': context.config.get(
+        'disk_budget_gb', 0), 'pruned_gb': 0.0}
+    context.gear_dict['disk_monitor'] = None
+    context.gear_dict['disk_sizes'] = dict(DEFAULT_SIZES)
+
+    # Directories are removed in the background, see discard()
+    context.gear_dict['cleaner'] = Cleaner()
+
+    # More tables for freesurfer_tables.pl to make
+    for key, known in (('extra_parcellations', EXTRA_PARCELLATIONS),
+                       ('extra_measures', EXTRA_MEASURES)):
+        values = [vv.strip() for vv in
+                  (context.config.get(key) or '').split(',') if vv.strip()]
+        unknown = [vv for vv in values if vv not in known]
+        if unknown:
+            context.gear_dict['errors'].append(
+                key + ' can only have ' + ', '.join(known) + ', not ' +
+                ', '.join(unknown))
+        context.gear_dict[key] = values
+
+    # Every recon-all run is recorded here, see record_run()
+    context.gear_dict['run_history'] = open_run_history(context, log)
+    context.gear_dict['machine'] = machine()
+
     # Get level of run from destination's parent: subject or session
     fw = context.client
     dest_container = fw.get(context.destination['id'])
@@ -431,10 +844,25 @@ def initialize(context):
         context.output_dir + '/' + context.destination['id'] + '/' + \
         context.gear_dict['project_label_safe']
 
+    # recon-all runs in the same path under config scratch_dir (e.g. local
+    # NVMe or tmpfs) if it is set, so its many small reads and writes are not
+    # on the output volume.  What is kept is moved over when the gear is
+    # done, see move_from_scratch().
+    context.gear_dict['scratch_dir'] = context.config.get('scratch_dir', '')
+    if context.gear_dict['scratch_dir']:
+        context.gear_dict['subjects_dir'] = os.path.join(
+            context.gear_dict['scratch_dir'], context.destination['id'],
+            context.gear_dict['project_label_safe'])
+        log.info('Using scratch directory ' +
+                 context.gear_dict['subjects_dir'])
+    else:
+        context.gear_dict['subjects_dir'] = \
+            context.gear_dict['output_analysisid_dir']
+
     # grab environment for gear
     with open('/tmp/gear_environ.json', 'r') as f:
         environ = json.load(f)
-        environ['SUBJECTS_DIR'] = context.gear_dict['output_analysisid_dir']
+        environ['SUBJECTS_DIR'] = context.gear_dict['subjects_dir']
         context.gear_dict['environ'] = environ
 
         # Add environment to log if debugging
@@ -443,7 +871,8 @@ def initialize(context):
             kv += k + '=' + v + ' '
         log.debug('Environment: ' + kv)
 
-    find_freesurfer_license(context, '/opt/freesurfer/license.txt')
+    with span('license'):
+        find_freesurfer_license(context, '/opt/freesurfer/license.txt')
 
     return log
 
@@ -465,7 +894,21 @@ def set_up_data(context, log):
             log.info('Downloading scans for subject "' + subject_code + '"')
 
             # Grab all T1 nifti files for this subject
-            find_and_download_files(context)
+            with span('discovery') as sp, utils.metrics.timed('discovery'):
+                find_and_download_files(context)
+                sp.set('files', len(context.gear_dict['niftis']))
+
+            # Check headers before anything is run on them
+            preflight_niftis(context)
+
+            # Only one scan per session if asked, and unique visit names
+            select_scans(context)
+            utils.metrics.gauge('grp14_timepoints',
+                                len(context.gear_dict['niftis']))
+
+            if context.gear_dict['dropped']:
+                update_gear_status('dropped-visits',
+                                   context.gear_dict['dropped'])
 
         elif context.gear_dict['run_level'] == 'session':
 
@@ -485,6 +928,1001 @@ def set_up_data(context, log):
         log.exception('Error in input download and validation.')
 
 
+def make_watchdog(context, subject_dir):
+    """Set up a Watchdog for a recon-all run from the watchdog_* config.
+
+    Memory admission needs the watchdog to follow the run's memory use, so
+    there is always one when it is on, even if it has no timeouts.
+
+    Returns:
+        watchdog (utils.watchdog.Watchdog), None if no timeouts are set and
+            memory admission is off
+    """
+
+    stall = context.config.get('watchdog_stall_timeout', 360) * 60
+    stage = context.config.get('watchdog_stage_timeout', 0) * 60
+    total = context.config.get('watchdog_global_timeout', 0) * 3600
+    stages = parse_stage_timeouts(
+        context.config.get('watchdog_stage_timeouts', ''))
+
+    if stall <= 0 and stage <= 0 and total <= 0 and not stages and \
+       context.gear_dict.get('memory_admission') is None:
+        return None
+
+    return Watchdog(os.path.join(context.gear_dict['subjects_dir'],
+                                 subject_dir),
+                    stall_timeout=stall, global_timeout=total,
+                    stage_timeout=stage, stage_timeouts=stages)
+
+
+def run_recon_all(context, cmd, dry, subject_dir, step, key=None):
+    """Run (or pretend to run) a recon-all command under the watchdog.
+
+    If the subject directory was restored from a checkpoint it is not run
+    again.  With checkpoints on, the finished directory is saved as one
+    (see make_checkpointer()).
+
+    With memory admission on, the command waits until there is enough
+    memory for it to reach its peak, and its peak memory use is saved in
+    the analysis info under "memory".
+
+    If the watchdog kills recon-all, what it saw is saved in the analysis
+    info under "watchdog".  A time point's run that fails is only tolerated
+    (a non-zero return code is returned instead of raising an exception) if
+    config drop_failed_timepoints is set, or if the watchdog killed it and
+    watchdog_action is "drop".  The reason is saved in
+    context.gear_dict['failures'][subject_dir].
+
+    Args:
+        cmd (str): the whole command line
+        dry (bool): only log the command
+        subject_dir (str): the directory recon-all is making
+        step (str): "cross-sectional", "base" or "longitudinal".  Only
+            a time point's run can be dropped, not the template's (base).
+        key (str): what the subject directory is made from, see
+            checkpoint_key()
+
+    Returns:
+        return_code (int)
+    """
+
+    if dry:
+        log.info('Not running: ' + cmd)
+        return 0
+
+    if context.gear_dict.get('terminated'):
+        raise Exception('Not running ' + subject_dir + ': the gear is ' +
+                        'being stopped')
+
+    if subject_dir in context.gear_dict['reused']:
+        log.info('Not running ' + subject_dir + ': using analysis ' +
+                 context.gear_dict['reused'][subject_dir])
+        publish_subject(context, subject_dir)
+        return 0
+    if subject_dir in context.gear_dict['restored']:
+        log.info('Not running ' + subject_dir + ': restored from checkpoint')
+        publish_subject(context, subject_dir)
+        return 0
+
+    watchdog = make_watchdog(context, subject_dir)
+    admission = context.gear_dict.get('memory_admission')
+    usage = {}
+    with span('recon-all', step=step, subject_dir=subject_dir) as sp:
+        if admission is None:
+            log.info('Running: ' + cmd)
+            run_started(context, subject_dir)
+            return_code = utils.system.run(context, cmd, ignore_errors=True,
+                                           watchdog=watchdog, usage=usage)
+        else:
+            with admission.admit(step, subject_dir, watchdog):
+                log.info('Running: ' + cmd)
+                run_started(context, subject_dir)
+                return_code = utils.system.run(context, cmd,
+                                               ignore_errors=True,
+                                               watchdog=watchdog,
+                                               usage=usage)
+            admission.record_peak(step, watchdog.peak_rss)
+        sp.set('return_code', return_code)
+        sp.set('cpu_seconds', usage.get('cpu_seconds'))
+        if watchdog and watchdog.peak_rss:
+            sp.set('peak_rss_bytes', watchdog.peak_rss)
+    utils.metrics.inc('grp14_recon_all_runs_total', step=step,
+                      return_code=return_code)
+    record_run(context, step, subject_dir, cmd, return_code, usage, watchdog)
+    run_finished(context, step, subject_dir, return_code)
+
+    if watchdog and watchdog.peak_rss:
+        peak_stage = max(watchdog.stage_peaks,
+                         key=watchdog.stage_peaks.get)
+        context.gear_dict['memory'][subject_dir] = {
+            'peak_gb': round(watchdog.peak_rss / GB, 2),
+            'peak_stage': peak_stage}
+        update_gear_status('memory', context.gear_dict['memory'])
+
+    if return_code == 0:
+        checkpointer = context.gear_dict['checkpointer']
+        if checkpointer and key:
+            checkpointer.save(subject_dir, key)
+        publish_subject(context, subject_dir)
+        return return_code
+
+    if watchdog and watchdog.expired:
+        context.gear_dict['watchdog'][subject_dir] = watchdog.expired
+        update_gear_status('watchdog', context.gear_dict['watchdog'])
+        reason = 'stopped by watchdog: ' + watchdog.expired['reason']
+        tolerated = context.config.get('watchdog_action', 'fail') == 'drop'
+    else:
+        reason = 'recon-all failed with return code ' + str(return_code)
+        tolerated = False
+
+    tolerated = tolerated or context.config.get('drop_failed_timepoints',
+                                                False)
+    context.gear_dict['failures'][subject_dir] = reason
+
+    if step != 'base' and tolerated:
+        log.error(subject_dir + ': ' + reason)
+        return return_code
+
+    raise Exception(subject_dir + ': ' + reason)
+
+
+def run_cross_sectional(context, nn, options, dry):
+    """Cross-sectional recon-all for the nn-th time point.
+
+    Returns:
+        return_code (int)
+    """
+
+    scrnum = context.gear_dict['subject_code_safe']
+    subject_dir = scrnum + "-" + context.gear_dict['visits'][nn]
+    num_niftis = str(len(context.gear_dict['niftis']))
+
+    update_gear_status('longitudinal-step', 'cross-sectional ' + \
+        subject_dir + ' (' + str(nn + 1) + ' of ' + num_niftis + \
+        ') "' + context.gear_dict['file_names'][nn] + '" ' + \
+        context.gear_dict['createds'][nn])
+
+    cmd = 'recon-all -s ' + subject_dir + \
+          ' -i ' + context.gear_dict['niftis'][nn] + ' -all -qcache' + options
+    return_code = run_recon_all(context, cmd, dry, subject_dir,
+                                'cross-sectional',
+                                checkpoint_key(context, 'cross-sectional',
+                                               nn))
+
+    set_recon_all_status(subject_dir)
+
+    return return_code
+
+
+def run_longitudinal(context, nn, options, dry):
+    """Longitudinal recon-all for the nn-th time point.
+
+    Returns:
+        return_code (int)
+    """
+
+    scrnum = context.gear_dict['subject_code_safe']
+    subject_dir = scrnum + "-" + context.gear_dict['visits'][nn]
+    num_niftis = str(len(context.gear_dict['niftis']))
+
+    update_gear_status('longitudinal-step', 'longitudinal ' +
+        subject_dir + ' (' + str(nn + 1) + ' of ' + num_niftis + \
+        ') "' + context.gear_dict['file_names'][nn] + '" ' + \
+        context.gear_dict['createds'][nn])
+
+    cmd = 'recon-all -long ' + subject_dir + ' BASE -all' + options
+    return_code = run_recon_all(context, cmd, dry,
+                                subject_dir + '.long.BASE', 'longitudinal',
+                                checkpoint_key(context, 'longitudinal', nn))
+
+    set_recon_all_status(subject_dir + '.long.BASE')
+
+    if not dry:
+        # nothing later needs more than the stats of these
+        prune_subjects(context, [subject_dir, subject_dir + '.long.BASE'])
+
+    return return_code
+
+
+def plan_step(context, step, num_runs):
+    """Decide how to share the CPUs for a step of the pipeline.
+
+    Uses config parallel_mode and n_concurrent_timepoints, see
+    utils.parallel.plan_threads().  The plan is saved in
+    context.gear_dict['parallelism'][step].
+    """
+
+    plan = plan_threads(int(context.gear_dict['cpu_count']), num_runs,
+                        context.config.get('n_concurrent_timepoints', 1),
+                        context.config.get('parallel_mode', 'none'))
+    context.gear_dict['parallelism'][step] = plan
+    context.gear_dict['step_span'] = utils.tracing.start_span(
+        step, runs=num_runs, concurrent=plan['concurrent'])
+    log.info(step + ': ' + str(plan['concurrent']) + ' at a time, ' +
+             str(plan['openmp']) + ' OpenMP threads' +
+             (' per hemisphere' if plan['hemispheres'] else ''))
+    return plan
+
+
+def finish_step(context, step, start):
+    """Save how long a step took along with its CPU plan in the analysis
+    info, so throughput can be compared between settings"""
+
+    context.gear_dict['step_span'].end()
+    plan = context.gear_dict['parallelism'][step]
+    plan['minutes'] = round((time.time() - start) / 60, 2)
+    utils.metrics.gauge('grp14_phase_duration_seconds',
+                        round(time.time() - start, 3), phase=step)
+    update_gear_status('parallelism', context.gear_dict['parallelism'])
+
+
+def open_run_history(context, log):
+    """Open the run history database (see utils.history) in the work
+    directory.
+
+    If a database from earlier gear runs is given as the run_history input,
+    it is copied and added to.
+
+    It is called from initialize(), before there is a global log, so the
+    log is passed in.
+
+    Returns:
+        history (utils.history.RunHistory), None if it can't be opened
+    """
+
+    path = os.path.join(context.work_dir, 'run_history.sqlite')
+    previous = context.get_input_path('run_history')
+    try:
+        if previous:
+            log.info('Adding to run history ' + previous)
+            shutil.copy(previous, path)
+        return RunHistory(path)
+    except (OSError, sqlite3.Error) as e:
+        msg = 'Run history is not being kept: ' + str(e)
+        log.warning(msg)
+        context.gear_dict['warnings'].append(msg)
+        return None
+
+
+def record_run(context, step, subject_dir, cmd, return_code, usage,
+               watchdog):
+    """Add a recon-all run to the run history database.
+
+    Args:
+        step (str): one of STEPS
+        subject_dir (str): the directory recon-all made
+        cmd (str): the recon-all command, the flags after "-all" are saved
+        return_code (int): of recon-all
+        usage (dict): from utils.system.run()
+        watchdog (utils.watchdog.Watchdog): for the peak memory, can be None
+    """
+
+    history = context.gear_dict['run_history']
+    if history is None or 'wall_seconds' not in usage:
+        return
+
+    with _schedule_lock:
+        run = context.gear_dict.get('schedule', {}).get('runs', {}).get(
+            subject_dir, {})
+    features = run.get('features', {})
+    cpu_model, memory_gb = context.gear_dict['machine']
+    cpu_seconds = usage['cpu_seconds']
+
+    try:
+        history.record(
+            gear_version=context.manifest_json['version'],
+            analysis_id=context.destination['id'],
+            cpu_model=cpu_model, memory_gb=memory_gb,
+            cpu_count=int(context.gear_dict['cpu_count']),
+            concurrent=context.gear_dict['parallelism'][step]['concurrent'],
+            step=step, subject_dir=subject_dir, visit=run.get('visit'),
+            flags=cmd[cmd.find(' -all'):].strip(),
+            voxels=features.get('voxels'),
+            field_strength=features.get('field_strength'),
+            wall_minutes=round(usage['wall_seconds'] / 60, 2),
+            cpu_minutes=None if cpu_seconds is None else
+                        round(cpu_seconds / 60, 2),
+            peak_rss_gb=round(watchdog.peak_rss / GB, 2) if watchdog
+                        else None,
+            return_code=return_code)
+    except sqlite3.Error as e:
+        log.warning('Could not add to run history: ' + str(e))
+
+
+def export_run_history(context):
+    """Close the run history database and, if config export_run_history is
+    set, save it as an output of the analysis"""
+
+    history = context.gear_dict.get('run_history')
+    if history is None:
+        return
+    history.close()
+    if context.config.get('export_run_history', False):
+        path = os.path.join(context.output_dir,
+                            context.gear_dict['project_label_safe'] +
+                            '_run_history.sqlite')
+        log.info('Saving run history as ' + path)
+        shutil.copy(history.path, path)
+
+
+def checkpoint_key(context, step, nn=None):
+    """Hash of what a subject directory is made from: the gear version, the
+    -3T option, and the input file of the time point (or of all of them for
+    the template).  A checkpoint is only restored if this is the same.
+
+    Args:
+        step (str): one of STEPS
+        nn (int): the time point, not used for "base"
+    """
+
+    def timepoint(nn):
+        hashes = context.gear_dict['file_hashes'][nn]
+        return [context.gear_dict['visits'][nn],
+                context.gear_dict['file_names'][nn],
+                context.gear_dict['createds'][nn],
+                hashes.get('sha256') or hashes.get('flywheel')]
+
+    made_from = {'gear_version': context.manifest_json['version'],
+                 'three_t': context.gear_dict.get('three_t', ''),
+                 'step': step}
+    if step == 'base':
+        made_from['timepoints'] = [
+            timepoint(nn) for nn in range(len(context.gear_dict['niftis']))]
+    else:
+        made_from['timepoint'] = timepoint(nn)
+    if step == 'longitudinal':
+        made_from['base'] = checkpoint_key(context, 'base')
+
+    text = json.dumps(made_from, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def make_checkpointer(context):
+    """Set up saving finished subject directories as checkpoints, if config
+    checkpoints is set.
+
+    Checkpoints are attached to the subject, or put in config
+    checkpoint_dir if it is set (a local stand-in for the Flywheel files).
+
+    Returns:
+        checkpointer (utils.checkpoint.Checkpointer), None if off
+    """
+
+    if not context.config.get('checkpoints', False):
+        return None
+
+    if context.config.get('checkpoint_dir'):
+        store = LocalStore(context.config['checkpoint_dir'])
+    else:
+        store = FlywheelStore(context.client, context.gear_dict['subject_id'])
+
+    return Checkpointer(store, context.gear_dict['subjects_dir'],
+                        context.work_dir)
+
+
+def restore_checkpoints(context):
+    """Restore the subject directories that have up to date checkpoints.
+
+    The template is only restored if all time points were, because one made
+    from other cross-sectional results would not match them, and the
+    longitudinal runs only if the template was.  What was restored is put in
+    context.gear_dict['restored'] and the analysis info.
+    """
+
+    checkpointer = context.gear_dict['checkpointer']
+    try:
+        checkpoints = checkpointer.store.list()
+    except Exception as e:
+        log.warning('Could not list checkpoints: ' + str(e))
+        return
+    if not checkpoints:
+        return
+
+    scrnum = context.gear_dict['subject_code_safe']
+    restored = context.gear_dict['restored']
+
+    def restore(subject_dir, step, nn=None):
+        try:
+            if checkpointer.restore(subject_dir,
+                                    checkpoint_key(context, step, nn),
+                                    checkpoints):
+                restored.add(subject_dir)
+                return True
+        except Exception as e:
+            log.warning('Could not restore ' + subject_dir + ': ' + str(e))
+        return False
+
+    num = len(context.gear_dict['visits'])
+    all_cross = all([restore(scrnum + '-' + context.gear_dict['visits'][nn],
+                             'cross-sectional', nn) for nn in range(num)])
+    if all_cross and restore('BASE', 'base'):
+        for nn in range(num):
+            restore(scrnum + '-' + context.gear_dict['visits'][nn] +
+                    '.long.BASE', 'longitudinal', nn)
+
+    if restored:
+        update_gear_status('restored', sorted(restored))
+
+
+def reuse_analysis(context, analysis, subject_dir, build_stamp):
+    """Try to use the subject directory in an analysis' zipped outputs as a
+    time point's cross-sectional result.
+
+    Returns:
+        reused (bool)
+    """
+
+    subjects_dir = context.gear_dict['subjects_dir']
+    for afile in analysis.files:
+        if not afile.name.endswith('.zip'):
+            continue
+        path = os.path.join(context.work_dir, afile.name)
+        log.info('Downloading ' + afile.name + ' from analysis ' +
+                 analysis.label + ' (' + analysis.id + ')')
+        try:
+            analysis.download_file(afile.name, path)
+            found = unpack_subject(path, subjects_dir, subject_dir)
+        except (OSError, zipfile.BadZipFile, ValueError) as e:
+            log.warning('Could not unpack ' + afile.name + ': ' + str(e))
+            found = False
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        if not found:
+            continue
+
+        problems = check_subject(os.path.join(subjects_dir, subject_dir),
+                                 build_stamp, context.gear_dict['three_t'])
+        if not problems:
+            return True
+        log.info('Not using ' + afile.name + ' for ' + subject_dir + ': ' +
+                 ', '.join(problems))
+        shutil.rmtree(os.path.join(subjects_dir, subject_dir))
+
+    return False
+
+
+def reuse_cross_sectional(context):
+    """Use the cross-sectional results of earlier analyses on the sessions
+    instead of running recon-all -all for those time points, if config
+    reuse_cross_sectional is set.
+
+    The analyses must be by one of the gears in config reuse_gear_names and
+    have used the same input file, see utils.reuse.  The subject directories
+    that are used are added to context.gear_dict['restored'] so they are not
+    run again, and the analysis each came from is saved in the analysis info
+    under "reused".
+    """
+
+    if not context.config.get('reuse_cross_sectional', False):
+        return
+
+    gear_names = context.config.get('reuse_gear_names',
+                                    'freesurfer-recon-all').split()
+    fs_home = context.gear_dict['environ'].get('FREESURFER_HOME', '')
+    try:
+        with open(os.path.join(fs_home, 'build-stamp.txt'), 'r') as fh:
+            build_stamp = fh.read().strip()
+    except OSError:
+        log.warning('FreeSurfer version unknown, not checking that reused ' +
+                    'results have the same version')
+        build_stamp = None
+
+    fw = context.client
+    scrnum = context.gear_dict['subject_code_safe']
+    for nn, visit in enumerate(context.gear_dict['visits']):
+        subject_dir = scrnum + '-' + visit
+        if subject_dir in context.gear_dict['restored']:
+            continue
+        try:
+            analyses = find_prior_analyses(
+                fw, context.gear_dict['session_ids'][nn],
+                context.gear_dict['file_names'][nn], gear_names)
+        except Exception as e:
+            log.warning('Could not look for analyses to reuse for ' +
+                        subject_dir + ': ' + str(e))
+            continue
+        for analysis in analyses:
+            if reuse_analysis(context, analysis, subject_dir, build_stamp):
+                log.info('Using ' + subject_dir + ' from analysis ' +
+                         analysis.label + ' (' + analysis.id + ')')
+                context.gear_dict['restored'].add(subject_dir)
+                context.gear_dict['reused'][subject_dir] = analysis.id
+                if context.gear_dict['checkpointer']:
+                    context.gear_dict['checkpointer'].save(
+                        subject_dir,
+                        checkpoint_key(context, 'cross-sectional', nn))
+                break
+
+    if context.gear_dict['reused']:
+        update_gear_status('reused', context.gear_dict['reused'])
+
+
+def make_publisher(context):
+    """Set up publishing results as they are made, from config
+    progressive_upload: "stage" puts them in the output directory, "upload"
+    also uploads them to the analysis right away.
+
+    Returns:
+        publisher (utils.results.publish.Publisher), None if "off"
+    """
+
+    mode = context.config.get('progressive_upload', 'off')
+    if mode == 'off':
+        return None
+    upload = None
+    if mode == 'upload':
+        upload = functools.partial(context.client.upload_output_to_analysis,
+                                   context.destination['id'])
+    return Publisher(context.output_dir, upload,
+                     context.gear_dict['scratch_dir'] or None)
+
+
+def publish_subject(context, subject_dir):
+    """Publish a finished subject directory.
+
+    If the subject directories are being kept and zipped, it gets its own
+    zip file, and is left out of the zip file made at the end.  Otherwise
+    only its stats and recon-all-status.log are published, in a zip file
+    that ends in "_stats.zip".  Paths in the zip files are the same as in
+    the one made at the end.
+    """
+
+    publisher = context.gear_dict['publisher']
+    if publisher is None:
+        return
+
+    path = os.path.relpath(os.path.join(
+        context.gear_dict['output_analysisid_dir'], subject_dir),
+        context.output_dir)
+    name = context.manifest_json['name'] + '_' + subject_dir
+
+    if not context.config['remove_subjects_dir'] and \
+       context.config['gear-zip-output']:
+        publisher.add_zip(name + '.zip', [path])
+        context.gear_dict['published_dirs'].append(path)
+    else:
+        publisher.add_zip(name + '_stats.zip',
+                          [os.path.join(path, 'stats'),
+                           os.path.join(path, 'scripts',
+                                        'recon-all-status.log')])
+
+
+def on_sigterm(signum, frame):
+    """Stop the gear cleanly when it is told to (e.g. a preemptible node is
+    being taken back).
+
+    recon-all is stopped, and the finished subject directories still waiting
+    to be saved as checkpoints are given until config
+    checkpoint_grace_period runs out.  Then the gear exits without zipping
+    or removing the half finished results (see execute()).
+    """
+
+    log.warning('Received signal ' + str(signum) + ', stopping')
+    context.gear_dict['terminated'] = True
+    utils.system.terminate_all()
+
+    grace = context.config.get('checkpoint_grace_period', 25)
+    deadline = time.time() + grace
+
+    checkpointer = context.gear_dict['checkpointer']
+    if checkpointer:
+        if checkpointer.flush(grace):
+            log.info('All checkpoints saved')
+        else:
+            log.warning('Not all checkpoints were saved in ' + str(grace) +
+                        ' seconds')
+
+    # results published so far are kept
+    publisher = context.gear_dict['publisher']
+    if publisher:
+        publisher.flush(max(0, deadline - time.time()))
+
+    raise SystemExit(1)
+
+
+def step_runs(context, step):
+    """The recon-all runs of a step.
+
+    Returns:
+        runs (list of tuple): subject directory, features (see
+            utils.runtime.timepoint_features()) and visit (None for the
+            template) for each run, in time point order
+    """
+
+    if step == 'base':
+        return [('BASE', {}, None)]
+
+    scrnum = context.gear_dict['subject_code_safe']
+    suffix = '.long.BASE' if step == 'longitudinal' else ''
+    runs = []
+    for nn, visit in enumerate(context.gear_dict['visits']):
+        features = timepoint_features(
+            context.gear_dict['nifti_headers'][nn],
+            context.gear_dict['field_strength'][nn])
+        runs.append((scrnum + '-' + visit + suffix, features, visit))
+    return runs
+
+
+def schedule_step(context, step, plan):
+    """Predict how long each run of a step will take, and order them so the
+    longest start first.
+
+    Started in the other order, the slowest run could start last and leave
+    most of the CPUs idle at the end of the step.  The predictions are kept
+    in context.gear_dict['schedule'] to estimate when the gear will finish
+    (see report_eta()).
+
+    Args:
+        step (str): one of STEPS
+        plan (dict): from plan_step()
+
+    Returns:
+        order (list of int): indices of the runs, longest first
+    """
+
+    predictor = context.gear_dict['runtime_predictor']
+
+    # Earlier gear runs with the same CPU plan tell how fast this machine
+    # is.  Their longitudinal runs can't be used because those are
+    # predicted from their own subject's cross-sectional runs.
+    history = context.gear_dict['run_history']
+    if history is not None and step != 'longitudinal':
+        timings = history.timings(step, int(context.gear_dict['cpu_count']),
+                                  plan['concurrent'])
+        for timing in timings:
+            predictor.record(step, timing, timing['wall_minutes'])
+        if timings:
+            log.info('Using ' + str(len(timings)) + ' ' + step +
+                     ' run(s) from the run history to predict runtimes')
+
+    runs = {}
+    for nn, (subject_dir, features, visit) in \
+            enumerate(step_runs(context, step)):
+        runs[subject_dir] = {
+            'nn': nn, 'features': features, 'visit': visit,
+            'predicted': predictor.predict(step, features, visit),
+            'start': None,
+            'done': subject_dir in context.gear_dict['restored']}
+        log.info('Predicted ' + subject_dir + ': {:.0f} minutes'.format(
+            runs[subject_dir]['predicted']))
+
+    with _schedule_lock:
+        context.gear_dict['schedule'] = {
+            'step': step, 'concurrent': plan['concurrent'], 'runs': runs}
+
+    report_eta(context)
+
+    return longest_first({run['nn']: run['predicted']
+                          for run in runs.values()})
+
+
+def run_started(context, subject_dir):
+    """Note the time a scheduled run started"""
+
+    with _schedule_lock:
+        run = context.gear_dict.get('schedule', {}).get('runs', {}).get(
+            subject_dir)
+        if run:
+            run['start'] = time.time()
+
+
+def run_finished(context, step, subject_dir, return_code):
+    """Learn from how long a run took, save it with the prediction in the
+    analysis info under "runtimes", and update the ETA"""
+
+    with _schedule_lock:
+        run = context.gear_dict.get('schedule', {}).get('runs', {}).get(
+            subject_dir)
+        if not run or run['start'] is None:
+            return
+        run['done'] = True
+        minutes = (time.time() - run['start']) / 60
+        if return_code == 0:
+            context.gear_dict['runtime_predictor'].record(
+                step, run['features'], minutes, run['visit'])
+        context.gear_dict['runtimes'][subject_dir] = {
+            'predicted': round(run['predicted'], 1),
+            'minutes': round(minutes, 1)}
+
+    update_gear_status('runtimes', context.gear_dict['runtimes'])
+    report_eta(context)
+
+
+def report_eta(context):
+    """Estimate when the gear will finish and put it in the analysis info
+    under "eta".
+
+    The runs of the current step that are going have their predicted time
+    left, then the rest are started longest first as the concurrent slots
+    free up.  The later steps are predicted the same way.
+    """
+
+    predictor = context.gear_dict['runtime_predictor']
+    now = time.time()
+
+    with _schedule_lock:
+        schedule = context.gear_dict['schedule']
+        busy = []
+        waiting = []
+        for run in schedule['runs'].values():
+            if run['done']:
+                continue
+            if run['start'] is None:
+                waiting.append(run['predicted'])
+            else:
+                busy.append(max(0.0, run['predicted'] -
+                                (now - run['start']) / 60))
+        minutes = list_schedule(sorted(waiting, reverse=True),
+                                schedule['concurrent'], busy)
+
+        for step in STEPS[STEPS.index(schedule['step']) + 1:]:
+            runs = step_runs(context, step)
+            predicted = [predictor.predict(step, features, visit)
+                         for _, features, visit in runs]
+            if step == 'base':
+                concurrent = 1
+            else:
+                concurrent = plan_threads(
+                    int(context.gear_dict['cpu_count']), len(runs),
+                    context.config.get('n_concurrent_timepoints', 1),
+                    context.config.get('parallel_mode', 'none'))['concurrent']
+            minutes += list_schedule(sorted(predicted, reverse=True),
+                                     concurrent)
+
+    update_gear_status('eta', {
+        'step': schedule['step'],
+        'minutes_left': int(round(minutes)),
+        'finish': time.strftime('%Y-%m-%d %H:%M UTC',
+                                time.gmtime(now + minutes * 60))})
+
+
+def pruning(context):
+    """Subject directories are only pruned in disk budget mode, and when
+    they are not being returned"""
+
+    return context.gear_dict['disk']['budget_gb'] > 0 and \
+        context.config['remove_subjects_dir']
+
+
+def check_disk_budget(context, when):
+    """Fail early if SUBJECTS_DIR is going to use more disk than config
+    disk_budget_gb allows.
+
+    The peak is projected with utils.disk.project_peak() from the sizes in
+    context.gear_dict['disk_sizes'], which start as typical sizes and are
+    replaced by the real ones as the steps finish.
+
+    Args:
+        when (str): for the message, e.g. "after cross-sectional"
+    """
+
+    disk = context.gear_dict['disk']
+    if disk['budget_gb'] <= 0:
+        return
+
+    num_timepoints = len(context.gear_dict['niftis'])
+    concurrent = plan_threads(int(context.gear_dict['cpu_count']),
+                              num_timepoints,
+                              context.config.get('n_concurrent_timepoints', 1),
+                              context.config.get('parallel_mode', 'none')
+                              )['concurrent']
+    projected = project_peak(num_timepoints, concurrent,
+                             context.gear_dict['disk_sizes'],
+                             pruning(context)) / GB
+    disk['projected_gb'] = round(projected, 2)
+    update_gear_status('disk', disk)
+    log.info('Projected peak disk use ' + when + ' is ' +
+             '{:.1f} GB, budget is {} GB'.format(projected,
+                                                   disk['budget_gb']))
+
+    if projected > disk['budget_gb']:
+        msg = 'Projected peak disk use ' + when + ' is ' + \
+              '{:.1f} GB, more than disk_budget_gb {}'.format(
+                  projected, disk['budget_gb'])
+        if not pruning(context):
+            msg += ' (set remove_subjects_dir to prune subject directories)'
+        raise Exception(msg)
+
+
+def check_free_space(context, step):
+    """Fail before a step if there is not enough free space in SUBJECTS_DIR
+    for the subject directories it will make (sizes as in
+    check_disk_budget()).  Directories that were restored or reused are
+    already there."""
+
+    done = context.gear_dict['restored'] | set(context.gear_dict['reused'])
+    num_runs = len([run for run in step_runs(context, step)
+                    if run[0] not in done])
+    needed = num_runs * context.gear_dict['disk_sizes'][step]
+    free = shutil.disk_usage(context.gear_dict['subjects_dir']).free
+    if needed > free:
+        raise Exception('Not enough disk space for ' + step + ' in ' +
+                        context.gear_dict['subjects_dir'] + ': ' +
+                        '{:.1f} GB needed, {:.1f} GB free'.format(
+                            needed / GB, free / GB))
+
+
+def move_from_scratch(context):
+    """Move what is being kept from the scratch directory to the output
+    directory, then remove the scratch directory.
+
+    With remove_subjects_dir set only the tables are kept.  Subject
+    directories already published in their own zip files are left out.
+    """
+
+    scratch = context.gear_dict['subjects_dir']
+    out = context.gear_dict['output_analysisid_dir']
+    if not context.gear_dict['scratch_dir'] or not os.path.exists(scratch):
+        return
+
+    keep = []
+    for name in sorted(os.listdir(scratch)):
+        path = os.path.join(scratch, name)
+        if context.config['remove_subjects_dir'] and name != 'tables':
+            continue
+        if os.path.relpath(os.path.join(out, name), context.output_dir) in \
+           context.gear_dict['published_dirs']:
+            continue
+        keep.append(path)
+
+    size = sum(directory_size(pp) if os.path.isdir(pp) and
+               not os.path.islink(pp) else os.lstat(pp).st_size
+               for pp in keep)
+    os.makedirs(out, exist_ok=True)
+    free = shutil.disk_usage(out).free
+    if size > free:
+        raise Exception('Not enough disk space in ' + out + ' for the ' +
+                        'results: {:.1f} GB needed, {:.1f} GB free'.format(
+                            size / GB, free / GB))
+
+    start = time.time()
+    for path in keep:
+        dest = os.path.join(out, os.path.basename(path))
+        if os.path.lexists(dest):
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                shutil.rmtree(dest)
+            else:
+                os.remove(dest)
+        shutil.move(path, dest)
+    log.info('Moved {:.2f} GB from '.format(size / GB) + scratch + ' in ' +
+             '{:.1f} seconds'.format(time.time() - start))
+
+    remove_scratch(context)
+
+
+def remove_scratch(context):
+    """Remove this analysis' part of the scratch directory"""
+
+    path = os.path.join(context.gear_dict['scratch_dir'],
+                        context.destination['id'])
+    if context.gear_dict['scratch_dir'] and os.path.exists(path):
+        discard(context, path)
+
+
+def discard(context, path):
+    """Remove a directory in the background (see utils.cleanup.Cleaner).
+
+    It is moved to a trash directory at the top of the scratch directory or
+    of the output directory, whichever it is in, so it is on the same file
+    system.  Trash in the output directory is waited for before the gear
+    exits, see wait_for_cleanup().
+    """
+
+    top = context.output_dir
+    scratch = context.gear_dict['scratch_dir']
+    if scratch and os.path.abspath(path).startswith(
+            os.path.abspath(scratch) + os.sep):
+        top = scratch
+    log.debug('removing "' + path + '"')
+    context.gear_dict['cleaner'].discard(path, os.path.join(top, TRASH))
+
+
+def wait_for_cleanup(context):
+    """Wait until nothing is left to delete in the output directory (or on
+    its file system), so nothing is there when it is uploaded.  Trash on
+    other file systems (e.g. a scratch directory) is not waited for."""
+
+    start = time.time()
+    with span('cleanup'), utils.metrics.timed('cleanup'):
+        context.gear_dict['cleaner'].wait(
+            os.path.join(context.output_dir, TRASH))
+    log.info('Cleaned up in {:.1f} seconds'.format(time.time() - start))
+    if context.gear_dict['scratch_dir']:
+        # only removed if it is already empty
+        context.gear_dict['cleaner'].wait(
+            os.path.join(context.gear_dict['scratch_dir'], TRASH), 0)
+
+
+def measure_disk_sizes(context, step, subject_dirs):
+    """Use the real size of the subject directories a step made in later
+    projections.  Longitudinal directories are assumed to be as much bigger
+    or smaller than typical as the time points are."""
+
+    out = context.gear_dict['subjects_dir']
+    sizes = [directory_size(os.path.join(out, sd)) for sd in subject_dirs]
+    sizes = [ss for ss in sizes if ss > 0]
+    if not sizes:
+        return
+    average = sum(sizes) / len(sizes)
+    disk_sizes = context.gear_dict['disk_sizes']
+    if step == 'cross-sectional':
+        disk_sizes['longitudinal'] = DEFAULT_SIZES['longitudinal'] * \
+            average / DEFAULT_SIZES['cross-sectional']
+    disk_sizes[step] = average
+
+
+def prune_subjects(context, subject_dirs):
+    """Cut subject directories down to what the tables and logs need, see
+    utils.disk.prune_subject().
+
+    Checkpoints are made from the whole directories, so any that are queued
+    are waited for first.
+    """
+
+    if not pruning(context):
+        return
+
+    if context.gear_dict['checkpointer']:
+        context.gear_dict['checkpointer'].flush()
+
+    out = context.gear_dict['subjects_dir']
+    freed = 0
+    for subject_dir in subject_dirs:
+        freed += prune_subject(os.path.join(out, subject_dir))
+    if freed:
+        log.info('Pruned ' + ', '.join(subject_dirs) +
+                 ' ({:.2f} GB)'.format(freed / GB))
+    with _schedule_lock:
+        disk = context.gear_dict['disk']
+        disk['pruned_gb'] = round(disk['pruned_gb'] + freed / GB, 2)
+
+
+def stop_disk_monitor(context):
+    """Stop sampling the disk use, after a last sample"""
+
+    monitor = context.gear_dict['disk_monitor']
+    if monitor is None:
+        return
+    monitor.stop()
+    monitor.join()
+
+
+def report_disk(context):
+    """Save the peak disk use in the analysis info"""
+
+    monitor = context.gear_dict['disk_monitor']
+    if monitor is None:
+        return
+    monitor.sample()
+    disk = context.gear_dict['disk']
+    disk['peak_gb'] = round(monitor.peak / GB, 2)
+    update_gear_status('disk', disk)
+
+
+def write_dropped_table(context, tables_dir):
+    """List the files that were found but not processed in a csv file.
+
+    The columns are like the other tables: study, scrnum, visit, then the
+    file name and the reason it was dropped.
+    """
+
+    if not context.gear_dict['dropped'] or not os.path.isdir(tables_dir):
+        return
+
+    study = context.gear_dict['project_label_safe']
+    scrnum = context.gear_dict['subject_code_safe']
+    path = os.path.join(tables_dir, study + '_dropped_visits.csv')
+    log.info('Writing ' + path)
+
+    with open(path, 'w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['study', 'scrnum', 'visit', 'file_name', 'reason'])
+        for dropped in context.gear_dict['dropped']:
+            writer.writerow([study, scrnum, dropped['visit'],
+                             dropped['file_name'], dropped['reason']])
+
+
 def field_strength_close_enough(field_strength, desired_value):
     """Check if the given value is "close enough" to the desired value
     
@@ -497,6 +1935,9 @@ def field_strength_close_enough(field_strength, desired_value):
             as opposed to 1.5.
     """
 
+    if field_strength is None:
+        return False
+
     if field_strength > 100:  # assume it is in mT instead of Teslas
         field_strength /= 1000  # and turn it into Teslas
 
@@ -535,7 +1976,9 @@ def execute(context, log):
 
             # Create output directory
             log.info('Creating ' + context.gear_dict['output_analysisid_dir'])
-            out = context.gear_dict['output_analysisid_dir']
+            if not os.path.exists(context.gear_dict['output_analysisid_dir']):
+                os.makedirs(context.gear_dict['output_analysisid_dir'])
+            out = context.gear_dict['subjects_dir']
             if not os.path.exists(out):
                 os.makedirs(out)
 
@@ -543,13 +1986,16 @@ def execute(context, log):
             # The longitudinal pipeline, huzzah! #
             # ---------------------------------- #
 
-            options = ' -openmp ' + context.gear_dict['cpu_count'] # zoom zomm
-
-            if '3T' in context.config:
-                options += ' -3T'
+            # the same field strength option is used for all recon-all runs
+            three_t = ''
+            if '3T' in context.config or \
+               any(field_strength_close_enough(fs, 3)
+                   for fs in context.gear_dict['field_strength']):
+                three_t = ' -3T'
+            context.gear_dict['three_t'] = three_t
 
             subjects_dir = '/opt/freesurfer/subjects/'
-            output_dir = context.gear_dict['output_analysisid_dir']
+            output_dir = context.gear_dict['subjects_dir']
 
             # first link averages
             fst_links_to_make = ["fsaverage", "lh.EC_average","rh.EC_average"]
@@ -563,36 +2009,81 @@ def execute(context, log):
                 else:
                     log.info('Link exists ' + link)
 
+            # save finished subject directories so a gear that is stopped
+            # can carry on from them when it is run again
+            signal.signal(signal.SIGTERM, on_sigterm)
+            context.gear_dict['publisher'] = make_publisher(context)
+            context.gear_dict['checkpointer'] = make_checkpointer(context)
+            if context.gear_dict['checkpointer']:
+                restore_checkpoints(context)
+            reuse_cross_sectional(context)
+
             # Run cross-sectional analysis on each nifti
             # study is freesurfer's SUBJECTS_DIR
             scrnum = context.gear_dict['subject_code_safe']
-            num_niftis = str(len(context.gear_dict['niftis']))
 
-            for nn, nifti in enumerate(context.gear_dict['niftis']):
-
-                if field_strength_close_enough(
-                    context.gear_dict['field_strength'][nn], 3):
-                        if ' -3T' not in options:
-                            options += ' -3T'
-
-                subject_dir = scrnum + "-" + context.gear_dict['visits'][nn]
-
-                update_gear_status('longitudinal-step', 'cross-sectional ' + \
-                    subject_dir + ' (' + str(nn + 1) + ' of ' + num_niftis + \
-                    ') "' + context.gear_dict['file_names'][nn] + '" ' + \
-                    context.gear_dict['createds'][nn])
-
-                cmd = 'recon-all -s ' + subject_dir + \
-                      ' -i ' + nifti + ' -all -qcache' + options
-                if dry:
-                    log.info('Not running: ' + cmd)
+            # fail now if the subject directories won't fit in the budget,
+            # and follow the disk use when it matters (a budget or a scratch
+            # directory to fill)
+            if context.gear_dict['disk']['budget_gb'] > 0 or \
+               context.gear_dict['scratch_dir']:
+                context.gear_dict['disk_monitor'] = DiskMonitor(out)
+                context.gear_dict['disk_monitor'].start()
+            check_disk_budget(context, 'before recon-all')
+
+            # runs going at the same time only start when their peak memory
+            # will fit
+            if context.config.get('memory_admission', True):
+                context.gear_dict['memory_admission'] = MemoryAdmission(
+                    parse_memory_estimates(
+                        context.config.get('memory_estimates', '')))
+
+            # with drop_failed_timepoints (or watchdog_action "drop"), a time
+            # point that fails is left out and the pipeline goes on
+            failed = []  # indices of time points that failed
+
+            if not dry:
+                check_free_space(context, 'cross-sectional')
+            plan = plan_step(context, 'cross-sectional',
+                             len(context.gear_dict['niftis']))
+            options = plan_options(plan) + three_t
+            start = time.time()
+            order = schedule_step(context, 'cross-sectional', plan)
+            jobs = [functools.partial(run_cross_sectional, context, nn,
+                                      options, dry)
+                    for nn in order]
+            with utils.profiling.paused():
+                results = run_jobs(jobs, plan['concurrent'])
+            for nn, rc in zip(order, results):
+                if rc == 0:
+                    ret.append(rc)
                 else:
-                    log.info('Running: ' + cmd)
-                    ret.append(utils.system.run(context, cmd))
+                    failed.append(nn)
+            finish_step(context, 'cross-sectional', start)
+
+            # leave out the time points that failed
+            dropped_dirs = []
+            for nn in sorted(failed, reverse=True):
+                subject_dir = scrnum + '-' + context.gear_dict['visits'][nn]
+                dropped_dirs.append(subject_dir)
+                drop_timepoint(context, nn, 'cross-sectional ' +
+                               context.gear_dict['failures'][subject_dir])
+            if failed:
+                update_gear_status('dropped-visits',
+                                   context.gear_dict['dropped'])
+                prune_subjects(context, dropped_dirs)
 
-                set_recon_all_status(subject_dir)
+            num_niftis = str(len(context.gear_dict['niftis']))
+            if failed and len(context.gear_dict['niftis']) < MIN_TIMEPOINTS:
+                raise Exception('Only ' + num_niftis + ' time point(s) ' +
+                                'left, at least ' + str(MIN_TIMEPOINTS) +
+                                ' are needed to create the template')
 
-                set_recon_all_status(subject_dir)
+            if not dry:
+                measure_disk_sizes(context, 'cross-sectional',
+                                   [scrnum + '-' + vv for vv in
+                                    context.gear_dict['visits']])
+                check_disk_budget(context, 'after cross-sectional')
 
             # Create template
             cmd = 'recon-all -base BASE '
@@ -605,34 +2096,64 @@ def execute(context, log):
 
                 cmd += '-tp ' + subject_dir + ' '
 
-            cmd += '-all' + options
-            if dry:
-                log.info('Not running: ' + cmd)
-            else:
-                log.info('Running: ' + cmd)
-                ret.append(utils.system.run(context, cmd))
+            if not dry:
+                check_free_space(context, 'base')
+            plan = plan_step(context, 'base', 1)
+            cmd += '-all' + plan_options(plan) + three_t
+            start = time.time()
+            schedule_step(context, 'base', plan)
+            with utils.profiling.paused():
+                ret.append(run_recon_all(context, cmd, dry, 'BASE', 'base',
+                                         checkpoint_key(context, 'base')))
+            finish_step(context, 'base', start)
 
             set_recon_all_status('BASE')
 
-            # Run longitudinal on each time point
-
-            for nn, nifti in enumerate(context.gear_dict['niftis']):
-
-                subject_dir = scrnum + "-" + context.gear_dict['visits'][nn]
+            if not dry:
+                measure_disk_sizes(context, 'base', ['BASE'])
+                check_disk_budget(context, 'after base')
 
-                update_gear_status('longitudinal-step', 'longitudinal ' +
-                    subject_dir + ' (' + str(nn + 1) + ' of ' + num_niftis + \
-                    ') "' + context.gear_dict['file_names'][nn] + '" ' + \
-                    context.gear_dict['createds'][nn])
+            # Run longitudinal on each time point
 
-                cmd = 'recon-all -long ' + subject_dir + ' BASE -all' + options
-                if dry:
-                    log.info('Not running: ' + cmd)
+            failed = []
+            if not dry:
+                check_free_space(context, 'longitudinal')
+            plan = plan_step(context, 'longitudinal',
+                             len(context.gear_dict['niftis']))
+            options = plan_options(plan) + three_t
+            start = time.time()
+            order = schedule_step(context, 'longitudinal', plan)
+            jobs = [functools.partial(run_longitudinal, context, nn,
+                                      options, dry)
+                    for nn in order]
+            with utils.profiling.paused():
+                results = run_jobs(jobs, plan['concurrent'])
+            for nn, rc in zip(order, results):
+                if rc == 0:
+                    ret.append(rc)
                 else:
-                    log.info('Running: ' + cmd)
-                    ret.append(utils.system.run(context, cmd))
-
-                set_recon_all_status(subject_dir + '.long.BASE')
+                    failed.append(nn)
+            finish_step(context, 'longitudinal', start)
+
+            # failed longitudinal runs are left out of the tables
+            exclude = []
+            dropped_dirs = ['BASE']  # no longer needed by anything
+            for nn in sorted(failed, reverse=True):
+                long_dir = scrnum + '-' + context.gear_dict['visits'][nn] + \
+                           '.long.BASE'
+                exclude.append(long_dir)
+                dropped_dirs.append(long_dir[:-len('.long.BASE')])
+                dropped_dirs.append(long_dir)
+                drop_timepoint(context, nn, 'longitudinal ' +
+                               context.gear_dict['failures'][long_dir])
+            if not dry:
+                prune_subjects(context, dropped_dirs)
+                report_disk(context)
+            if failed:
+                update_gear_status('dropped-visits',
+                                   context.gear_dict['dropped'])
+                if not context.gear_dict['niftis']:
+                    raise Exception('All longitudinal runs failed')
 
             update_gear_status('longitudinal-step', 'all steps completed')
 
@@ -640,9 +2161,46 @@ def execute(context, log):
             # aseg.stats and ?h.aparc.stats.  Then modify the results.
             # freesurfer_tables.pl
             os.chdir(out)
-            cmd = '/flywheel/v0/freesurfer_tables.pl .'
+            cmd = '/flywheel/v0/freesurfer_tables.pl'
+            if exclude:
+                cmd += ' -x ' + ','.join(exclude)
+            if context.gear_dict['extra_parcellations']:
+                cmd += ' -p ' + ','.join(
+                    context.gear_dict['extra_parcellations'])
+            if context.gear_dict['extra_measures']:
+                cmd += ' -m ' + ','.join(context.gear_dict['extra_measures'])
+            cmd += ' -j ' + context.gear_dict['cpu_count'] + ' .'
             log.info('Running: ' + cmd)
-            ret.append(utils.system.run(context, cmd))
+            with span('tables') as sp, utils.metrics.timed('tables'):
+                ret.append(utils.system.run(context, cmd))
+                sp.set('return_code', ret[-1])
+
+            write_dropped_table(context, out + '/tables')
+
+            dates = {visit: parse_date(created) for visit, created in
+                     zip(context.gear_dict['visits'],
+                         context.gear_dict['createds'])}
+            # these are extras, they should not fail the analysis
+            if context.config.get('change_tables'):
+                try:
+                    with span('change_tables') as sp:
+                        sp.set('tables', len(write_change_tables(
+                            out + '/tables', dates)))
+                except Exception as e:
+                    context.gear_dict['warnings'].append(e)
+                    log.warning('Unable to make the change tables: ' +
+                                str(e))
+
+            try:
+                publish_summary_metrics(context, out + '/tables', dates)
+            except Exception as e:
+                context.gear_dict['warnings'].append(e)
+                log.warning('Unable to publish the summary metrics: ' +
+                            str(e))
+
+            if context.gear_dict['publisher']:
+                for ff in glob.glob(out + '/tables/*'):
+                    context.gear_dict['publisher'].add_file(ff)
 
         log.info('Return codes: ' + repr(ret))
 
@@ -661,11 +2219,44 @@ def execute(context, log):
 
     finally:
 
+        export_run_history(context)
+        # also when the gear was stopped or failed
+        stop_disk_monitor(context)
+        report_disk(context)
+
+        if context.gear_dict.get('terminated'):
+            # the subject directories are half finished, there is nothing
+            # useful to zip
+            log.warning('Gear was stopped.  Run it again to carry on ' +
+                        'from the checkpoints.')
+            remove_scratch(context)
+            wait_for_cleanup(context)
+            stop_metrics(1)
+            os.sys.exit(1)
+
+        # removing the subject directories must wait for checkpoints
+        # and results being published
+        if context.gear_dict['checkpointer']:
+            context.gear_dict['checkpointer'].flush()
+        published = set()
+        if context.gear_dict['publisher']:
+            context.gear_dict['publisher'].flush()
+            published = context.gear_dict['publisher'].published
+
+        try:
+            with span('move-from-scratch'):
+                move_from_scratch(context)
+        except Exception as e:
+            context.gear_dict['errors'].append(e)
+            log.critical(e)
+            log.exception('Unable to move results from scratch directory.')
+
         # Copy summary csv files to top-level output
         files = glob.glob(context.gear_dict['output_analysisid_dir'] + \
                          '/tables/*')
         for ff in files:
-            shutil.copy(ff,context.output_dir)
+            if os.path.basename(ff) not in published:
+                shutil.copy(ff,context.output_dir)
 
         if context.config['remove_subjects_dir']:
             # Remove all of Freesurfer's subject  directories
@@ -676,18 +2267,24 @@ def execute(context, log):
                         os.unlink(path)
                         log.debug('removing link "' + path + '"')
                     elif os.path.isdir(path):
-                        log.debug('removing subject directory "' + path + '"')
-                        shutil.rmtree(path)
+                        discard(context, path)
 
         # Default config: zip entire output/<analysis_id> folder
         if os.path.exists(context.gear_dict['output_analysisid_dir']):
             if context.config['gear-zip-output']:
 
-                zip_output(context)
+                # files are removed as they are zipped
+                with span('zip'), utils.metrics.timed('zip'):
+                    dest_zip = zip_output(
+                        context, exclude=context.gear_dict['published_dirs'],
+                        remove=True)
+                if dest_zip:
+                    utils.metrics.gauge('grp14_archive_bytes',
+                                        os.path.getsize(dest_zip))
 
                 path = context.output_dir + '/' + context.destination['id']
-                log.debug('removing output directory "' + path + '"')
-                shutil.rmtree(path)
+                if os.path.exists(path):
+                    discard(context, path)
 
             else:
                 log.info('NOT zipping output directory "' +
@@ -719,6 +2316,9 @@ def execute(context, log):
             log.info(msg)
             return_code = 1
 
+        wait_for_cleanup(context)
+        stop_metrics(return_code)
+
         log.info('Gear is done.  Returning '+str(return_code))
         os.sys.exit(return_code)
 
@@ -727,9 +2327,20 @@ if __name__ == '__main__':
 
     context = flywheel.GearContext()
 
-    log = initialize(context)
+    start_trace(context)
+    start_metrics(context)
+    start_profile(context)
+
+    with span('gear'):
+
+        with span('initialize'), utils.metrics.timed('initialize'), \
+                utils.profiling.phase('initialize'):
+            log = initialize(context)
 
-    if len(context.gear_dict['errors']) == 0:
-        set_up_data(context, log)
+        if len(context.gear_dict['errors']) == 0:
+            with span('set_up_data'), utils.profiling.phase('set_up_data'):
+                set_up_data(context, log)
 
-    execute(context, log)
+        # recon-all runs are left out of the profile
+        with utils.profiling.phase('execute'):
+            execute(context, log)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Rates of change of tables that freesurfer_tables.pl can leave behind
+
+Run from the top of the repository:
+
+    python3 -m unittest discover tests
+"""
+
+import csv
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils.results.change_rates import write_change_tables
+
+
+DATES = {'V01': datetime.datetime(2018, 1, 1),
+         'V02': datetime.datetime(2019, 1, 1)}
+
+
+class WriteChangeTablesTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tables_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tables_dir)
+
+    def write(self, name, rows):
+
+        with open(os.path.join(self.tables_dir, name), 'w', newline='') as fh:
+            csv.writer(fh).writerows(rows)
+
+    def read(self, name):
+
+        with open(os.path.join(self.tables_dir, name), 'r', newline='') as fh:
+            return list(csv.reader(fh))
+
+    def test_header_only_tables_are_skipped(self):
+
+        self.write('Study_aparc.a2009s_thick.csv',
+                   [['study', 'scrnum', 'visit', 'lh_G_front_middle']])
+        self.write('freesurfer_wmparc_vol.csv', [['Measure:volume']])
+        self.write('empty.csv', [])
+        self.write('Study_aseg_vol.csv',
+                   [['study', 'scrnum', 'visit', 'Left-Hippocampus'],
+                    ['Study', 'S1', 'V01', '4000'],
+                    ['Study', 'S1', 'V02', '3960']])
+
+        written = write_change_tables(self.tables_dir, DATES)
+
+        self.assertEqual(sorted(os.path.basename(ww) for ww in written),
+                         ['Study_aseg_vol_change.csv',
+                          'Study_aseg_vol_pct_change.csv',
+                          'Study_aseg_vol_slope.csv'])
+        slope = self.read('Study_aseg_vol_slope.csv')
+        self.assertEqual(slope[0], ['study', 'scrnum', 'visits', 'years',
+                                    'Left-Hippocampus'])
+        self.assertAlmostEqual(float(slope[1][4]), -40 * 365.25 / 365, 3)
+
+    def test_short_rows_are_missing_values(self):
+
+        self.write('Study_aseg_vol.csv',
+                   [['study', 'scrnum', 'visit', 'A', 'B'],
+                    ['Study', 'S1', 'V01', '10', '20'],
+                    ['Study', 'S1', 'V02', '12']])
+
+        write_change_tables(self.tables_dir, DATES)
+
+        change = self.read('Study_aseg_vol_change.csv')
+        self.assertEqual(change[1][:4], ['Study', 'S1', 'V02', 'V01'])
+        self.assertEqual(change[1][6], '')
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Opening the run history database given as the run_history input
+
+run.py needs the Flywheel SDK, so this is run in the gear's image, from
+/flywheel/v0:
+
+    python3 -m unittest discover tests
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from utils.history import RunHistory
+
+try:
+    import run
+except ImportError as e:  # no Flywheel SDK
+    run = None
+    reason = str(e)
+else:
+    reason = ''
+
+
+log = logging.getLogger(__name__)
+
+
+@unittest.skipIf(run is None, reason)
+class OpenRunHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.work_dir = tempfile.mkdtemp()
+        self.input_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.work_dir)
+        shutil.rmtree(self.input_dir)
+
+    def context(self, previous):
+
+        return types.SimpleNamespace(
+            work_dir=self.work_dir,
+            get_input_path=lambda name: previous,
+            gear_dict={'warnings': []})
+
+    def test_previous_database_is_added_to(self):
+
+        previous = os.path.join(self.input_dir, 'run_history.sqlite')
+        history = RunHistory(previous)
+        history.record(step='cross-sectional', cpu_count=4, concurrent=1,
+                       voxels=100, wall_minutes=300.0, return_code=0)
+        history.close()
+
+        context = self.context(previous)
+        history = run.open_run_history(context, log)
+
+        self.assertIsNotNone(history)
+        self.assertEqual(history.path,
+                         os.path.join(self.work_dir, 'run_history.sqlite'))
+        self.assertEqual(len(history.timings('cross-sectional', 4, 1)), 1)
+        history.close()
+        self.assertEqual(context.gear_dict['warnings'], [])
+
+    def test_unreadable_database_is_a_warning(self):
+
+        previous = os.path.join(self.input_dir, 'run_history.sqlite')
+        with open(previous, 'wb') as fh:
+            fh.write(b'not a database' * 100)
+
+        context = self.context(previous)
+
+        self.assertIsNone(run.open_run_history(context, log))
+        self.assertEqual(len(context.gear_dict['warnings']), 1)
+
+    def test_missing_database_is_a_warning(self):
+
+        context = self.context(os.path.join(self.input_dir, 'missing'))
+
+        self.assertIsNone(run.open_run_history(context, log))
+        self.assertEqual(len(context.gear_dict['warnings']), 1)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Do slow work (packing, uploading) in the background, one task at a time
+"""
+
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class Worker:
+    """A thread that calls queued functions in order.
+
+    An exception in a task is logged and the next task goes on, so nothing
+    done here can stop the gear.
+
+    Args:
+        name (str): for log messages
+    """
+
+    def __init__(self, name):
+
+        self.name = name
+        self._queue = []
+        self._busy = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args):
+        """Queue function(*args) and return right away"""
+
+        with self._condition:
+            self._queue.append((function, args))
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until all queued tasks are done.
+
+        Returns:
+            done (bool): False if it timed out
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._queue or self._busy:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    return False
+                self._condition.wait(left)
+        return True
+
+    def _loop(self):
+
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                function, args = self._queue.pop(0)
+                self._busy = True
+            try:
+                function(*args)
+            except Exception as e:
+                log.warning(self.name + ': ' + str(e))
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
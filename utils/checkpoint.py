@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Save finished FreeSurfer subject directories as checkpoints, and restore
+them when the gear is run again
+
+A checkpoint is a .tar.gz of one subject directory (a time point, BASE, or a
+.long.BASE directory) stored with a key that says what it was made from.  It
+is only restored if the key is the same, so a changed input or gear version
+is run again.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+from utils.background import Worker
+
+
+log = logging.getLogger(__name__)
+
+
+PREFIX = 'grp14_checkpoint_'
+
+
+class FlywheelStore:
+    """Checkpoints are files attached to a Flywheel container (e.g. the
+    subject) with the key in the file's info.
+
+    Args:
+        fw (flywheel.Client)
+        container_id (str)
+    """
+
+    def __init__(self, fw, container_id):
+
+        self.fw = fw
+        self.container_id = container_id
+
+    def list(self):
+        """Checkpoint files as a list of dict: name, modified (seconds) and
+        info"""
+
+        container = self.fw.get(self.container_id)
+        return [{'name': ff.name, 'modified': ff.modified.timestamp(),
+                 'info': ff.info or {}}
+                for ff in container.files if ff.name.startswith(PREFIX)]
+
+    def upload(self, path, info):
+
+        container = self.fw.get(self.container_id)
+        container.upload_file(path)
+        container.update_file_info(os.path.basename(path), info)
+
+    def download(self, name, path):
+
+        self.fw.get(self.container_id).download_file(name, path)
+
+
+class LocalStore:
+    """Checkpoints in a local directory, with the info in a .json file next
+    to each.  Works like FlywheelStore, for testing or a shared file system.
+
+    Args:
+        directory (str): created if it does not exist
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def list(self):
+
+        checkpoints = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.startswith(PREFIX) or \
+               name.endswith('.json') or name.endswith('.part'):
+                continue
+            try:
+                with open(path + '.json', 'r') as fh:
+                    info = json.load(fh)
+            except (OSError, ValueError):
+                info = {}
+            checkpoints.append({'name': name,
+                                'modified': os.path.getmtime(path),
+                                'info': info})
+        return checkpoints
+
+    def upload(self, path, info):
+
+        dest = os.path.join(self.directory, os.path.basename(path))
+        # write then rename so a half copied file is never listed
+        shutil.copy(path, dest + '.part')
+        with open(dest + '.json', 'w') as fh:
+            json.dump(info, fh)
+        os.replace(dest + '.part', dest)
+
+    def download(self, name, path):
+
+        shutil.copy(os.path.join(self.directory, name), path)
+
+
+class Checkpointer:
+    """Save finished subject directories in the background.
+
+    save() queues a directory and returns right away, one thread packs and
+    uploads them in order so recon-all runs are not held up.  flush() waits
+    for the queue to empty, e.g. when the gear is being stopped.
+
+    Args:
+        store (FlywheelStore or LocalStore)
+        subjects_dir (str): FreeSurfer's SUBJECTS_DIR
+        work_dir (str): where to make the archives
+    """
+
+    def __init__(self, store, subjects_dir, work_dir):
+
+        self.store = store
+        self.subjects_dir = subjects_dir
+        self.work_dir = work_dir
+        self.saved = []  # subject directories that were uploaded
+        self._worker = Worker('Checkpoints')
+
+    def save(self, subject_dir, key):
+        """Queue a finished subject directory to be saved"""
+
+        self._worker.submit(self._upload, subject_dir, key)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued has been saved.
+
+        Returns:
+            done (bool): False if it timed out
+        """
+
+        return self._worker.flush(timeout)
+
+    def _upload(self, subject_dir, key):
+
+        start = time.time()
+        path = os.path.join(self.work_dir, PREFIX + subject_dir + '.tar.gz')
+        try:
+            with tarfile.open(path, 'w:gz', compresslevel=1) as tar:
+                tar.add(os.path.join(self.subjects_dir, subject_dir),
+                        arcname=subject_dir)
+            self.store.upload(path, {'checkpoint_key': key,
+                                     'subject_dir': subject_dir})
+        except Exception as e:  # a lost checkpoint is not fatal
+            log.warning('Could not save checkpoint of ' + subject_dir +
+                        ': ' + str(e))
+            return
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        self.saved.append(subject_dir)
+        log.info('Saved checkpoint of ' + subject_dir + ' in ' +
+                 '{:.1f} seconds'.format(time.time() - start))
+
+    def restore(self, subject_dir, key, checkpoints):
+        """Unpack a subject directory's checkpoint if its key matches.
+
+        Args:
+            subject_dir (str)
+            key (str): what the checkpoint must have been made from
+            checkpoints (list): from the store's list()
+
+        Returns:
+            restored (bool)
+        """
+
+        name = PREFIX + subject_dir + '.tar.gz'
+        matches = [cc for cc in checkpoints if cc['name'] == name]
+        if not matches:
+            return False
+        newest = max(matches, key=lambda cc: cc['modified'])
+        if newest['info'].get('checkpoint_key') != key:
+            log.info('Checkpoint of ' + subject_dir + ' is out of date')
+            return False
+
+        dest = os.path.join(self.subjects_dir, subject_dir)
+        with tempfile.TemporaryDirectory(dir=self.work_dir) as tmp:
+            path = os.path.join(tmp, name)
+            self.store.download(name, path)
+            with tarfile.open(path, 'r:gz') as tar:
+                for member in tar.getmembers():
+                    parts = member.name.split('/')
+                    if parts[0] != subject_dir or '..' in parts:
+                        raise ValueError('Unexpected member "' +
+                                         member.name + '" in ' + name)
+                if os.path.exists(dest):
+                    shutil.rmtree(dest)
+                tar.extractall(self.subjects_dir)
+        log.info('Restored ' + subject_dir + ' from checkpoint')
+        return True
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Delete big directory trees without waiting for them
+
+A FreeSurfer subject directory has thousands of small files, and removing
+them one after another is slow.  A directory to be removed is renamed into
+a trash directory on the same file system right away, and its contents are
+deleted by several threads in the background.
+"""
+
+import logging
+import os
+import queue
+import shutil
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+TRASH = '.grp14_trash'
+
+
+class Cleaner:
+    """Threads that delete discarded directories.
+
+    The threads do not keep Python from exiting, so call wait() for trash
+    that must be gone first (e.g. if it is in the output directory).
+
+    Args:
+        workers (int): number of threads deleting at the same time
+    """
+
+    def __init__(self, workers=8):
+
+        self._queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._pending = {}  # file system (st_dev): directories left
+        self._groups = {}  # directory: top level entries left to delete
+        self._trash_dirs = set()
+        self._count = 0
+        for _ in range(workers):
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    def discard(self, path, trash_dir):
+        """Remove a directory (or file, or link) in the background.
+
+        Args:
+            path (str)
+            trash_dir (str): where to move it to first, on the same file
+                system.  If it can't be moved there, it is deleted where it
+                is.
+        """
+
+        if os.path.islink(path) or not os.path.isdir(path):
+            os.remove(path)
+            return
+
+        self._use_trash_dir(trash_dir)
+        with self._condition:
+            self._count += 1
+            dest = os.path.join(trash_dir, str(os.getpid()) + '_' +
+                                str(self._count) + '_' +
+                                os.path.basename(os.path.normpath(path)))
+        try:
+            os.rename(path, dest)
+        except OSError:  # e.g. a different file system
+            dest = path
+        self._delete(dest)
+
+    def wait(self, trash_dir, timeout=None):
+        """Wait until everything on the same file system as trash_dir has
+        been deleted, then remove trash_dir if it is empty.
+
+        Returns:
+            done (bool): False if it timed out
+        """
+
+        if not os.path.isdir(trash_dir):
+            return True
+        device = os.stat(trash_dir).st_dev
+        with self._condition:
+            done = self._condition.wait_for(
+                lambda: not self._pending.get(device), timeout)
+        if done:
+            try:
+                os.rmdir(trash_dir)
+            except OSError:
+                pass
+        return done
+
+    def _use_trash_dir(self, trash_dir):
+        """Make trash_dir, and delete anything a gear that was stopped left
+        in it"""
+
+        if trash_dir in self._trash_dirs:
+            return
+        self._trash_dirs.add(trash_dir)
+        os.makedirs(trash_dir, exist_ok=True)
+        for name in os.listdir(trash_dir):
+            path = os.path.join(trash_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                self._delete(path)
+            else:
+                os.remove(path)
+
+    def _delete(self, path):
+
+        entries = [os.path.join(path, name) for name in os.listdir(path)]
+        with self._condition:
+            device = os.stat(path).st_dev
+            self._pending[device] = self._pending.get(device, 0) + 1
+            self._groups[path] = len(entries)
+        if not entries:
+            self._finish(path, device)
+        for entry in entries:
+            self._queue.put((entry, path, device))
+
+    def _finish(self, path, device):
+
+        shutil.rmtree(path, ignore_errors=True)
+        with self._condition:
+            del self._groups[path]
+            self._pending[device] -= 1
+            self._condition.notify_all()
+
+    def _loop(self):
+
+        while True:
+            entry, path, device = self._queue.get()
+            try:
+                if os.path.isdir(entry) and not os.path.islink(entry):
+                    shutil.rmtree(entry)
+                else:
+                    os.remove(entry)
+            except OSError as e:
+                log.warning('Could not delete ' + entry + ': ' + str(e))
+            with self._condition:
+                self._groups[path] -= 1
+                last = self._groups[path] == 0
+            if last:
+                self._finish(path, device)
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
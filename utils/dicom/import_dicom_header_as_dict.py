@@ -3,6 +3,10 @@
 """
 
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pydicom
 
 
 log = logging.getLogger(__name__)
@@ -11,6 +15,8 @@ log = logging.getLogger(__name__)
 def import_dicom_header_as_dict(dcm_filepath, tag_keyword_list):
     """
     Generates a dictionary of DICOM tag-DICOM tag value key-value pairs given a filepath to a valid DICOM file
+    Only the header is read (parsing stops before the pixel data) and only the
+    requested tags are decoded.
     :param dcm_filepath: path to an individual DICOM image
     :type dcm_filepath: str
     :param tag_keyword_list: a list of DICOM tags to acquire
@@ -25,8 +31,9 @@ def import_dicom_header_as_dict(dcm_filepath, tag_keyword_list):
 
     header_dict = dict()
     try:
-        dataset = pydicom.read_file(dcm_filepath)
-    except pydicom.filereader.InvalidDicomError:
+        dataset = pydicom.dcmread(dcm_filepath, stop_before_pixels=True,
+                                  specific_tags=list(tag_keyword_list))
+    except pydicom.errors.InvalidDicomError:
         log.warning('Invalid DICOM file: {}'.format(dcm_filepath))
         return header_dict
 
@@ -38,4 +45,59 @@ def import_dicom_header_as_dict(dcm_filepath, tag_keyword_list):
     return header_dict
 
 
+def _read_headers(tag_keyword_list, dcm_filepaths):
+    """import_dicom_header_as_dict() for a chunk of a batch, an unreadable
+    file gives an empty dict instead of stopping the batch"""
+
+    headers = []
+    for dcm_filepath in dcm_filepaths:
+        try:
+            headers.append(import_dicom_header_as_dict(dcm_filepath, tag_keyword_list))
+        except (OSError, EOFError) as e:
+            log.warning('Could not read {}: {}'.format(dcm_filepath, e))
+            headers.append(dict())
+    return headers
+
+
+def import_dicom_headers_as_dicts(dcm_filepaths, tag_keyword_list,
+                                  max_workers=None, chunksize=32):
+    """
+    Reads the requested tags of many DICOM files, in parallel processes
+    Each file is read as by import_dicom_header_as_dict(): only the header and
+    only the requested tags, so a sweep over a large series is limited by
+    reading the files rather than by parsing them.
+    :param dcm_filepaths: paths to individual DICOM images
+    :type dcm_filepaths: list
+    :param tag_keyword_list: a list of DICOM tags to acquire
+    :type tag_keyword_list: list
+    :param max_workers: number of processes, the number of CPUs by default
+    :type max_workers: int
+    :param chunksize: number of files given to a process at a time, a
+        batch of one chunk is read in this process
+    :type chunksize: int
+    :return: path: dictionary of DICOM tag-DICOM tag value pairs (empty if the file is not a valid DICOM file)
+    :rtype: dict
+    """
+
+    dcm_filepaths = list(dcm_filepaths)
+    tag_keyword_list = list(tag_keyword_list)
+    # Executor.map() has no chunksize before python 3.5
+    chunks = [dcm_filepaths[nn:nn + chunksize]
+              for nn in range(0, len(dcm_filepaths), chunksize)]
+    workers = min(max_workers or os.cpu_count() or 1, len(chunks))
+
+    if workers <= 1:
+        return dict(zip(dcm_filepaths, _read_headers(tag_keyword_list, dcm_filepaths)))
+
+    log.debug('Reading {} DICOM headers with {} processes'.format(
+        len(dcm_filepaths), workers))
+    header_dicts = dict()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_read_headers, tag_keyword_list, chunk)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            header_dicts.update(zip(chunk, future.result()))
+    return header_dicts
+
+
 # vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
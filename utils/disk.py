@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Keep track of the disk space used by FreeSurfer's SUBJECTS_DIR
+
+Every time point directory, BASE and every .long.BASE directory would stay
+until the end of the gear.  When the subject directories are not being
+returned, each can be pruned as soon as no later step needs it, and only the
+stats (for the tables) and scripts (for the logs) are kept.
+"""
+
+import logging
+import os
+import shutil
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+GB = 1024 ** 3
+
+# Size of one subject directory made by each step when nothing better is
+# known (recon-all -all with -qcache for the time points)
+DEFAULT_SIZES = {'cross-sectional': 0.8 * GB, 'base': 0.5 * GB,
+                 'longitudinal': 0.5 * GB}
+
+# What is kept in a subject directory that is pruned
+KEEP = ['stats', 'scripts']
+
+
+def directory_size(path):
+    """Bytes used by the files in a directory tree (symbolic links are not
+    followed)"""
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for fl in files:
+            try:
+                total += os.lstat(os.path.join(root, fl)).st_blocks * 512
+            except OSError:
+                pass  # it went away
+    return total
+
+
+def project_peak(num_timepoints, concurrent, sizes, prune):
+    """Largest size SUBJECTS_DIR will reach.
+
+    With pruning, a time point's directory goes and its .long.BASE is cut
+    down to KEEP as soon as its longitudinal run is done, so the peak is
+    when the first longitudinal runs are going.
+
+    Args:
+        num_timepoints (int)
+        concurrent (int): longitudinal runs going at the same time
+        sizes (dict): bytes for a subject directory of each step
+        prune (bool)
+
+    Returns:
+        bytes (float)
+    """
+
+    cross = num_timepoints * sizes['cross-sectional']
+    if prune:
+        longs = min(concurrent, num_timepoints) * sizes['longitudinal']
+    else:
+        longs = num_timepoints * sizes['longitudinal']
+    return cross + sizes['base'] + longs
+
+
+def prune_subject(path, keep=None):
+    """Remove everything in a subject directory except keep.
+
+    Args:
+        path (str): the subject directory
+        keep (list of str): names of the top level directories to keep, []
+            to remove the whole directory.  Default is KEEP.
+
+    Returns:
+        freed (int): bytes
+    """
+
+    keep = KEEP if keep is None else keep
+    if not os.path.isdir(path):
+        return 0
+    freed = 0
+    if not keep:
+        freed = directory_size(path)
+        shutil.rmtree(path)
+        return freed
+    for name in os.listdir(path):
+        if name in keep:
+            continue
+        full_path = os.path.join(path, name)
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            freed += directory_size(full_path)
+            shutil.rmtree(full_path)
+        else:
+            freed += os.lstat(full_path).st_blocks * 512
+            os.remove(full_path)
+    return freed
+
+
+class DiskMonitor(threading.Thread):
+    """Sample the disk space used on the file system that holds path, to
+    find the peak the gear reached.
+
+    Args:
+        path (str): a directory on the file system to watch
+        interval (float): seconds between samples
+    """
+
+    def __init__(self, path, interval=15.0):
+
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.start_used = shutil.disk_usage(path).used
+        self.peak_used = self.start_used
+        self._stopping = threading.Event()
+
+    def sample(self):
+        """Take a sample now"""
+
+        try:
+            used = shutil.disk_usage(self.path).used
+        except OSError:
+            return
+        self.peak_used = max(self.peak_used, used)
+
+    @property
+    def peak(self):
+        """Most bytes used at once above what was used at the start"""
+
+        return max(0, self.peak_used - self.start_used)
+
+    def run(self):
+
+        while not self._stopping.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+
+        self._stopping.set()
+        self.sample()
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
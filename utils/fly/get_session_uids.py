@@ -3,86 +3,145 @@
 import os
 import logging
 import json
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.dicom.import_dicom_header_as_dict import import_dicom_headers_as_dicts
+from utils.fly.make_file_name_safe import make_file_name_safe
+from utils.helpers.extract_return_paths import ArchiveMembers
 
 
 log = logging.getLogger(__name__)
 
 
-def get_session_uids(session, output_path):
+TAG_LIST = ['SeriesInstanceUID', 'StudyInstanceUID']
+
+
+def download_dicom_image(file, download_directory):
+    """
+    Downloads one image of a DICOM file to read its header from.  For a DICOM
+    archive only its first image is downloaded if possible.  If its members
+    can't be listed the whole file is downloaded, but only its first image is
+    taken out of it.
+    :param file: a flywheel file of type dicom
+    :type file: flywheel.models.file_entry.FileEntry
+    :param download_directory: an empty directory to download to
+    :type download_directory: str
+    :return: download_path, the path to the image, None if there is no image
+        to read the UIDs from
+    :rtype: str
+    """
+
+    try:
+        members = [mm['path'] for mm in file.get_zip_info().members
+                   if not mm['path'].endswith('/')]
+    except Exception as e:
+        log.warning('Could not access zip members of {}: {}'.format(file.name, e))
+        members = None
+
+    if members:
+        # Get a single image from the DICOM archive
+        download_path = os.path.join(download_directory,
+                                     make_file_name_safe(os.path.basename(members[0])))
+        file.download_zip_member(members[0], download_path)
+        return download_path
+    if members == []:
+        log.error('No images in {}'.format(file.name))
+        return None
+
+    # Download the whole file, a single image or an archive
+    archive_path = os.path.join(download_directory, make_file_name_safe(file.name))
+    file.download(archive_path)
+    with ArchiveMembers(archive_path) as archive:
+        if not archive.members:
+            log.error('No images in {}'.format(file.name))
+            return None
+        member = archive.members[0]
+        download_path = os.path.join(download_directory,
+                                     'image_' + make_file_name_safe(os.path.basename(member)))
+        with archive.open(member) as src, open(download_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    os.remove(archive_path)
+    return download_path
+
+
+def get_session_uids(session, output_path, max_workers=8):
     """
     Writes all unique UIDs for the input session to the output_path and returns the corresponding dictionary
+    The acquisitions are reloaded and an image of each DICOM file downloaded
+    up to max_workers at a time, then all of their headers are read in a batch.
     :param session: a flywheel session
     :type session: flywheel.models.session.Session
     :param output_path: the directory to which to write the json file containing session Study/SeriesInstanceUIDs
     :type output_path: str
-    :param log: a Logger instance
-    :type log: logging.Logger
+    :param max_workers: the most acquisitions or files to download at the same time
+    :type max_workers: int
     :return: session_dict, a dictionary containing session StudyInstanceUIDs and SeriesInstanceUIDs
     :rtype: dict
     """
 
     log.debug('')
 
-    tag_list = ['SeriesInstanceUID', 'StudyInstanceUID']
     log.info('Getting UID info for session {} ({})'.format(session.id, session.label))
     session_dict = dict()
 
-    for acquisition in session.acquisitions():
-        log.info('Getting UID info for acquisition {} ({})'.format(acquisition.id, acquisition.label))
-        acquisition = acquisition.reload()
+    download_directory = tempfile.mkdtemp()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+
+            def reload(acquisition):
+                log.info('Getting UID info for acquisition {} ({})'.format(acquisition.id, acquisition.label))
+                return acquisition.reload()
+
+            def download(nn):
+                directory = os.path.join(download_directory, str(nn))
+                os.mkdir(directory)
+                return download_dicom_image(dicoms[nn][1], directory)
+
+            acquisitions = list(executor.map(reload, session.acquisitions()))
+            dicoms = [(acquisition, file) for acquisition in acquisitions
+                      for file in acquisition.files if file.type == 'dicom']
+            download_paths = list(executor.map(download, range(len(dicoms))))
+
+        # then the headers of all of them at once
+        header_dicts = import_dicom_headers_as_dicts(
+            [path for path in download_paths if path], TAG_LIST)
+        headers = [header_dicts[path] if path else dict() for path in download_paths]
+    finally:
+        shutil.rmtree(download_directory, ignore_errors=True)
+
+    # in the order of the acquisitions and files, whichever finished first
+    failed = False
+    for acquisition in acquisitions:
         dicom_count = 0
         UID_entry_count = 0
-        for file in acquisition.files:
-            if file.type == 'dicom':
-                log.debug('Processing DICOM: {}'.format(file.name))
-                dicom_count += 1
-                download_directory = tempfile.mkdtemp()
-                try:
-                    # Get a single image from the DICOM archive if possible
-                    zip_member_file = file.get_zip_info().members[0]['path']
-                    safe_file_name = make_file_name_safe(zip_member_file, log)
-                    download_path = os.path.join(download_directory, safe_file_name)
-                    file.download_zip_member(zip_member_file, download_path)
-                    dicom_file_list = [download_path]
-                # if can't get zip file member, download the whole archive
-                except Exception as e:
-                    log.warning('Could not access zip members:')
-                    log.warning(e)
-                    log.info('Downloading entire DICOM archive')
-                    # Replace non-alphanumeric (or underscore) characters with x
-                    safe_zip_name = make_file_name_safe(file.name, log)
-                    download_path = os.path.join(download_directory, safe_zip_name)
-                    file.download(download_path)
-                    if zipfile.is_zipfile(download_path):
-                        dicom_file_list = extract_return_path(download_path)
-                    else:
-                        dicom_file_list = [download_path]
-                # import the dicom header info
-                log.debug('Reading {}'.format(download_path))
-                dicom_dict = import_dicom_header_as_dict(dicom_file_list[-1], tag_list, log)
-
-                # Confirm that UIDs exist
-                if not dicom_dict.get('StudyInstanceUID'):
-                    log.error('No StudyInstanceUID present for file: {}'.format(file.name))
-                if not dicom_dict.get('SeriesInstanceUID'):
-                    log.error('No SeriesInstanceUID present for file: {}'.format(file.name))
-                # Create key if it doesn't exist
-                if dicom_dict.get('StudyInstanceUID'):
-                    UID_entry_count += 1
-                    if not session_dict.get(dicom_dict.get('StudyInstanceUID')):
-                        session_dict[dicom_dict['StudyInstanceUID']] = list()
-                    session_dict[dicom_dict['StudyInstanceUID']].append(dicom_dict['SeriesInstanceUID'])
-                # Remove the extracted DICOM images
-                shutil.rmtree(os.path.dirname(dicom_file_list[0]))
-                # Remove the download zip
-                if os.path.isdir(download_directory):
-                    shutil.rmtree(download_directory)
-                if session_dict:
-                    with open(output_path, 'w') as f:
-                        json.dump(session_dict, f, separators=(', ', ': '), indent=4)
+        for (acq, file), dicom_dict in zip(dicoms, headers):
+            if acq is not acquisition:
+                continue
+            dicom_count += 1
+            # Confirm that UIDs exist
+            if not dicom_dict.get('StudyInstanceUID'):
+                log.error('No StudyInstanceUID present for file: {}'.format(file.name))
+            if not dicom_dict.get('SeriesInstanceUID'):
+                log.error('No SeriesInstanceUID present for file: {}'.format(file.name))
+            # Create key if it doesn't exist
+            if dicom_dict.get('StudyInstanceUID'):
+                UID_entry_count += 1
+                if not session_dict.get(dicom_dict.get('StudyInstanceUID')):
+                    session_dict[dicom_dict['StudyInstanceUID']] = list()
+                session_dict[dicom_dict['StudyInstanceUID']].append(dicom_dict.get('SeriesInstanceUID'))
         if dicom_count != UID_entry_count:
-            log.error('expected {} StudyInstanceUIDs, found {}'.format(dicom_count, UID_entry_count))
-            os.sys.exit(1)
+            log.error('expected {} StudyInstanceUIDs, found {} in acquisition {}'.format(
+                dicom_count, UID_entry_count, acquisition.label))
+            failed = True
+
+    if session_dict:
+        with open(output_path, 'w') as f:
+            json.dump(session_dict, f, separators=(', ', ': '), indent=4)
+
+    if failed:
+        os.sys.exit(1)
 
     return session_dict
 
@@ -3,6 +3,10 @@
 Things that go zip or unzip
 """
 import logging
+import os
+import shutil
+import tempfile
+import zipfile
 
 
 log = logging.getLogger(__name__)
@@ -12,7 +16,8 @@ def extract_return_paths(input_filepath):
     """
     Extracts a zip archive to a temporary directory and
     returns a list of paths of the files.  Does not delete
-    the temporary directory.
+    the temporary directory.  See ArchiveMembers to read only
+    some of the files.
     :param input_filepath:  a path to a zip archive
     :type input_filepath: str
     :return: file_list, a list of paths to the extracted files
@@ -37,4 +42,104 @@ def extract_return_paths(input_filepath):
     return file_list
 
 
+class ArchiveMembers(object):
+    """
+    Lazy access to the files in a zip archive: nothing is extracted until a
+    member is asked for, and the temporary directory (if one was needed) is
+    removed when it is closed, at the end of a with statement.  A file that
+    is not a zip is treated as an archive with that one file in it, read in
+    place.
+
+        with ArchiveMembers(input_filepath) as archive:
+            with archive.open(archive.members[-1]) as fp:
+                dataset = pydicom.dcmread(fp, stop_before_pixels=True)
+
+    :param input_filepath:  a path to a zip archive
+    :type input_filepath: str
+    """
+
+    def __init__(self, input_filepath):
+
+        self.input_filepath = input_filepath
+        self._zip = None
+        self._temp_dirpath = None
+        self._closed = False
+
+        if zipfile.is_zipfile(input_filepath):
+            self._zip = zipfile.ZipFile(input_filepath)
+            # Remove directories from the list
+            self.members = [name for name in self._zip.namelist() if not name.endswith('/')]
+        else:
+            log.warning('Not a zip. Attempting to read {} directly'.format(
+                os.path.basename(input_filepath)))
+            self.members = [os.path.basename(input_filepath)]
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+    def __iter__(self):
+
+        return iter(self.members)
+
+    def open(self, member):
+        """
+        Streams one member without writing it to disk
+        :param member: a name from members
+        :type member: str
+        :return: a binary file object, to be closed by the caller
+        """
+
+        self._check_open()
+        if self._zip is None:
+            return open(self._path(member), 'rb')
+        return self._zip.open(member)
+
+    def extract(self, member):
+        """
+        Extracts one member to the temporary directory (if it is not there
+        already), for what needs a real file
+        :param member: a name from members
+        :type member: str
+        :return: the path to the extracted file
+        :rtype: str
+        """
+
+        self._check_open()
+        if self._zip is None:
+            return self._path(member)
+        if self._temp_dirpath is None:
+            self._temp_dirpath = tempfile.mkdtemp()
+        path = os.path.join(self._temp_dirpath, member)
+        if not os.path.exists(path):
+            path = self._zip.extract(member, self._temp_dirpath)
+        return path
+
+    def _check_open(self):
+
+        if self._closed:
+            raise ValueError('{} is closed'.format(self.input_filepath))
+
+    def _path(self, member):
+
+        if member != os.path.basename(self.input_filepath):
+            raise KeyError('{} is not in {}'.format(member, self.input_filepath))
+        return self.input_filepath
+
+    def close(self):
+        """Closes the archive and removes what was extracted"""
+
+        self._closed = True
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._temp_dirpath is not None:
+            shutil.rmtree(self._temp_dirpath, ignore_errors=True)
+            self._temp_dirpath = None
+
+
 # vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
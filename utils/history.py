@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Keep a record of every recon-all run in a small SQLite database
+
+Each row is one recon-all run: which step and time point, the gear version,
+the machine and CPU plan, the recon-all flags, and the wall time, CPU time
+and peak memory it took.  Summarize a database (e.g. one exported by the
+gear, or several merged) with:
+
+    python3 -m utils.history summary run_history.sqlite
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    recorded TEXT,
+    gear_version TEXT,
+    analysis_id TEXT,
+    cpu_model TEXT,
+    memory_gb REAL,
+    cpu_count INTEGER,
+    concurrent INTEGER,
+    step TEXT,
+    subject_dir TEXT,
+    visit TEXT,
+    flags TEXT,
+    voxels INTEGER,
+    field_strength REAL,
+    wall_minutes REAL,
+    cpu_minutes REAL,
+    peak_rss_gb REAL,
+    return_code INTEGER
+)
+'''
+
+COLUMNS = ['recorded', 'gear_version', 'analysis_id', 'cpu_model',
+           'memory_gb', 'cpu_count', 'concurrent', 'step', 'subject_dir',
+           'visit', 'flags', 'voxels', 'field_strength', 'wall_minutes',
+           'cpu_minutes', 'peak_rss_gb', 'return_code']
+
+# What the summary can be grouped by
+GROUP_COLUMNS = ['gear_version', 'cpu_model', 'cpu_count', 'concurrent',
+                 'step', 'flags']
+
+
+def machine():
+    """CPU model and total memory (GB) of this machine, for the records"""
+
+    cpu_model = 'unknown'
+    memory_gb = None
+    try:
+        with open('/proc/cpuinfo', 'r') as fh:
+            for line in fh:
+                if line.startswith('model name'):
+                    cpu_model = line.split(':', 1)[1].strip()
+                    break
+        with open('/proc/meminfo', 'r') as fh:
+            for line in fh:
+                if line.startswith('MemTotal:'):
+                    memory_gb = round(int(line.split()[1]) / 1024 ** 2, 1)
+                    break
+    except OSError:
+        pass
+    return cpu_model, memory_gb
+
+
+class RunHistory:
+    """A run history database that can be written to from several threads.
+
+    Args:
+        path (str): the SQLite file, created if it does not exist
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(SCHEMA)
+        self._connection.commit()
+
+    def record(self, **fields):
+        """Add a row, fields are some of COLUMNS.  "recorded" defaults to
+        now."""
+
+        fields.setdefault('recorded', time.strftime('%Y-%m-%d %H:%M:%S',
+                                                    time.gmtime()))
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError('Unknown run history columns: ' +
+                             ', '.join(sorted(unknown)))
+        names = sorted(fields)
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO runs (' + ', '.join(names) + ') VALUES (' +
+                ', '.join('?' * len(names)) + ')',
+                [fields[nn] for nn in names])
+            self._connection.commit()
+
+    def timings(self, step, cpu_count, concurrent):
+        """Successful runs of a step with the same CPU plan.
+
+        Returns:
+            timings (list of dict): voxels, field_strength and wall_minutes
+        """
+
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT voxels, field_strength, wall_minutes FROM runs '
+                'WHERE step = ? AND cpu_count = ? AND concurrent = ? AND '
+                'return_code = 0 AND wall_minutes > 0',
+                (step, cpu_count, concurrent)).fetchall()
+        return [{'voxels': row[0], 'field_strength': row[1],
+                 'wall_minutes': row[2]} for row in rows]
+
+    def summary(self, group_by, step=None):
+        """Throughput of successful runs grouped by some of GROUP_COLUMNS.
+
+        Returns:
+            columns (list of str), rows (list of tuple): the group columns,
+                then runs, mean wall and CPU minutes, CPU efficiency (CPU
+                time / (wall time * CPUs per run)), time points per hour
+                with that many running at once, and the largest peak memory
+        """
+
+        for column in group_by:
+            if column not in GROUP_COLUMNS:
+                raise ValueError('Can\'t group by "' + column + '", use ' +
+                                 ', '.join(GROUP_COLUMNS))
+        groups = ', '.join(group_by)
+        where = 'WHERE return_code = 0 AND wall_minutes > 0'
+        args = []
+        if step:
+            where += ' AND step = ?'
+            args.append(step)
+
+        sql = ('SELECT ' + groups + ', COUNT(*), '
+               'ROUND(AVG(wall_minutes), 1), ROUND(AVG(cpu_minutes), 1), '
+               'ROUND(AVG(cpu_minutes * concurrent / '
+               '(wall_minutes * cpu_count)), 2), '
+               'ROUND(60.0 * AVG(concurrent) / AVG(wall_minutes), 2), '
+               'ROUND(MAX(peak_rss_gb), 2) '
+               'FROM runs ' + where + ' GROUP BY ' + groups +
+               ' ORDER BY ' + groups)
+
+        with self._lock:
+            rows = self._connection.execute(sql, args).fetchall()
+        columns = list(group_by) + ['runs', 'wall_minutes', 'cpu_minutes',
+                                    'cpu_efficiency', 'per_hour',
+                                    'peak_rss_gb']
+        return columns, rows
+
+    def close(self):
+
+        with self._lock:
+            self._connection.close()
+
+
+def print_table(columns, rows, out=sys.stdout):
+    """Print rows as aligned columns"""
+
+    text = [columns] + [['' if vv is None else str(vv) for vv in row]
+                        for row in rows]
+    widths = [max(len(row[cc]) for row in text) for cc in range(len(columns))]
+    for row in text:
+        out.write('  '.join(vv.ljust(ww) for vv, ww in zip(row, widths))
+                  .rstrip() + '\n')
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Summarize recon-all throughput in a run history ' +
+                    'database')
+    parser.add_argument('command', choices=['summary'])
+    parser.add_argument('database')
+    parser.add_argument('--by', default='gear_version,step,cpu_count,flags',
+                        help='comma separated columns to group by, from ' +
+                             ', '.join(GROUP_COLUMNS))
+    parser.add_argument('--step', help='only this recon-all step')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        parser.error('No such file: ' + args.database)
+
+    history = RunHistory(args.database)
+    try:
+        columns, rows = history.summary(args.by.split(','), args.step)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        history.close()
+    print_table(columns, rows)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
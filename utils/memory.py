@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Start recon-all runs only when there is enough memory for them
+
+Several recon-all runs at the same time can reach their peak memory use
+together (e.g. in mri_ca_register) and get the gear killed by the OOM killer.
+"""
+
+import contextlib
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+GB = 1024 ** 3
+
+# Peak memory of one recon-all run of each step when nothing better is known
+DEFAULT_ESTIMATES = {'cross-sectional': 4 * GB, 'base': 6 * GB,
+                     'longitudinal': 5 * GB}
+
+
+def _read_number(path):
+    """Integer in a file, None if the file is missing or says "max"."""
+
+    try:
+        with open(path, 'r') as fh:
+            text = fh.read().strip()
+    except OSError:
+        return None
+    return int(text) if text.isdigit() else None
+
+
+def _read_stat(path, key):
+    """Value of key in a cgroup memory.stat file, 0 if not there"""
+
+    try:
+        with open(path, 'r') as fh:
+            for line in fh:
+                name, _, value = line.partition(' ')
+                if name == key:
+                    return int(value)
+    except OSError:
+        pass
+    return 0
+
+
+def cgroup_available():
+    """Memory left under this container's cgroup limit in bytes.
+
+    Works with cgroup v2 and v1.  Page cache that can be dropped
+    (inactive_file) does not count as used.  Returns None if there is no
+    limit.
+    """
+
+    # cgroup v2
+    limit = _read_number('/sys/fs/cgroup/memory.max')
+    if limit is not None:
+        used = _read_number('/sys/fs/cgroup/memory.current') or 0
+        used -= _read_stat('/sys/fs/cgroup/memory.stat', 'inactive_file')
+        return max(0, limit - used)
+
+    # cgroup v1, "no limit" is a huge number
+    v1 = '/sys/fs/cgroup/memory/'
+    limit = _read_number(v1 + 'memory.limit_in_bytes')
+    if limit is not None and limit < 2 ** 60:
+        used = _read_number(v1 + 'memory.usage_in_bytes') or 0
+        used -= _read_stat(v1 + 'memory.stat', 'total_inactive_file')
+        return max(0, limit - used)
+
+    return None
+
+
+def meminfo_available():
+    """MemAvailable from /proc/meminfo in bytes, None if unknown"""
+
+    try:
+        with open('/proc/meminfo', 'r') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def available_memory():
+    """Bytes that can still be used: the smaller of the cgroup headroom and
+    the machine's MemAvailable"""
+
+    values = [vv for vv in (cgroup_available(), meminfo_available())
+              if vv is not None]
+    return min(values) if values else None
+
+
+def parse_memory_estimates(text):
+    """Parse "step=GB step=GB ..." into a dict of bytes, on top of the
+    defaults"""
+
+    estimates = dict(DEFAULT_ESTIMATES)
+    for item in text.split():
+        step, _, gigabytes = item.partition('=')
+        if step not in estimates:
+            raise ValueError('Unknown step "' + step + '" in memory ' +
+                             'estimates, should be one of ' +
+                             ', '.join(sorted(DEFAULT_ESTIMATES)))
+        estimates[step] = float(gigabytes) * GB
+    return estimates
+
+
+class MemoryAdmission:
+    """Let a recon-all run start only if its peak memory will fit.
+
+    The memory a run will need is its step's estimate: the largest peak seen
+    so far for that step (see record_peak()) plus a margin, or the configured
+    estimate if no run of the step has finished yet.  A run that has started
+    but has not yet reached its estimate still has the difference set aside,
+    so runs that start together cannot all count on the same free memory.
+    When nothing else is running, a run always starts.
+
+    Args:
+        estimates (dict): bytes for each step, see parse_memory_estimates()
+        margin (float): peaks that were seen are multiplied by this
+        poll_interval (float): seconds between checks while waiting
+    """
+
+    def __init__(self, estimates, margin=1.2, poll_interval=30):
+
+        self.estimates = dict(estimates)
+        self.margin = margin
+        self.poll_interval = poll_interval
+        self.peaks = {}  # largest peak seen for each step
+        self._running = {}  # key -> (estimate, watchdog or None)
+        self._condition = threading.Condition()
+
+    def estimate(self, step):
+        """Bytes a run of this step is expected to need at its peak"""
+
+        if step in self.peaks:
+            return self.peaks[step] * self.margin
+        return self.estimates[step]
+
+    def record_peak(self, step, peak_rss):
+        """Remember the peak memory of a run of this step that finished"""
+
+        if peak_rss:
+            with self._condition:
+                self.peaks[step] = max(self.peaks.get(step, 0), peak_rss)
+
+    def _set_aside(self):
+        """Memory promised to running runs but not used by them yet"""
+
+        total = 0
+        for estimate, watchdog in self._running.values():
+            used = watchdog.rss if watchdog else 0
+            total += max(0, estimate - used)
+        return total
+
+    @contextlib.contextmanager
+    def admit(self, step, name, watchdog=None):
+        """Wait until a run of this step fits, then hold its place.
+
+        Args:
+            step (str): a key of the estimates
+            name (str): for log messages
+            watchdog (utils.watchdog.Watchdog): follows the memory use of
+                the run once it has started
+        """
+
+        needed = self.estimate(step)
+        key = object()
+        waited = False
+
+        with self._condition:
+            while self._running:
+                available = available_memory()
+                if available is None:
+                    break
+                headroom = available - self._set_aside()
+                if needed <= headroom:
+                    break
+                if not waited:
+                    log.info('Waiting for memory to start ' + name + ': ' +
+                             'needs {:.1f} GB, {:.1f} GB free'.format(
+                                 needed / GB, max(0, headroom) / GB))
+                    waited = True
+                self._condition.wait(self.poll_interval)
+            self._running[key] = (needed, watchdog)
+
+        if waited:
+            log.info('Enough memory to start ' + name)
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                del self._running[key]
+                self._condition.notify_all()
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
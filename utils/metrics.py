@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Counters and gauges for the Prometheus node_exporter textfile collector
+
+The gear updates metrics as it goes and they are written to a .prom file
+(to a temporary file that is then renamed, so the collector never reads half
+a file) every few seconds and when the gear is done.
+
+    utils.metrics.inc('grp14_downloaded_bytes_total', size)
+    utils.metrics.add('grp14_processes_active', 1, command='recon-all')
+
+Nothing is kept until start() is called.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+
+# name: (type, help)
+METRICS = {
+    'grp14_info': ('gauge', 'Always 1, the labels say which gear run it is'),
+    'grp14_running': ('gauge', '1 while the gear is running, 0 when done'),
+    'grp14_start_time_seconds': ('gauge', 'When the gear started'),
+    'grp14_exit_code': ('gauge', 'What the gear returned'),
+    'grp14_timepoints': ('gauge', 'Time points being processed'),
+    'grp14_downloads_total': ('counter', 'Input files downloaded'),
+    'grp14_downloaded_bytes_total': ('counter',
+                                     'Bytes of input files downloaded'),
+    'grp14_api_calls_total': ('counter', 'Flywheel API requests'),
+    'grp14_processes_active': ('gauge', 'Commands running now'),
+    'grp14_commands_total': ('counter',
+                             'Commands that finished, by return code'),
+    'grp14_recon_all_runs_total': ('counter',
+                                   'recon-all runs that finished, by step ' +
+                                   'and return code'),
+    'grp14_phase_duration_seconds': ('gauge', 'How long each phase took'),
+    'grp14_archive_bytes': ('gauge', 'Size of the zipped results'),
+}
+
+
+class Metrics:
+    """Metric values, written to a .prom file.
+
+    Args:
+        path (str): the .prom file
+        labels (dict): added to every sample, e.g. the analysis id, so
+            several gears on a node can share the collector's directory
+        interval (float): seconds between writes while something changed
+    """
+
+    def __init__(self, path, labels=None, interval=15.0):
+
+        self.path = path
+        self.labels = labels or {}
+        self.interval = interval
+        self._values = {}  # (name, sorted label items): value
+        self._lock = threading.Lock()
+        self._changed = False
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def add(self, name, value, **labels):
+        """Add value (which can be negative for a gauge)"""
+
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+            self._changed = True
+
+    def set(self, name, value, **labels):
+
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = value
+            self._changed = True
+
+    def render(self):
+        """The metrics in the Prometheus text format"""
+
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        described = set()
+        for (name, labels), value in values:
+            if name not in described:
+                kind, text = METRICS.get(name, ('untyped', name))
+                lines.append('# HELP ' + name + ' ' + text)
+                lines.append('# TYPE ' + name + ' ' + kind)
+                described.add(name)
+            lines.append(name + _format_labels(dict(self.labels, **dict(
+                labels))) + ' ' + repr(float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """Replace the .prom file with the current values"""
+
+        with self._lock:
+            self._changed = False
+        tmp = self.path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp, 'w') as fh:
+                fh.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning('Could not write metrics to ' + self.path + ': ' +
+                        str(e))
+
+    def stop(self):
+
+        self._stopping.set()
+        self.write()
+
+    def _loop(self):
+
+        while not self._stopping.wait(self.interval):
+            if self._changed:
+                self.write()
+
+
+def _label_key(labels):
+
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels):
+
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        key + '="' + str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in sorted(labels.items())) + '}'
+
+
+_metrics = None
+
+
+def start(path, **labels):
+    """Start keeping metrics and writing them to path"""
+
+    global _metrics
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    _metrics = Metrics(path, labels)
+    log.info('Writing metrics to ' + path)
+    return _metrics
+
+
+def stop():
+    """Write the metrics one last time"""
+
+    global _metrics
+    if _metrics is not None:
+        _metrics.stop()
+    _metrics = None
+
+
+def add(name, value, **labels):
+
+    if _metrics is not None:
+        _metrics.add(name, value, **labels)
+
+
+def inc(name, value=1, **labels):
+    """Count something, value must not be negative"""
+
+    add(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    """Set a gauge"""
+
+    if _metrics is not None:
+        _metrics.set(name, value, **labels)
+
+
+@contextmanager
+def timed(phase):
+    """Set grp14_phase_duration_seconds for what is in it"""
+
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        gauge('grp14_phase_duration_seconds',
+              round(time.time() - start_time, 3), phase=phase)
+
+
+def count_api_calls(fw):
+    """Count the Flywheel client's API requests by HTTP method.
+
+    All requests the SDK makes go through fw.api_client.call_api().
+    """
+
+    api_client = getattr(fw, 'api_client', None)
+    call_api = getattr(api_client, 'call_api', None)
+    if call_api is None:
+        return
+
+    def counted(resource_path, method, *args, **kwargs):
+        inc('grp14_api_calls_total', method=method)
+        return call_api(resource_path, method, *args, **kwargs)
+
+    api_client.call_api = counted
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -0,0 +1,5 @@
+# This is a comment to prevent CircleCI from considering the file as empty.
+
+# If you edit this file, please consider updating bids-app-template
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Content hash and image fingerprint of a NIfTI file, to find duplicate scans
+"""
+
+import hashlib
+import logging
+import zlib
+
+from utils.nifti.read_nifti_header import parse_nifti_header
+from utils.nifti.read_nifti_header import NIFTI2_HEADER_SIZE
+
+
+log = logging.getLogger(__name__)
+
+
+def fingerprint_nifti(file_path, chunk_size=1024 * 1024):
+    """Hash a NIfTI file's bytes and its image, reading the file only once.
+
+    The content hash is the sha256 of the file as it is stored.  The image
+    fingerprint is the sha256 of the geometry in the header (the grid, the
+    qform and sform and the intensity scaling) plus the voxel data after
+    vox_offset.  It ignores the gzip wrapper, descrip and header
+    extensions, so a re-export of the same scan with a new time stamp or
+    compression level gets the same fingerprint but a different content hash.
+
+    Args:
+        file_path (str): path to a .nii or .nii.gz file
+        chunk_size (int): number of bytes to read at a time
+
+    Returns:
+        hashes (dict): 'sha256' (content hash) and 'fingerprint' (image
+            fingerprint, None if the header could not be read)
+    """
+
+    content = hashlib.sha256()
+    image = hashlib.sha256()
+
+    if file_path.endswith('.gz'):
+        # 32 + MAX_WBITS: accept a gzip header
+        decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    else:
+        decompressor = None
+
+    head = b''
+    header = None
+    skip = 0  # bytes still to skip before the voxel data starts
+
+    with open(file_path, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            content.update(chunk)
+
+            if decompressor is None:
+                data = chunk
+            else:
+                data = decompressor.decompress(chunk)
+                # a .gz can be several gzip members back to back
+                while decompressor.unused_data:
+                    rest = decompressor.unused_data
+                    decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+                    data += decompressor.decompress(rest)
+
+            if header is None:
+                head += data
+                if len(head) < NIFTI2_HEADER_SIZE:
+                    continue
+                try:
+                    header = parse_nifti_header(head, file_path)
+                except ValueError as e:
+                    log.warning(str(e))
+                    return {'sha256': _finish(fh, content, chunk_size),
+                            'fingerprint': None}
+                image.update(_geometry(header))
+                data = head
+                skip = header['vox_offset']
+
+            if skip >= len(data):
+                skip -= len(data)
+                continue
+            image.update(data[skip:])
+            skip = 0
+
+    if header is None:  # the whole file is smaller than a NIfTI-2 header
+        try:
+            header = parse_nifti_header(head, file_path)
+        except ValueError as e:
+            log.warning(str(e))
+            return {'sha256': content.hexdigest(), 'fingerprint': None}
+        image.update(_geometry(header))
+        image.update(head[header['vox_offset']:])
+
+    return {'sha256': content.hexdigest(), 'fingerprint': image.hexdigest()}
+
+
+def _rounded(values):
+    """Rounded so NIfTI-1 floats and NIfTI-2 doubles compare equal (and
+    -0.0 is 0.0)"""
+
+    return [round(vv, 4) + 0.0 for vv in values]
+
+
+def _geometry(header):
+    """Bytes describing the image grid, its place in the world and the
+    scaling of the voxel values, part of the fingerprint.  Two files with the
+    same voxels in a different orientation or scaling are different images.
+    """
+
+    qform = _rounded(header['quatern']) if header['qform_code'] > 0 else None
+    sform = _rounded(header['srow']) if header['sform_code'] > 0 else None
+    # a slope of 0 means the values are not scaled, the same as 1 and 0
+    if header['scl_slope'] == 0:
+        scaling = [1.0, 0.0]
+    else:
+        scaling = _rounded([header['scl_slope'], header['scl_inter']])
+
+    return repr((header['datatype'], header['dims'],
+                 _rounded(header['pixdim']), qform, sform,
+                 scaling)).encode()
+
+
+def _finish(fh, content, chunk_size):
+    """Hash the rest of the open file and return the hex digest"""
+
+    for chunk in iter(lambda: fh.read(chunk_size), b''):
+        content.update(chunk)
+    return content.hexdigest()
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
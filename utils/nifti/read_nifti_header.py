@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Read just the header of a NIfTI-1 or NIfTI-2 file without loading the image
+"""
+
+import gzip
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+
+
+log = logging.getLogger(__name__)
+
+
+NIFTI1_HEADER_SIZE = 348
+NIFTI2_HEADER_SIZE = 540
+
+
+def _header_bytes(file_path):
+    """Return the first bytes of the file, enough to hold a NIfTI-2 header.
+
+    Uncompressed files are memory mapped so only the header pages are read.
+    For .nii.gz only the header is decompressed, not the whole volume.
+    """
+
+    if file_path.endswith('.gz'):
+        with gzip.open(file_path, 'rb') as fh:
+            return fh.read(NIFTI2_HEADER_SIZE)
+
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as fh:
+        with mmap.mmap(fh.fileno(), min(size, NIFTI2_HEADER_SIZE),
+                       access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+
+def _quaternion_to_matrix(b, c, d, qfac, pixdim):
+    """3x3 voxel to world matrix from the qform quaternion (NIfTI-1 spec)"""
+
+    a = 1.0 - (b * b + c * c + d * d)
+    a = math.sqrt(a) if a > 0 else 0.0
+
+    rot = [[a*a + b*b - c*c - d*d, 2*b*c - 2*a*d, 2*b*d + 2*a*c],
+           [2*b*c + 2*a*d, a*a + c*c - b*b - d*d, 2*c*d - 2*a*b],
+           [2*b*d - 2*a*c, 2*c*d + 2*a*b, a*a + d*d - c*c - b*b]]
+
+    scale = [pixdim[1], pixdim[2], pixdim[3] * qfac]
+    return [[rot[rr][cc] * scale[cc] for cc in range(3)] for rr in range(3)]
+
+
+def _axis_codes(matrix):
+    """Orientation string like "RAS" or "LIA" for the voxel axes.
+
+    Each voxel axis (column) is assigned to the world axis it points along
+    the most.  Returns None if two voxel axes point along the same world axis
+    or an axis has zero length.
+    """
+
+    labels = (('L', 'R'), ('P', 'A'), ('I', 'S'))
+    codes = ''
+    used = set()
+    for cc in range(3):
+        column = [matrix[rr][cc] for rr in range(3)]
+        world = max(range(3), key=lambda rr: abs(column[rr]))
+        if column[world] == 0 or world in used:
+            return None
+        used.add(world)
+        codes += labels[world][1 if column[world] > 0 else 0]
+    return codes
+
+
+def parse_nifti_header(data, file_path=''):
+    """Parse NIfTI-1 or NIfTI-2 header bytes.
+
+    Args:
+        data (bytes): the start of the file, at least the whole header
+        file_path (str): only used in error messages
+
+    Returns:
+        header (dict): see read_nifti_header()
+
+    Raises:
+        ValueError: if data is not a NIfTI header
+    """
+
+    if len(data) < 4:
+        raise ValueError('Too short to be a NIfTI file: ' + file_path)
+
+    # the header size tells the version and the byte order
+    for endian in ('<', '>'):
+        sizeof_hdr = struct.unpack(endian + 'i', data[:4])[0]
+        if sizeof_hdr in (NIFTI1_HEADER_SIZE, NIFTI2_HEADER_SIZE):
+            break
+    else:
+        raise ValueError('Not a NIfTI file (bad sizeof_hdr): ' + file_path)
+
+    if len(data) < sizeof_hdr:
+        raise ValueError('Truncated NIfTI header: ' + file_path)
+
+    header = {'version': 1 if sizeof_hdr == NIFTI1_HEADER_SIZE else 2}
+
+    if header['version'] == 1:
+        dims = struct.unpack_from(endian + '8h', data, 40)
+        header['datatype'] = struct.unpack_from(endian + 'h', data, 70)[0]
+        pixdim = struct.unpack_from(endian + '8f', data, 76)
+        header['vox_offset'] = int(struct.unpack_from(endian + 'f', data,
+                                                      108)[0])
+        scaling = struct.unpack_from(endian + '2f', data, 112)
+        descrip = data[148:228]
+        qform_code, sform_code = struct.unpack_from(endian + '2h', data, 252)
+        quatern = struct.unpack_from(endian + '6f', data, 256)
+        srows = struct.unpack_from(endian + '12f', data, 280)
+    else:
+        header['datatype'] = struct.unpack_from(endian + 'h', data, 12)[0]
+        dims = struct.unpack_from(endian + '8q', data, 16)
+        pixdim = struct.unpack_from(endian + '8d', data, 104)
+        header['vox_offset'] = struct.unpack_from(endian + 'q', data, 168)[0]
+        scaling = struct.unpack_from(endian + '2d', data, 176)
+        descrip = data[240:320]
+        qform_code, sform_code = struct.unpack_from(endian + '2i', data, 344)
+        quatern = struct.unpack_from(endian + '6d', data, 352)
+        srows = struct.unpack_from(endian + '12d', data, 400)
+
+    header['dims'] = list(dims)
+    header['pixdim'] = list(pixdim)
+    header['scl_slope'], header['scl_inter'] = scaling
+    header['qform_code'] = qform_code
+    header['sform_code'] = sform_code
+    header['quatern'] = list(quatern)
+    header['srow'] = list(srows)
+
+    # prefer sform over qform, as FreeSurfer does
+    if sform_code > 0:
+        matrix = [list(srows[0:3]), list(srows[4:7]), list(srows[8:11])]
+        header['orientation'] = _axis_codes(matrix)
+    elif qform_code > 0:
+        qfac = -1.0 if pixdim[0] < 0 else 1.0
+        matrix = _quaternion_to_matrix(quatern[0], quatern[1], quatern[2],
+                                       qfac, pixdim)
+        header['orientation'] = _axis_codes(matrix)
+    else:
+        header['orientation'] = None
+
+    descrip = descrip.split(b'\0')[0].decode('ascii', errors='replace')
+    header['descrip'] = descrip.strip()
+
+    match = re.search(r'B0\s*=\s*([0-9]*\.?[0-9]+)', descrip)
+    header['field_strength'] = float(match.group(1)) if match else None
+
+    return header
+
+
+def read_nifti_header(file_path):
+    """Parse the NIfTI-1 or NIfTI-2 header of a (possibly gzipped) file.
+
+    Args:
+        file_path (str): path to a .nii or .nii.gz file
+
+    Returns:
+        header (dict): version, dims (list, dim[0] is the number of
+            dimensions), pixdim (voxel sizes, list), datatype, vox_offset,
+            scl_slope, scl_inter, qform_code, sform_code, quatern (quatern_b,
+            c, d and qoffset_x, y, z), srow (srow_x, y, z), orientation
+            (e.g. "RAS", None if unknown), descrip (str) and field_strength
+            (float from "B0=..." in descrip, None if not there)
+
+    Raises:
+        ValueError: if the file does not have a NIfTI header
+    """
+
+    return parse_nifti_header(_header_bytes(file_path), file_path)
+
+
+def check_nifti_header(header, max_voxel_size):
+    """Find reasons a scan can't be used for recon-all.
+
+    Args:
+        header (dict): as returned by read_nifti_header()
+        max_voxel_size (float): largest acceptable voxel edge in mm
+
+    Returns:
+        problems (list of str): empty if the scan looks usable
+    """
+
+    problems = []
+
+    dims = header['dims']
+    ndim = dims[0]
+    extra = [dd for dd in dims[4:ndim + 1] if dd > 1] if ndim > 3 else []
+    if ndim < 3 or extra or min(dims[1:4]) < 2:
+        problems.append('not a 3D volume (dims ' + str(dims[:ndim + 1]) +
+                        ')')
+
+    voxel_size = [abs(pp) for pp in header['pixdim'][1:4]]
+    if min(voxel_size) <= 0:
+        problems.append('invalid voxel size ' + str(voxel_size))
+    elif max(voxel_size) > max_voxel_size:
+        problems.append('voxel size ' +
+                        'x'.join('{:.2f}'.format(vv) for vv in voxel_size) +
+                        ' mm is coarser than ' + str(max_voxel_size) + ' mm')
+
+    if header['qform_code'] <= 0 and header['sform_code'] <= 0:
+        problems.append('no qform or sform orientation')
+    elif header['orientation'] is None:
+        problems.append('degenerate orientation matrix')
+
+    return problems
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
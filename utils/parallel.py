@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Share the CPUs between recon-all runs and run several at once
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+import utils.system
+
+
+log = logging.getLogger(__name__)
+
+
+PARALLEL_MODES = ['none', 'hemispheres', 'auto']
+
+
+def plan_threads(cpu_count, num_runs, max_concurrent, mode):
+    """Split the CPU budget for one step of the pipeline.
+
+    The CPUs are shared by the recon-all runs that go at the same time (up to
+    max_concurrent of the num_runs time points).  With hemisphere parallelism
+    (recon-all -parallel) the left and right hemisphere streams run at the
+    same time, so each gets half of a run's CPUs as OpenMP threads.  "auto"
+    uses -parallel when a run has at least 2 CPUs.
+
+    Args:
+        cpu_count (int): number of CPUs the gear can use
+        num_runs (int): number of recon-all runs in this step
+        max_concurrent (int): most runs to do at the same time
+        mode (str): one of PARALLEL_MODES
+
+    Returns:
+        plan (dict): concurrent (number of runs at the same time),
+            cpus_per_run, hemispheres (bool: use -parallel), and openmp
+            (threads for -openmp)
+    """
+
+    if mode not in PARALLEL_MODES:
+        raise ValueError('Unknown parallel mode "' + str(mode) + '"')
+
+    concurrent = max(1, min(max_concurrent, num_runs, cpu_count))
+    cpus_per_run = max(1, cpu_count // concurrent)
+
+    if mode == 'hemispheres':
+        hemispheres = True
+    elif mode == 'auto':
+        hemispheres = cpus_per_run >= 2
+    else:
+        hemispheres = False
+
+    openmp = max(1, cpus_per_run // 2) if hemispheres else cpus_per_run
+
+    return {'concurrent': concurrent, 'cpus_per_run': cpus_per_run,
+            'hemispheres': hemispheres, 'openmp': openmp}
+
+
+def plan_options(plan):
+    """recon-all options for a plan from plan_threads()"""
+
+    options = ' -openmp ' + str(plan['openmp'])
+    if plan['hemispheres']:
+        options += ' -parallel'
+    return options
+
+
+def run_jobs(jobs, max_workers):
+    """Call each job (a function with no arguments) using up to max_workers
+    threads.
+
+    If a job raises an exception, jobs that have not started are cancelled,
+    the commands that are still running are killed, and the exception is
+    raised here.
+
+    Returns:
+        results (list): what each job returned, in the same order as jobs
+    """
+
+    if max_workers <= 1:
+        return [job() for job in jobs]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(job) for job in jobs]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                for other in not_done:
+                    other.cancel()
+                utils.system.terminate_all()
+                raise future.exception()
+
+    return [future.result() for future in futures]
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
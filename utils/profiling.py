@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Profile the gear's own Python code with cProfile and tracemalloc
+
+Each phase (e.g. initialize) gets a .pstats file that can be loaded with
+pstats or snakeviz, and a text report with the functions that took the most
+time and the lines that allocated the most memory.  Time spent waiting for
+recon-all can be left out with paused().
+
+Nothing is done until start() is called, so phase() and paused() cost
+nothing when profiling is off.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """Writes a profile of each phase to the output directory.
+
+    Args:
+        output_dir (str): where to put the reports
+        prefix (str): start of the report file names
+        frames (int): how many frames of the stack tracemalloc keeps for
+            each allocation
+    """
+
+    def __init__(self, output_dir, prefix, frames=10):
+
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self._current = None
+        tracemalloc.start(frames)
+
+    @contextmanager
+    def phase(self, name):
+        """Profile what is in it (only in the calling thread)"""
+
+        profile = cProfile.Profile()
+        before = self._snapshot()
+        if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9
+            tracemalloc.reset_peak()
+        start = time.time()
+        self._current = profile
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._current = None
+            seconds = time.time() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            try:
+                self._report(name, profile, before, self._snapshot(),
+                             seconds, peak)
+            except Exception as e:  # a lost profile is not fatal
+                log.warning('Could not write profile of ' + name + ': ' +
+                            str(e))
+
+    @contextmanager
+    def paused(self):
+        """Leave what is in it out of the current phase's profile"""
+
+        profile = self._current
+        if profile is None:
+            yield
+            return
+        profile.disable()
+        try:
+            yield
+        finally:
+            profile.enable()
+
+    def _snapshot(self):
+
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, __file__)))
+
+    def _report(self, name, profile, before, after, seconds, peak):
+
+        path = os.path.join(self.output_dir, self.prefix + name)
+        profile.dump_stats(path + '.pstats')
+
+        with open(path + '.txt', 'w') as fh:
+            fh.write('Phase: ' + name + '\n')
+            fh.write('Wall time: {:.1f} seconds '.format(seconds) +
+                     '(including time paused)\n')
+            fh.write('Peak traced memory: {:.1f} MB\n\n'.format(
+                peak / 1024 ** 2))
+
+            fh.write('Functions by cumulative time:\n')
+            stats = pstats.Stats(profile, stream=fh)
+            stats.sort_stats('cumulative').print_stats(40)
+
+            fh.write('Memory allocated during the phase and still held at ' +
+                     'the end, by line:\n\n')
+            for stat in after.compare_to(before, 'lineno')[:30]:
+                fh.write(str(stat) + '\n')
+
+            fh.write('\nLargest allocations held at the end, with where ' +
+                     'they were made:\n\n')
+            for stat in after.statistics('traceback')[:5]:
+                fh.write('{} blocks, {:.1f} KiB\n'.format(
+                    stat.count, stat.size / 1024))
+                for line in stat.traceback.format():
+                    fh.write(line + '\n')
+                fh.write('\n')
+
+        log.info('Wrote profile of ' + name + ' to ' + path + '.pstats')
+
+
+_profiler = None
+
+
+def start(output_dir, prefix):
+    """Start profiling the phases, see Profiler"""
+
+    global _profiler
+    _profiler = Profiler(output_dir, prefix)
+    return _profiler
+
+
+def phase(name):
+    """Context manager that profiles what is in it"""
+
+    if _profiler is None:
+        return _nothing()
+    return _profiler.phase(name)
+
+
+def paused():
+    """Context manager that leaves what is in it out of the profile"""
+
+    if _profiler is None:
+        return _nothing()
+    return _profiler.paused()
+
+
+@contextmanager
+def _nothing():
+
+    yield
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -0,0 +1,212 @@
+"""Rates of change of the longitudinal tables, from the scan dates
+
+For each table made by freesurfer_tables.pl (study, scrnum, visit, then one
+column per variable) three more are made with the same variable columns:
+
+    *_change.csv      change per year from the visit before
+    *_pct_change.csv  the same, as a percentage of the value at the visit
+                      before
+    *_slope.csv       least-squares slope per year over all of a subject's
+                      visits
+
+The visits of a subject are a visits x variables matrix, so each rate is
+computed for all variables at once.
+"""
+
+import csv
+import datetime
+import logging
+import os
+
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+
+DAYS_PER_YEAR = 365.25
+
+# Tables that are not one row per visit
+SKIPPED = ('_dictionary.csv', '_dropped_visits.csv', '_change.csv',
+           '_pct_change.csv', '_slope.csv')
+
+
+def parse_date(created):
+    """Scan time from the acquisition timestamp in ISO format
+
+    Returns:
+        when (datetime.datetime): None if it is not known
+    """
+
+    try:
+        return datetime.datetime.strptime(created[:19], '%Y-%m-%dT%H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def read_table(path):
+    """The rows of a table as a matrix
+
+    Returns:
+        (header, ids, values): the header, the (study, scrnum, visit) of
+            each row, and the variables as a rows x variables array, NaN
+            where a value is not a number
+
+    Raises:
+        ValueError: if the table does not start with study, scrnum, visit
+    """
+
+    with open(path, 'r', newline='') as fh:
+        rows = list(csv.reader(fh))
+    if not rows or rows[0][:3] != ['study', 'scrnum', 'visit']:
+        raise ValueError('Not a table of visits: ' + path)
+    header = rows[0]
+    ids = [tuple(row[:3]) for row in rows[1:]]
+
+    def number(text):
+        try:
+            return float(text)
+        except ValueError:
+            return np.nan
+
+    # a short row is missing its last values
+    values = np.array([[number(vv) for vv in row[3:len(header)]] +
+                       [np.nan] * (len(header) - max(len(row), 3))
+                       for row in rows[1:]],
+                      dtype=float).reshape(len(ids), len(header) - 3)
+    return header, ids, values
+
+
+def change_rates(years, values):
+    """Rates of change of one subject's visits
+
+    Args:
+        years (numpy array): time of each visit in years, ascending
+        values (numpy array): visits x variables
+
+    Returns:
+        (change, pct_change, slope): change per year and percent change per
+            year from each visit to the next ((visits - 1) x variables), and
+            the least-squares slope per year of each variable, NaN where
+            there is not enough to go on
+    """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = np.diff(years)[:, np.newaxis]
+        step = np.where(step > 0, step, np.nan)
+        diff = np.diff(values, axis=0)
+        change = diff / step
+        pct_change = 100.0 * change / values[:-1]
+
+        # slope of each column over the visits where it has a value
+        have = ~np.isnan(values)
+        count = have.sum(axis=0)
+        tt = np.where(have, years[:, np.newaxis], 0.0)
+        xx = np.where(have, values, 0.0)
+        t_mean = tt.sum(axis=0) / count
+        x_mean = xx.sum(axis=0) / count
+        t_dev = np.where(have, years[:, np.newaxis] - t_mean, 0.0)
+        slope = (t_dev * (xx - x_mean)).sum(axis=0) / \
+            (t_dev ** 2).sum(axis=0)
+        slope = np.where(count >= 2, slope, np.nan)
+
+    pct_change[~np.isfinite(pct_change)] = np.nan
+    slope[~np.isfinite(slope)] = np.nan
+    return change, pct_change, slope
+
+
+def _format(value):
+
+    return '' if np.isnan(value) else '{:.6g}'.format(value)
+
+
+def _write_rates(path, dates):
+    """Write the rates of change of one table
+
+    Returns:
+        written (list of str): paths of the tables made
+    """
+
+    name = os.path.basename(path)
+    try:
+        header, ids, values = read_table(path)
+    except ValueError as e:
+        log.info(str(e))
+        return []
+    if not ids:
+        log.warning('No visits in ' + name + ', no rates of change')
+        return []
+
+    change_rows = []
+    pct_rows = []
+    slope_rows = []
+    for subject in sorted(set(ii[:2] for ii in ids)):
+        rows = [nn for nn, ii in enumerate(ids)
+                if ii[:2] == subject and dates.get(ii[2])]
+        if len(rows) < 2:
+            log.warning('Fewer than 2 dated visits of ' + subject[1] +
+                        ' in ' + name + ', no rates of change')
+            continue
+        rows.sort(key=lambda nn: dates[ids[nn][2]])
+        first = dates[ids[rows[0]][2]]
+        years = np.array([(dates[ids[nn][2]] - first).total_seconds() /
+                          (86400 * DAYS_PER_YEAR) for nn in rows])
+        change, pct_change, slope = change_rates(years, values[rows])
+
+        for kk in range(1, len(rows)):
+            start = [subject[0], subject[1], ids[rows[kk]][2],
+                     ids[rows[kk - 1]][2],
+                     '{:.4f}'.format(years[kk] - years[kk - 1])]
+            change_rows.append(start + [_format(vv)
+                                        for vv in change[kk - 1]])
+            pct_rows.append(start + [_format(vv)
+                                     for vv in pct_change[kk - 1]])
+        slope_rows.append([subject[0], subject[1], str(len(rows)),
+                           '{:.4f}'.format(years[-1])] +
+                          [_format(vv) for vv in slope])
+
+    if not slope_rows:
+        return []
+    written = []
+    base = path[:-len('.csv')]
+    interval = ['study', 'scrnum', 'visit', 'previous_visit', 'years']
+    for suffix, columns, rows in (
+            ('_change.csv', interval, change_rows),
+            ('_pct_change.csv', interval, pct_rows),
+            ('_slope.csv', ['study', 'scrnum', 'visits', 'years'],
+             slope_rows)):
+        with open(base + suffix, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(columns + header[3:])
+            writer.writerows(rows)
+        written.append(base + suffix)
+    return written
+
+
+def write_change_tables(tables_dir, dates):
+    """Write the rates of change of each table in tables_dir
+
+    A table that cannot be read is left out with a warning, the rates of
+    change are an extra.
+
+    Args:
+        tables_dir (str): where freesurfer_tables.pl put the tables
+        dates (dict): visit: scan time (datetime.datetime) of each visit
+
+    Returns:
+        written (list of str): paths of the tables made
+    """
+
+    written = []
+    for name in sorted(os.listdir(tables_dir)):
+        if not name.endswith('.csv') or name.endswith(SKIPPED):
+            continue
+        try:
+            written += _write_rates(os.path.join(tables_dir, name), dates)
+        except Exception as e:
+            log.warning('No rates of change for ' + name + ': ' + str(e))
+
+    log.info('Wrote ' + str(len(written)) + ' tables of rates of change')
+    return written
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -0,0 +1,148 @@
+"""A few values of the tables, put in the analysis info so they can be
+searched for without downloading the tables
+
+The variables are chosen with patterns like "Left-Hippocampus" or
+"lh_*_thickness" (see fnmatch), in order of importance.  For each one the
+info has its value at each visit, at the first and the last visit (so a
+single query finds e.g. a small hippocampus at baseline), and its slope per
+year if there is a *_slope.csv table:
+
+    {"Left-Hippocampus": {"visits": {"V01": 4012.3, "V02": 3987.1},
+                          "baseline": 4012.3, "latest": 3987.1,
+                          "slope_per_year": -25.2},
+     ...}
+
+If all of them would make the info bigger than the size limit, the least
+important ones are left out.
+"""
+
+import csv
+import fnmatch
+import json
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+# Tables that are not one row per visit, only the slopes are used
+SKIPPED = ('_dictionary.csv', '_dropped_visits.csv', '_change.csv',
+           '_pct_change.csv', '_slope.csv')
+
+
+def parse_patterns(text):
+    """Patterns from a comma or space separated list"""
+
+    return [pp for pp in (text or '').replace(',', ' ').split() if pp]
+
+
+def _number(text):
+
+    try:
+        return float('{:.6g}'.format(float(text)))
+    except ValueError:
+        return None
+
+
+def _read(path):
+
+    with open(path, 'r', newline='') as fh:
+        rows = list(csv.reader(fh))
+    if not rows:
+        return [], []
+    return rows[0], rows[1:]
+
+
+def collect_metrics(tables_dir, patterns, dates=None):
+    """The variables matching patterns, most important first
+
+    Args:
+        tables_dir (str): where the tables are
+        patterns (list of str): fnmatch patterns of variable names, the
+            first is the most important
+        dates (dict): visit: scan time, to order the visits; visits with
+            no date go last
+
+    Returns:
+        metrics (list of (name, dict)): see the module's docstring
+    """
+
+    dates = dates or {}
+    values = {}  # variable: {visit: value}
+    slopes = {}
+    source = {}  # variable: the table it is taken from, e.g. aparc and
+                 # aparc.DKTatlas tables have some of the same variables
+    for name in sorted(os.listdir(tables_dir)):
+        slope_table = name.endswith('_slope.csv')
+        if not name.endswith('.csv') or \
+                (name.endswith(SKIPPED) and not slope_table):
+            continue
+        header, rows = _read(os.path.join(tables_dir, name))
+        table = name[:-len('_slope.csv')] if slope_table else name[:-4]
+        if slope_table:
+            first = header.index('years') + 1 if 'years' in header else None
+        elif header[:3] == ['study', 'scrnum', 'visit']:
+            first = 3
+        else:
+            first = None
+        if first is None:
+            continue
+
+        for cc in range(first, len(header)):
+            variable = header[cc]
+            if not any(fnmatch.fnmatchcase(variable, pp) for pp in patterns):
+                continue
+            if source.setdefault(variable, table) != table:
+                continue
+            for row in rows:
+                value = _number(row[cc]) if cc < len(row) else None
+                if value is None:
+                    continue
+                if slope_table:
+                    slopes[variable] = value
+                else:
+                    values.setdefault(variable, {})[row[2]] = value
+
+    def priority(variable):
+        return [nn for nn, pp in enumerate(patterns)
+                if fnmatch.fnmatchcase(variable, pp)][0]
+
+    def visit_order(visit):
+        when = dates.get(visit)
+        return (when is None, when or 0, visit)
+
+    metrics = []
+    for variable in sorted(values, key=lambda vv: (priority(vv), vv)):
+        visits = sorted(values[variable], key=visit_order)
+        entry = {'visits': {vv: values[variable][vv] for vv in visits},
+                 'baseline': values[variable][visits[0]],
+                 'latest': values[variable][visits[-1]]}
+        if variable in slopes:
+            entry['slope_per_year'] = slopes[variable]
+        metrics.append((variable, entry))
+    return metrics
+
+
+def limit_size(metrics, max_bytes):
+    """As many of the metrics as fit in max_bytes of JSON
+
+    Returns:
+        (info, omitted): the metrics as a dict, and the names of the ones
+            left out
+    """
+
+    info = {}
+    size = 2  # {}
+    omitted = []
+    for variable, entry in metrics:
+        # the key, the value, ': ' and ', '
+        added = len(json.dumps(variable)) + len(json.dumps(entry)) + 4
+        if omitted or size + added > max_bytes:
+            omitted.append(variable)
+            continue
+        info[variable] = entry
+        size += added
+    return info, omitted
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
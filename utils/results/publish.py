@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Publish finished subject directories and tables while the gear runs
+
+Each finished subject directory is zipped into the output directory as it
+is made, and uploaded right away if the gear can upload, instead of all of
+the results being zipped after the last recon-all.
+"""
+
+import os
+import logging
+import shutil
+import time
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from utils.background import Worker
+
+
+log = logging.getLogger(__name__)
+
+
+class Publisher:
+    """Put results in the output directory as soon as they are made instead
+    of when the gear is done, and upload them to the analysis right away if
+    an upload function is given.
+
+    Files are zipped and uploaded in the background.  A file that was
+    uploaded is removed from the output directory so the upload after the
+    gear exits has nothing left to do.  If uploading fails, the file stays
+    to be uploaded then.
+
+    Args:
+        output_dir (str): the gear's output directory
+        upload (function): upload(path) attaches a file to the analysis,
+            None to only stage files in the output directory
+        source_dir (str): where the paths given to add_zip() are, if not
+            in the output directory (e.g. a scratch directory laid out the
+            same way)
+    """
+
+    def __init__(self, output_dir, upload=None, source_dir=None):
+
+        self.output_dir = output_dir
+        self.upload = upload
+        self.source_dir = source_dir or output_dir
+        self.published = set()  # names of the files published so far
+        self._worker = Worker('Publishing results')
+
+    def add_file(self, path):
+        """Publish a copy of a file"""
+
+        self._worker.submit(self._add_file, path)
+
+    def add_zip(self, name, paths):
+        """Publish a zip file of files and directories.
+
+        Args:
+            name (str): zip file name
+            paths (list of str): relative to the source directory, which
+                is how they are stored in the zip file
+        """
+
+        self._worker.submit(self._add_zip, name, paths)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued has been published.
+
+        Returns:
+            done (bool): False if it timed out
+        """
+
+        return self._worker.flush(timeout)
+
+    def _add_file(self, path):
+
+        dest = os.path.join(self.output_dir, os.path.basename(path))
+        if os.path.abspath(path) != os.path.abspath(dest):
+            shutil.copy(path, dest)
+        self._publish(dest)
+
+    def _add_zip(self, name, paths):
+
+        start = time.time()
+        dest = os.path.join(self.output_dir, name)
+        try:
+            with ZipFile(dest + '.part', 'w', ZIP_DEFLATED) as outzip:
+                for path in paths:
+                    self._zip_path(outzip, path)
+        except Exception:
+            os.remove(dest + '.part')
+            raise
+        os.replace(dest + '.part', dest)
+        log.info('Zipped ' + name + ' in {:.1f} seconds'.format(
+            time.time() - start))
+        self._publish(dest)
+
+    def _zip_path(self, outzip, path):
+
+        full_path = os.path.join(self.source_dir, path)
+        if os.path.isfile(full_path):
+            outzip.write(full_path, path)
+            return
+        for root, _, files in os.walk(full_path):
+            for fl in files:
+                fl_path = os.path.join(root, fl)
+                outzip.write(fl_path, os.path.relpath(fl_path,
+                                                      self.source_dir))
+
+    def _publish(self, path):
+
+        name = os.path.basename(path)
+        if self.upload:
+            try:
+                self.upload(path)
+                os.remove(path)
+                log.info('Uploaded ' + name)
+            except Exception as e:
+                log.warning('Could not upload ' + name + ', it will be ' +
+                            'uploaded when the gear is done: ' + str(e))
+        self.published.add(name)
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -8,8 +8,19 @@ from zipfile import ZipFile, ZIP_DEFLATED
 log = logging.getLogger(__name__)
 
 
-def zip_output(context):
-    """Create zipped results"""
+def zip_output(context, exclude=None, remove=False):
+    """Create zipped results
+
+    Args:
+        exclude (list of str): directories to leave out, relative to
+            context.output_dir like the paths in the zip file
+        remove (bool): delete each file once it is in the zip file, and
+            then the directories left empty, so the tree is not walked
+            again to remove it
+
+    Returns:
+        dest_zip (str): the zip file, None if there was nothing to zip
+    """
 
 
     # This executes regardless of errors or exit status,
@@ -47,12 +58,28 @@ def zip_output(context):
         )
 
         outzip = ZipFile(dest_zip, 'w', ZIP_DEFLATED)
-        for root, _, files in os.walk(actual_dir):
+        exclude = [os.path.normpath(ee) for ee in exclude or []]
+        walked = []
+        for root, dirs, files in os.walk(actual_dir):
+            walked.append(root)
+            dirs[:] = [dd for dd in dirs
+                       if os.path.join(root, dd) not in exclude]
             for fl in files:
                 fl_path = os.path.join(root,fl)
                 outzip.write(fl_path)
+                if remove:
+                    os.remove(fl_path)
         outzip.close()
 
+        if remove:
+            for root in reversed(walked):
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass  # not empty: excluded directories, links
+
+        return dest_zip
+
     else:
 
         log.error('Output directory does not exist: ' + full_path)
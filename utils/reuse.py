@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Use the results of an earlier cross-sectional recon-all (e.g. from the
+freesurfer-recon-all gear) instead of running it again
+
+A session's analyses are searched for one that ran on the same input file
+and has a zipped FreeSurfer subject directory in its outputs.  After it is
+unpacked, the subject directory is only used if recon-all finished, with the
+same FreeSurfer version and the same options that matter (-3T, -hires).
+"""
+
+import logging
+import os
+import shutil
+import zipfile
+
+
+log = logging.getLogger(__name__)
+
+
+# recon-all options that change the results, they must be the same as for
+# the time points that are run here
+MATCHING_FLAGS = ['-3T', '-hires']
+
+
+def find_prior_analyses(fw, session_id, file_name, gear_names):
+    """Analyses on a session that can have a cross-sectional result.
+
+    Args:
+        fw (flywheel.Client)
+        session_id (str)
+        file_name (str): the time point's input file, the analysis must
+            have used it as an input
+        gear_names (list of str): gears that run recon-all
+
+    Returns:
+        analyses (list): newest first
+    """
+
+    analyses = []
+    for analysis in fw.get_session_analyses(session_id):
+        gear_info = analysis.gear_info or {}
+        if gear_info.get('name') not in gear_names:
+            continue
+        inputs = [ff.name for ff in (analysis.inputs or [])]
+        if file_name not in inputs:
+            continue
+        if not any(ff.name.endswith('.zip') for ff in (analysis.files or [])):
+            continue
+        analyses.append(analysis)
+    return sorted(analyses, key=lambda aa: aa.created, reverse=True)
+
+
+def unpack_subject(zip_path, subjects_dir, subject_dir):
+    """Unpack the FreeSurfer subject directory in a zip file as
+    subjects_dir/subject_dir.
+
+    The subject directory is the one that holds scripts/recon-all.done,
+    wherever it is in the zip file.
+
+    Returns:
+        found (bool): False if the zip file has no subject directory
+    """
+
+    marker = 'scripts/recon-all.done'
+    with zipfile.ZipFile(zip_path) as zf:
+        names = zf.namelist()
+        prefixes = [nn[:-len(marker)] for nn in names if nn.endswith(marker)]
+        if len(prefixes) != 1:
+            return False
+        prefix = prefixes[0]
+
+        dest = os.path.join(subjects_dir, subject_dir)
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
+        for name in names:
+            if not name.startswith(prefix) or name.endswith('/'):
+                continue
+            parts = name[len(prefix):].split('/')
+            if '..' in parts:
+                raise ValueError('Unexpected member "' + name + '" in ' +
+                                 zip_path)
+            path = os.path.join(dest, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with zf.open(name) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+    return True
+
+
+def read_done_file(subject_path):
+    """Fields of scripts/recon-all.done as a dict, {} if it is missing"""
+
+    fields = {}
+    try:
+        with open(os.path.join(subject_path, 'scripts', 'recon-all.done'),
+                  'r') as fh:
+            for line in fh:
+                key, _, value = line.strip().partition(' ')
+                if key and not key.startswith('-'):
+                    fields[key] = value.strip()
+    except OSError:
+        pass
+    return fields
+
+
+def check_subject(subject_path, build_stamp, flags):
+    """Find reasons an unpacked subject directory can't be used.
+
+    Args:
+        subject_path (str): the subject directory
+        build_stamp (str): this FreeSurfer's build-stamp.txt, None if
+            unknown
+        flags (str): the recon-all options used for the other time points
+
+    Returns:
+        problems (list of str): empty if it can be used
+    """
+
+    problems = []
+
+    done = read_done_file(subject_path)
+    args = done.get('CMDARGS', '').split()
+    if not args:
+        problems.append('recon-all did not finish')
+    elif '-all' not in args and '-autorecon-all' not in args:
+        problems.append('recon-all was not run with -all')
+
+    if os.path.exists(os.path.join(subject_path, 'scripts',
+                                   'recon-all-status.log')):
+        with open(os.path.join(subject_path, 'scripts',
+                               'recon-all-status.log'), 'r') as fh:
+            lines = fh.read().splitlines()
+        if not lines or 'finished without error' not in lines[-1]:
+            problems.append('recon-all did not finish without error')
+
+    for flag in MATCHING_FLAGS:
+        if (flag in args) != (flag in flags.split()):
+            problems.append('recon-all was run ' +
+                            ('with ' if flag in args else 'without ') + flag)
+
+    if build_stamp is not None:
+        try:
+            with open(os.path.join(subject_path, 'scripts',
+                                   'build-stamp.txt'), 'r') as fh:
+                stamp = fh.read().strip()
+        except OSError:
+            stamp = None
+        if stamp != build_stamp:
+            problems.append('FreeSurfer version "' + str(stamp) + '" is ' +
+                            'not "' + build_stamp + '"')
+
+    return problems
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
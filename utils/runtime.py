@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Predict how long recon-all runs will take, to start the longest first and
+to estimate when the gear will finish
+"""
+
+import logging
+import statistics
+
+
+log = logging.getLogger(__name__)
+
+
+# Rough minutes for one recon-all run of a 256x256x256 1.5T scan.  They only
+# matter until a run of the step has been timed, see RuntimePredictor.
+DEFAULT_MINUTES = {'cross-sectional': 420.0, 'base': 150.0,
+                   'longitudinal': 240.0}
+
+REFERENCE_VOXELS = 256 ** 3
+
+# recon-all conforms every scan to 256^3 1mm, so only some stages (motion
+# correction, conforming, high resolution input) grow with the voxel count
+VOXEL_EXPONENT = 0.3
+
+# Higher SNR at 3T usually means fewer topology defects to fix
+THREE_T_FACTOR = 0.9
+
+
+def timepoint_features(header, field_strength):
+    """Features of a time point's scan used to predict its runtime.
+
+    Args:
+        header (dict): from utils.nifti.read_nifti_header(), can be None
+        field_strength (float): Tesla (or mT), can be None
+
+    Returns:
+        features (dict): voxels (int or None) and field_strength (float or
+            None, in Tesla)
+    """
+
+    voxels = None
+    if header:
+        voxels = 1
+        for dd in header['dims'][1:4]:
+            voxels *= max(1, dd)
+
+    if field_strength is not None and field_strength > 100:
+        field_strength /= 1000  # mT
+
+    return {'voxels': voxels, 'field_strength': field_strength}
+
+
+class RuntimePredictor:
+    """Predict the minutes a recon-all run will take from its scan.
+
+    A prior comes from the step's default minutes scaled by the voxel count
+    and field strength.  A longitudinal run is mostly a repeat of the same
+    scan's cross-sectional run with a head start from the template, so once
+    that is timed the prior is a fraction of it instead.  Timed runs of a
+    step (from this gear run or earlier ones, see record()) give a
+    correction: the median ratio of measured to prior minutes, which also
+    takes in the CPU plan and the speed of the machine.
+
+    Args:
+        defaults (dict): minutes for each step, see DEFAULT_MINUTES
+    """
+
+    # longitudinal minutes / cross-sectional minutes of the same scan
+    LONGITUDINAL_FRACTION = 0.55
+
+    def __init__(self, defaults=None):
+
+        self.defaults = dict(DEFAULT_MINUTES)
+        self.defaults.update(defaults or {})
+        self.ratios = {}  # step -> list of measured / prior
+        self.cross_minutes = {}  # time point name -> measured minutes
+
+    def prior(self, step, features, name=None):
+        """Minutes expected before any run of the step has been timed"""
+
+        if step == 'longitudinal' and name in self.cross_minutes:
+            return self.cross_minutes[name] * self.LONGITUDINAL_FRACTION
+
+        minutes = self.defaults[step]
+        if features.get('voxels'):
+            minutes *= (features['voxels'] / REFERENCE_VOXELS) ** \
+                       VOXEL_EXPONENT
+        field_strength = features.get('field_strength')
+        if field_strength is not None and abs(field_strength - 3) < 0.2:
+            minutes *= THREE_T_FACTOR
+        return minutes
+
+    def predict(self, step, features, name=None):
+        """Minutes a run of this step is expected to take.
+
+        Args:
+            step (str): "cross-sectional", "base" or "longitudinal"
+            features (dict): from timepoint_features()
+            name (str): the time point (visit), to use its cross-sectional
+                time for the longitudinal run
+        """
+
+        minutes = self.prior(step, features, name)
+        if self.ratios.get(step):
+            minutes *= statistics.median(self.ratios[step])
+        return minutes
+
+    def record(self, step, features, minutes, name=None):
+        """Learn from a run that finished"""
+
+        if minutes <= 0:
+            return
+        prior = self.prior(step, features, name)
+        self.ratios.setdefault(step, []).append(minutes / prior)
+        if step == 'cross-sectional' and name is not None:
+            self.cross_minutes[name] = minutes
+
+
+def longest_first(predictions):
+    """Keys of predictions (dict of minutes) ordered longest first"""
+
+    return sorted(predictions, key=lambda kk: -predictions[kk])
+
+
+def list_schedule(durations, workers, busy=None):
+    """Minutes until all jobs are done if each is started, in the given
+    order, as soon as one of the workers is free.
+
+    Args:
+        durations (list of float): minutes of each job not started yet
+        workers (int): number of jobs that can run at the same time
+        busy (list of float): minutes left for jobs that are already running
+
+    Returns:
+        minutes (float)
+    """
+
+    loads = list(busy or [])
+    loads += [0.0] * (max(1, workers) - len(loads))
+    for duration in durations:
+        loads.sort()
+        loads[0] += duration
+    return max(loads)
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -3,13 +3,24 @@
 """
 
 import logging
+import os
+import signal
+import threading
+import time
 from subprocess import Popen, PIPE, STDOUT
 
+import utils.metrics
+
 
 log = logging.getLogger(__name__)
 
 
-def run(context, command):
+# Processes started by run() that have not finished yet
+_running = set()
+_running_lock = threading.Lock()
+
+
+def run(context, command, ignore_errors=False, watchdog=None, usage=None):
     """Execute a command line command using subprocess.Popen().  
     
     Why?  Because the version of python in the BIDS App Freesurfer container 
@@ -17,21 +28,87 @@ def run(context, command):
 
     Args:
         command (str): command line command to run
+        ignore_errors (bool): return a non-zero return code instead of
+            raising an exception
+        watchdog (utils.watchdog.Watchdog): if given, it watches the command
+            while it runs
+        usage (dict): if given, wall_seconds and cpu_seconds (user + system
+            time of the command and everything it waited for, None if
+            unknown) are put in it
+
+    The command is run in its own process group so that all of it can be
+    killed (by the watchdog or terminate_all()).  How many are running and
+    their return codes are counted in utils.metrics.
     """
     log.info('Running: ' + command)
-    ignore_errors=False
+    name = os.path.basename(command.split()[0])
+    start = time.time()
     process = Popen(command, stdout=PIPE, stderr=STDOUT, shell=True, 
-                    env=context.gear_dict['environ'])
-    while True:
-        line = process.stdout.readline()
-        line = str(line, 'utf-8')[:-1]
-        print(line)
-        if line == '' and process.poll() is not None:
-            break
+                    env=context.gear_dict['environ'],
+                    start_new_session=True)
+    with _running_lock:
+        _running.add(process)
+    utils.metrics.add('grp14_processes_active', 1, command=name)
+    if watchdog:
+        watchdog.watch(process)
+    try:
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                break
+            print(str(line, 'utf-8')[:-1])
+        if usage is not None:
+            usage['cpu_seconds'] = _cpu_seconds(process.pid)
+            usage['wall_seconds'] = time.time() - start
+        process.wait()
+    finally:
+        if watchdog:
+            watchdog.stop()
+        with _running_lock:
+            _running.discard(process)
+        utils.metrics.add('grp14_processes_active', -1, command=name)
+    utils.metrics.inc('grp14_commands_total', command=name,
+                      return_code=process.returncode)
     if process.returncode != 0 and not ignore_errors:
+        if watchdog and watchdog.expired:
+            raise Exception('Stopped by watchdog: ' +
+                            watchdog.expired['reason'])
         raise Exception("Non zero return code: %d" % process.returncode)
 
     return process.returncode
 
 
+def _cpu_seconds(pid):
+    """CPU time of a finished child process and its waited for children.
+
+    Waits for the process to end without reaping it, so its /proc entry is
+    still there to read.
+    """
+
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        with open('/proc/' + str(pid) + '/stat', 'r') as fh:
+            stat = fh.read()
+    except OSError:
+        return None  # already reaped
+    # utime, stime, cutime, cstime come after the state and 10 other fields
+    fields = stat[stat.rindex(')') + 2:].split()
+    ticks = sum(int(ff) for ff in fields[11:15])
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def terminate_all(sig=signal.SIGTERM):
+    """Send a signal to the process groups of all commands still running"""
+
+    with _running_lock:
+        processes = list(_running)
+    for process in processes:
+        log.warning('Sending signal ' + str(int(sig)) + ' to process group ' +
+                    str(process.pid))
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+
 # vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
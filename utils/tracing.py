@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Time the phases of the gear as nested spans, written as JSON lines
+
+Like OpenTelemetry tracing, but to a local file: each line is one span with
+its name, start and end times, the span it is in, attributes (e.g. the time
+point, bytes or a return code), and whether it raised an exception.
+
+    with span('download', file=name) as sp:
+        ...
+        sp.set('bytes', size)
+
+Nothing is written until start() is called, so spans cost nothing when
+tracing is off.  A span made in a thread that is not in any span is put in
+the span the main thread is in, e.g. recon-all runs in the step that
+started them.
+"""
+
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__name__)
+
+
+_tracer = None
+
+
+class Span:
+    """One timed phase.  Ended by the span() context manager, or by end()
+    if it was made with start_span()."""
+
+    def __init__(self, tracer, name, parent_id, attributes):
+
+        self.tracer = tracer
+        self.name = name
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.ended = False
+
+    def set(self, key, value):
+        """Add an attribute"""
+
+        self.attributes[key] = value
+
+    def end(self, error=None):
+
+        if self.tracer is not None:
+            self.tracer.end(self, error)
+
+
+class Tracer:
+    """Writes spans to a JSON lines file.  Make it in the main thread.
+
+    Args:
+        path (str): the file, appended to
+        attributes (dict): added to every span, e.g. the gear version
+    """
+
+    def __init__(self, path, attributes=None):
+
+        self.path = path
+        self.trace_id = _random_id(16)
+        self.attributes = attributes or {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main_stack = self._stack()
+        self._fh = open(path, 'a')
+
+    def _stack(self):
+
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def start_span(self, name, **attributes):
+        """Start a span in the current one, it must be ended with end()"""
+
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is None and self._main_stack:
+            parent = self._main_stack[-1]
+        span = Span(self, name, parent.span_id if parent else None,
+                    attributes)
+        stack.append(span)
+        return span
+
+    def end(self, span, error=None):
+        """Write a span.  Spans started in it that were not ended (e.g.
+        because of an exception) are ended first."""
+
+        stack = self._stack()
+        if span in stack:
+            while stack[-1] is not span:
+                self.end(stack[-1], 'not ended')
+            stack.pop()
+        if span.ended:
+            return
+        span.ended = True
+
+        now = time.time()
+        record = {'trace_id': self.trace_id,
+                  'span_id': span.span_id,
+                  'parent_id': span.parent_id,
+                  'name': span.name,
+                  'start_time': round(span.start, 6),
+                  'end_time': round(now, 6),
+                  'duration_seconds': round(now - span.start, 6),
+                  'thread': threading.current_thread().name,
+                  'status': 'ok' if error is None else 'error',
+                  'attributes': dict(self.attributes, **span.attributes)}
+        if error is not None:
+            record['error'] = error
+        with self._lock:
+            if self._fh.closed:
+                return
+            self._fh.write(json.dumps(record, default=str) + '\n')
+            self._fh.flush()
+
+    @contextmanager
+    def span(self, name, **attributes):
+
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except SystemExit as e:
+            span.end(None if e.code in (0, None)
+                     else 'exit ' + str(e.code))
+            raise
+        except BaseException as e:
+            span.end(type(e).__name__ + ': ' + str(e))
+            raise
+        span.end()
+
+    def close(self):
+
+        with self._lock:
+            self._fh.close()
+
+
+def start(path, **attributes):
+    """Start writing spans to path.
+
+    Args:
+        path (str): JSON lines file
+        attributes: added to every span
+    """
+
+    global _tracer
+    _tracer = Tracer(path, attributes)
+    log.info('Writing trace to ' + path)
+    return _tracer
+
+
+def stop():
+    """Stop writing spans"""
+
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+
+
+def span(name, **attributes):
+    """Context manager that times what is in it as a span"""
+
+    if _tracer is None:
+        return _no_span()
+    return _tracer.span(name, **attributes)
+
+
+def start_span(name, **attributes):
+    """Start a span that is ended by calling its end()"""
+
+    if _tracer is None:
+        return Span(None, name, None, attributes)
+    return _tracer.start_span(name, **attributes)
+
+
+def _random_id(size):
+
+    return binascii.hexlify(os.urandom(size)).decode()
+
+
+@contextmanager
+def _no_span():
+
+    yield Span(None, '', None, {})
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Stop recon-all if it stops making progress or takes too long
+
+Progress is the growth of scripts/recon-all.log and scripts/
+recon-all-status.log in the subject's directory.  The stage is the last
+"#@#" line in recon-all-status.log.
+"""
+
+import logging
+import os
+import re
+import signal
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# e.g. "#@# Fix Topology lh Fri Dec 20 01:37:00 UTC 2019"
+STAGE_PATTERN = re.compile(
+    r'^#@#\s*(.*?)\s+\w{3} \w{3}\s+\d+ [\d:]+ \S+ \d{4}$')
+
+
+def parse_stage_timeouts(text):
+    """Parse "regex=minutes regex=minutes ..." into a list of pairs.
+
+    Args:
+        text (str): space separated list, e.g. "Fix.Topology=480 CA.Reg=600"
+
+    Returns:
+        stage_timeouts (list of (compiled regex, seconds))
+    """
+
+    stage_timeouts = []
+    for item in text.split():
+        regex, _, minutes = item.rpartition('=')
+        if not regex:
+            raise ValueError('Stage timeout "' + item + '" should look ' +
+                             'like regex=minutes')
+        stage_timeouts.append((re.compile(regex), float(minutes) * 60))
+    return stage_timeouts
+
+
+def group_processes(pgid):
+    """List the processes in a process group using /proc.
+
+    Returns:
+        processes (list of dict): pid, command, state and rss (bytes)
+    """
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    processes = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/' + entry + '/stat', 'r') as fh:
+                stat = fh.read()
+        except OSError:
+            continue  # it went away
+        # the command is in parentheses and can contain spaces
+        command = stat[stat.index('(') + 1:stat.rindex(')')]
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(fields[2]) != pgid:
+            continue
+        processes.append({'pid': int(entry), 'command': command,
+                          'state': fields[0],
+                          'rss': int(fields[21]) * page_size})
+    return processes
+
+
+def tail(path, num_lines, max_bytes=8192):
+    """Last lines of a text file, [] if it is missing"""
+
+    try:
+        with open(path, 'rb') as fh:
+            fh.seek(0, os.SEEK_END)
+            fh.seek(max(0, fh.tell() - max_bytes))
+            text = fh.read().decode('utf-8', errors='replace')
+    except OSError:
+        return []
+    return text.splitlines()[-num_lines:]
+
+
+class Watchdog(threading.Thread):
+    """Watch a recon-all process and kill its process tree if it hangs.
+
+    Create one for each recon-all command and pass it to utils.system.run(),
+    which starts it once the process is running, and stops it when the
+    process ends.  All timeouts are in seconds, 0 means no limit.
+
+    It also follows the memory use (resident set size) of all processes of
+    the command: rss is the latest total, peak_rss the largest, and
+    stage_peaks the largest in each stage.
+
+    Args:
+        subject_path (str): $SUBJECTS_DIR/<subject>, where the logs will be
+        stall_timeout (float): longest time with no growth of either log
+        global_timeout (float): longest time the whole command can run
+        stage_timeout (float): longest time in any one stage
+        stage_timeouts (list): (compiled regex, seconds) pairs that override
+            stage_timeout for the stages that match
+        poll_interval (float): longest time between checks in seconds
+    """
+
+    def __init__(self, subject_path, stall_timeout=0, global_timeout=0,
+                 stage_timeout=0, stage_timeouts=None, poll_interval=30.0):
+
+        super().__init__(daemon=True)
+
+        self.logs = [os.path.join(subject_path, 'scripts', 'recon-all.log'),
+                     os.path.join(subject_path, 'scripts',
+                                  'recon-all-status.log')]
+        self.stall_timeout = stall_timeout
+        self.global_timeout = global_timeout
+        self.stage_timeout = stage_timeout
+        self.stage_timeouts = stage_timeouts or []
+
+        limits = [tt for tt in [stall_timeout, global_timeout, stage_timeout] +
+                  [tt for _, tt in self.stage_timeouts] if tt > 0]
+        self.poll_interval = min([poll_interval] + [tt / 4 for tt in limits])
+
+        self.process = None
+        self.expired = None  # diagnostics (dict) once it has killed
+        self.stage = None
+        self.rss = 0
+        self.peak_rss = 0
+        self.stage_peaks = {}
+        self._stopping = threading.Event()
+
+    def watch(self, process):
+        """Start watching the (already started) process"""
+
+        self.process = process
+        self.start()
+
+    def stop(self):
+        """Stop watching, called when the process has ended"""
+
+        self._stopping.set()
+        if self.is_alive():
+            self.join()
+
+    def _stage_limit(self):
+        for regex, seconds in self.stage_timeouts:
+            if self.stage and regex.search(self.stage):
+                return seconds
+        return self.stage_timeout
+
+    def _current_stage(self):
+        for line in reversed(tail(self.logs[1], 20)):
+            match = STAGE_PATTERN.match(line)
+            if match:
+                return match.group(1)
+        return self.stage
+
+    def run(self):
+
+        start = time.time()
+        last_progress = start
+        stage_start = start
+        sizes = None
+
+        while not self._stopping.wait(self.poll_interval):
+
+            # not poll(), which would reap it before run() reads its usage
+            if self.process.returncode is not None:
+                return
+
+            now = time.time()
+
+            self.rss = sum(pp['rss'] for pp in
+                           group_processes(self.process.pid))
+            self.peak_rss = max(self.peak_rss, self.rss)
+            stage = str(self.stage)
+            self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0),
+                                          self.rss)
+
+            new_sizes = [os.path.getsize(ll) if os.path.exists(ll) else -1
+                         for ll in self.logs]
+            if new_sizes != sizes:
+                sizes = new_sizes
+                last_progress = now
+                stage = self._current_stage()
+                if stage != self.stage:
+                    self.stage = stage
+                    stage_start = now
+
+            reason = None
+            stage_limit = self._stage_limit()
+            if self.global_timeout > 0 and \
+               now - start > self.global_timeout:
+                reason = 'ran longer than ' + \
+                         _minutes(self.global_timeout) + ' minutes'
+            elif stage_limit > 0 and now - stage_start > stage_limit:
+                reason = 'stage "' + str(self.stage) + '" ran longer ' + \
+                         'than ' + _minutes(stage_limit) + ' minutes'
+            elif self.stall_timeout > 0 and \
+                 now - last_progress > self.stall_timeout:
+                reason = 'no progress for ' + \
+                         _minutes(self.stall_timeout) + ' minutes'
+
+            if reason:
+                self.expired = {
+                    'reason': reason,
+                    'stage': self.stage,
+                    'elapsed_minutes': round((now - start) / 60, 1),
+                    'minutes_since_progress':
+                        round((now - last_progress) / 60, 1),
+                    'minutes_in_stage': round((now - stage_start) / 60, 1),
+                    'processes': group_processes(self.process.pid),
+                    'log_tail': tail(self.logs[0], 20),
+                }
+                log.error('Watchdog: ' + reason + ', killing process ' +
+                          'group ' + str(self.process.pid))
+                self.kill()
+                return
+
+    def kill(self, grace=30):
+        """Send SIGTERM then SIGKILL to the whole process group"""
+
+        pgid = self.process.pid  # the process was started in a new session
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(pgid, sig)
+            except ProcessLookupError:
+                return
+            deadline = time.time() + grace
+            while time.time() < deadline:
+                if self.process.poll() is not None and \
+                   not group_processes(pgid):
+                    return
+                time.sleep(0.5)
+
+
+def _minutes(seconds):
+    return '{:g}'.format(round(seconds / 60, 2))
+
+
+# vi:set autoindent ts=4 sw=4 expandtab : See Vim, :help 'modeline'